@@ -0,0 +1,340 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+import concurrency
+import utils
+
+BRICK_SHAPE = (64, 64, 64)
+BRICK_CACHE_SIZE = 512 * 1024 * 1024
+# Maximum number of voxels of the downsampled copy given to the 3D viewers.
+PREVIEW_MAX_VOXELS = 256 ** 3
+HEADER_FILENAME = "header.json"
+BRICKS_FILENAME = "bricks.npy"
+
+def _number_of_bricks(shape: Tuple, brick_shape: Tuple) -> Tuple:
+    return tuple(-(-s // b) for s, b in zip(shape, brick_shape))
+
+def create_brick_store(
+    path: str,
+    slices: Iterable[ndarray],
+    shape: Tuple,
+    dtype,
+    spacing: Tuple = (1.0, 1.0, 1.0),
+    brick_shape: Tuple = BRICK_SHAPE,
+    origin: Tuple = (0.0, 0.0, 0.0),
+) -> None:
+    """
+    Writes a volume of the given shape (dz, dy, dx) to path as fixed size bricks. The
+    volume is given as an iterable of axial slices (or slabs of axial slices), so it
+    never needs to be completely in memory. A numpy array can be given directly.
+    """
+    dtype = np.dtype(dtype)
+    bz, by, bx = brick_shape
+    nbz, nby, nbx = _number_of_bricks(shape, brick_shape)
+    dz, dy, dx = shape
+
+    os.makedirs(path, exist_ok=True)
+    header = {
+        "shape": list(shape),
+        "dtype": dtype.str,
+        "spacing": list(spacing),
+        "brick_shape": list(brick_shape),
+        "origin": list(origin),
+    }
+    with open(os.path.join(path, HEADER_FILENAME), "w") as f:
+        json.dump(header, f)
+
+    bricks = np.lib.format.open_memmap(
+        os.path.join(path, BRICKS_FILENAME),
+        mode="w+",
+        dtype=dtype,
+        shape=(nbz, nby, nbx, bz, by, bx),
+    )
+
+    # One layer of bricks (bz axial slices) is kept in memory while writing.
+    layer = np.zeros((bz, nby * by, nbx * bx), dtype=dtype)
+    z = 0
+    for n_slice in slices:
+        n_slice = np.asarray(n_slice, dtype=dtype)
+        if n_slice.ndim == 2:
+            n_slice = n_slice[np.newaxis]
+        for s in n_slice:
+            layer[z % bz, :dy, :dx] = s
+            z += 1
+            if z % bz == 0 or z == dz:
+                kz = (z - 1) // bz
+                bricks[kz] = layer.reshape(bz, nby, by, nbx, bx).transpose(1, 3, 0, 2, 4)
+                layer[:] = 0
+    bricks.flush()
+    del bricks
+
+class BrickedVolumeBase:
+    """
+    Read only volume divided in bricks of brick_shape voxels. Bricks are kept in a LRU
+    cache limited to cache_size bytes. It supports the slicing used by
+    Slice.get_image_slice, reading only the bricks that are touched (the missing ones
+    in parallel), and prefetches the next layer of bricks in the scroll direction.
+    Subclasses define where the bricks come from in read_brick.
+    """
+    def __init__(
+        self,
+        shape: Tuple,
+        dtype,
+        spacing: Tuple,
+        brick_shape: Tuple,
+        cache_size: int = BRICK_CACHE_SIZE,
+        max_workers: int = None,
+    ) -> None:
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.spacing = tuple(spacing)
+        self.brick_shape = tuple(brick_shape)
+        self.ndim = 3
+
+        self.number_of_bricks = _number_of_bricks(self.shape, self.brick_shape)
+        self.brick_size = int(np.prod(self.brick_shape)) * self.dtype.itemsize
+
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Preview given by set_preview, e.g. read back from a session snapshot.
+        self.preview = None
+
+        # Last slab requested in each axis, used to find the scroll direction.
+        self.last_index = [None, None, None]
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or concurrency.get_threads())
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1)
+
+    def read_brick(self, key: Tuple) -> ndarray:
+        raise NotImplementedError
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    @property
+    def cache_nbytes(self) -> int:
+        return len(self.cache) * self.brick_size
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) -> ndarray:
+        array = self[:, :, :]
+        if dtype is not None:
+            array = array.astype(dtype, copy=False)
+        return array
+
+    def clear_cache(self) -> None:
+        with self.cache_lock:
+            self.cache.clear()
+
+    def get_bricks(self, keys: list) -> dict:
+        """
+        Returns a dict with the bricks of keys. The bricks that are not cached are read
+        in parallel.
+        """
+        bricks = {}
+        missing = []
+        with self.cache_lock:
+            for key in keys:
+                brick = self.cache.get(key)
+                if brick is None:
+                    missing.append(key)
+                else:
+                    self.cache.move_to_end(key)
+                    bricks[key] = brick
+            self.hits += len(bricks)
+            self.misses += len(missing)
+
+        if len(missing) == 1:
+            bricks[missing[0]] = self.read_brick(missing[0])
+        elif missing:
+            bricks.update(zip(missing, self.executor.map(self.read_brick, missing)))
+        for key in missing:
+            self.__store_brick(key, bricks[key])
+        return bricks
+
+    def get_brick(self, key: Tuple) -> ndarray:
+        return self.get_bricks([key])[key]
+
+    def __store_brick(self, key: Tuple, brick: ndarray) -> None:
+        with self.cache_lock:
+            if key in self.cache:
+                return
+            while self.cache and self.cache_nbytes + self.brick_size > self.cache_size:
+                self.cache.popitem(last=False)
+            if self.brick_size <= self.cache_size:
+                self.cache[key] = brick
+
+    def __prefetch(self, keys: Iterable[Tuple]) -> None:
+        for key in keys:
+            with self.cache_lock:
+                if key in self.cache:
+                    continue
+            self.__store_brick(key, self.read_brick(key))
+
+    def __getitem__(self, item) -> ndarray:
+        ranges, squeeze = utils.get_index_ranges(item, self.shape)
+        (z0, z1), (y0, y1), (x0, x1) = ranges
+        bz, by, bx = self.brick_shape
+        output = np.empty((z1 - z0, y1 - y0, x1 - x0), dtype=self.dtype)
+
+        keys = [
+            (kz, ky, kx)
+            for kz in range(z0 // bz, -(-z1 // bz))
+            for ky in range(y0 // by, -(-y1 // by))
+            for kx in range(x0 // bx, -(-x1 // bx))
+        ]
+        bricks = self.get_bricks(keys)
+
+        for (kz, ky, kx), brick in bricks.items():
+            sz0 = max(z0, kz * bz)
+            sz1 = min(z1, (kz + 1) * bz)
+            sy0 = max(y0, ky * by)
+            sy1 = min(y1, (ky + 1) * by)
+            sx0 = max(x0, kx * bx)
+            sx1 = min(x1, (kx + 1) * bx)
+            output[sz0 - z0 : sz1 - z0, sy0 - y0 : sy1 - y0, sx0 - x0 : sx1 - x0] = brick[
+                sz0 - kz * bz : sz1 - kz * bz,
+                sy0 - ky * by : sy1 - ky * by,
+                sx0 - kx * bx : sx1 - kx * bx,
+            ]
+
+        self.__schedule_prefetch(ranges)
+        if squeeze:
+            output = output.squeeze(axis=squeeze)
+        return output
+
+    def __schedule_prefetch(self, ranges: list) -> None:
+        # A slab is a request that spans the whole volume in two axes, as the slices of
+        # each orientation do. The layer of bricks after it in the scroll direction is
+        # read in background.
+        full = [r == (0, s) for r, s in zip(ranges, self.shape)]
+        if sum(full) != 2:
+            return
+        axis = full.index(False)
+        start = ranges[axis][0]
+        last = self.last_index[axis]
+        self.last_index[axis] = start
+        if last is None or last == start:
+            return
+
+        direction = 1 if start > last else -1
+        size = self.brick_shape[axis]
+        k = start // size + direction
+        if not 0 <= k < self.number_of_bricks[axis]:
+            return
+
+        keys = []
+        nbz, nby, nbx = self.number_of_bricks
+        for kz in range(nbz):
+            for ky in range(nby):
+                for kx in range(nbx):
+                    if (kz, ky, kx)[axis] == k:
+                        keys.append((kz, ky, kx))
+        self.prefetch_executor.submit(self.__prefetch, keys)
+
+    def downsample(self, step: int) -> ndarray:
+        """
+        Returns the volume sampled every step voxels in each axis. The bricks are read
+        directly, without going through the cache.
+        """
+        bz, by, bx = self.brick_shape
+        shape = tuple(-(-s // step) for s in self.shape)
+        output = np.empty(shape, dtype=self.dtype)
+        nbz, nby, nbx = self.number_of_bricks
+        dz, dy, dx = self.shape
+        for kz in range(nbz):
+            # First voxel of the brick that is a multiple of step.
+            oz = -(kz * bz) % step
+            for ky in range(nby):
+                oy = -(ky * by) % step
+                for kx in range(nbx):
+                    ox = -(kx * bx) % step
+                    brick = self.read_brick((kz, ky, kx))
+                    sub = brick[
+                        oz : min(bz, dz - kz * bz) : step,
+                        oy : min(by, dy - ky * by) : step,
+                        ox : min(bx, dx - kx * bx) : step,
+                    ]
+                    z = (kz * bz + oz) // step
+                    y = (ky * by + oy) // step
+                    x = (kx * bx + ox) // step
+                    output[z : z + sub.shape[0], y : y + sub.shape[1], x : x + sub.shape[2]] = sub
+        return output
+
+    def get_preview(self, max_voxels: int = PREVIEW_MAX_VOXELS) -> Tuple[ndarray, Tuple]:
+        """
+        Returns the smallest downsampling of the volume with at most max_voxels voxels
+        and its spacing. It reads every brick, so it is kept for the next calls.
+        """
+        if self.preview is not None:
+            return self.preview
+        step = 1
+        while np.prod([-(-s // step) for s in self.shape]) > max_voxels:
+            step += 1
+        spacing = tuple(s * step for s in self.spacing)
+        self.preview = (self.downsample(step), spacing)
+        return self.preview
+
+    def set_preview(self, matrix: ndarray, spacing: Tuple) -> None:
+        self.preview = (matrix, tuple(spacing))
+
+    def close(self) -> None:
+        self.prefetch_executor.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
+        self.clear_cache()
+
+class BrickedVolume(BrickedVolumeBase):
+    """
+    Bricked volume stored on disk by create_brick_store and read through mmap.
+    """
+    def __init__(self, path: str, cache_size: int = BRICK_CACHE_SIZE, max_workers: int = None) -> None:
+        with open(os.path.join(path, HEADER_FILENAME)) as f:
+            header = json.load(f)
+
+        BrickedVolumeBase.__init__(
+            self,
+            header["shape"],
+            header["dtype"],
+            header["spacing"],
+            header["brick_shape"],
+            cache_size,
+            max_workers,
+        )
+        self.path = path
+        # Patient position of the first voxel; stores written without it are at 0.
+        self.origin = tuple(header.get("origin", (0.0, 0.0, 0.0)))
+        self.bricks = np.load(os.path.join(path, BRICKS_FILENAME), mmap_mode="r")
+        self.mtime = self.__get_mtime()
+
+    def __get_mtime(self) -> int:
+        return os.stat(os.path.join(self.path, BRICKS_FILENAME)).st_mtime_ns
+
+    def read_brick(self, key: Tuple) -> ndarray:
+        return np.array(self.bricks[key])
+
+    def get_preview(self, max_voxels: int = PREVIEW_MAX_VOXELS) -> Tuple[ndarray, Tuple]:
+        # A store written again by create_brick_store (with the same shape) is mapped
+        # again, and its cached bricks and preview are dropped.
+        mtime = self.__get_mtime()
+        if mtime != self.mtime:
+            self.bricks = np.load(os.path.join(self.path, BRICKS_FILENAME), mmap_mode="r")
+            self.mtime = mtime
+            self.clear_cache()
+            self.preview = None
+        return BrickedVolumeBase.get_preview(self, max_voxels)
+
+    def close(self) -> None:
+        BrickedVolumeBase.close(self)
+        self.bricks = None
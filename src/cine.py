@@ -0,0 +1,190 @@
+import collections
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from vtkmodules.vtkRenderingCore import vtkRenderWindowInteractor
+from numpy import ndarray
+from pubsub import pub as Publisher
+
+import constants as const
+from events import Event
+from vtk_utils import TextZero
+
+class CinePlayer:
+    """
+    Plays the slices of an orientation in a loop at a target frame rate, driven by a
+    repeating timer of the interactor of the view. The slice to show is given by the
+    time since the start, so when a slice is not extracted yet the player keeps the
+    last one and moves on, dropping frames instead of stalling. The next slices are
+    extracted ahead of time by a thread.
+    """
+    def __init__(self, viewer, orientation: str, fps: int = const.CINE_FPS) -> None:
+        self.viewer = viewer
+        self.slice = viewer.slice
+        self.orientation = orientation
+        self.fps = fps
+        self.interactor = viewer.GetInteractor(orientation)
+        self.text_batch = viewer.text_batches[orientation]
+
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Extraction futures of the slices ahead, keyed by slice number.
+        self.prefetched = {}
+        # Times the last frames were shown, to measure the achieved frame rate.
+        self.frame_times = collections.deque()
+        self.dropped = 0
+
+        self.timer_id = None
+        self.observer = None
+        self.text = None
+        self.label = "Cine"
+        self.text_position = const.TEXT_POS_CINE
+
+    def GetStartPosition(self) -> int:
+        return self.viewer.GetScrollPosition(self.orientation)
+
+    def GetNumberOfFrames(self) -> int:
+        return self.slice.GetNumberOfSlices(self.orientation)
+
+    def Start(self) -> None:
+        self.position = self.GetStartPosition()
+        self.start_position = self.position
+        self.start_time = time.perf_counter()
+        self.last_update_3d = self.start_time
+        self.Prefetch()
+
+        text = TextZero()
+        text.SetSize(const.TEXT_SIZE_SMALL)
+        text.SetPosition(self.text_position)
+        text.property.SetJustificationToRight()
+        text.actor.GetTextProperty().ShallowCopy(text.property)
+        self.text_batch.Add(text)
+        self.text = text
+
+        self.observer = self.interactor.AddObserver("TimerEvent", self.OnTimer)
+        # The timer runs at twice the frame rate, so the frames are shown on time
+        # despite the jitter of the timer.
+        self.timer_id = self.interactor.CreateRepeatingTimer(max(1, int(500 / self.fps)))
+
+    def Stop(self) -> None:
+        if self.timer_id is not None:
+            self.interactor.DestroyTimer(self.timer_id)
+            self.interactor.RemoveObserver(self.observer)
+            self.timer_id = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.prefetched = {}
+        if self.text is not None:
+            self.text_batch.Remove(self.text)
+            self.text = None
+        self.Update3D()
+        self.viewer.UpdateRender()
+
+    def SetFps(self, fps: int) -> None:
+        fps = min(max(fps, const.CINE_MIN_FPS), const.CINE_MAX_FPS)
+        if fps == self.fps:
+            return
+        # Restarts the pacing from the slice shown.
+        self.fps = fps
+        self.start_position = self.position
+        self.start_time = time.perf_counter()
+        self.frame_times.clear()
+        if self.timer_id is not None:
+            self.interactor.DestroyTimer(self.timer_id)
+            self.timer_id = self.interactor.CreateRepeatingTimer(max(1, int(500 / self.fps)))
+
+    def GetSliceNumber(self, position: int) -> int:
+        return position % self.GetNumberOfFrames()
+
+    def Prefetch(self) -> None:
+        numbers = [self.GetSliceNumber(self.position + i) for i in range(1, const.CINE_PREFETCH + 1)]
+        # The slices left behind are dropped.
+        for number in list(self.prefetched):
+            if number not in numbers:
+                self.prefetched.pop(number).cancel()
+        for number in numbers:
+            if number not in self.prefetched:
+                self.prefetched[number] = self.executor.submit(self.slice.extract_image_slice, self.orientation, number)
+
+    def IsReady(self, number: int) -> bool:
+        return self.GetReadySlice(number) is not None
+
+    def GetReadySlice(self, number: int) -> ndarray:
+        future = self.prefetched.get(number)
+        if future is None or not future.done() or future.cancelled() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def OnTimer(self, obj: vtkRenderWindowInteractor, event: str) -> None:
+        if obj.GetTimerEventId() != self.timer_id:
+            return
+        now = time.perf_counter()
+        target = self.start_position + int((now - self.start_time) * self.fps)
+        if target <= self.position:
+            return
+
+        # Shows the target slice, or the most advanced one extracted before it.
+        for position in range(target, self.position, -1):
+            if self.IsReady(self.GetSliceNumber(position)):
+                break
+        else:
+            self.Prefetch()
+            return
+
+        self.dropped += position - self.position - 1
+        self.position = position
+
+        self.frame_times.append(now)
+        while now - self.frame_times[0] > 1.0:
+            self.frame_times.popleft()
+        span = now - self.frame_times[0]
+        achieved = (len(self.frame_times) - 1) / span if span > 0 else 0.0
+        self.text.SetValue("%s %.1f / %d fps, %d dropped" % (self.label, achieved, self.fps, self.dropped))
+
+        # The 3D plane and the other views follow at a lower rate.
+        update_3d = now - self.last_update_3d >= 1.0 / const.CINE_3D_FPS
+        if update_3d:
+            self.last_update_3d = now
+        self.ShowFrame(self.GetSliceNumber(position), update_3d)
+        self.Prefetch()
+
+    def ShowFrame(self, number: int, update_3d: bool) -> None:
+        self.slice.SetBufferImage(self.orientation, number, self.GetReadySlice(number))
+        self.viewer.SetScrollPosition(self.orientation, number)
+        if update_3d:
+            self.Update3D()
+            self.viewer.UpdateRender()
+        else:
+            self.viewer.RenderView(self.orientation)
+
+    def Update3D(self) -> None:
+        self.viewer.bus.Send(Event.UPDATE_SLICE_3D, orientations=[self.orientation])
+        self.viewer.bus.Send(Event.UPDATE_VOLUME)
+
+class PhaseCinePlayer(CinePlayer):
+    """
+    Plays the phases of a 4D volume in a loop in the MPR and 3D viewers. A phase is
+    ready when the slices shown in every orientation were prefetched in it.
+    """
+    def __init__(self, viewer, fps: int = const.PHASE_CINE_FPS) -> None:
+        CinePlayer.__init__(self, viewer, "AXIAL", fps)
+        self.label = "Phase cine"
+        self.text_position = const.TEXT_POS_PHASE_CINE
+
+    def GetStartPosition(self) -> int:
+        return self.slice.phase
+
+    def GetNumberOfFrames(self) -> int:
+        return self.slice.GetNumberOfPhases()
+
+    def Prefetch(self) -> None:
+        # The slice viewer prefetches the neighbouring phases of the slices it shows.
+        pass
+
+    def IsReady(self, number: int) -> bool:
+        return self.slice.IsPhaseReady(number)
+
+    def ShowFrame(self, number: int, update_3d: bool) -> None:
+        Publisher.sendMessage(self.viewer.Topic("Set phase"), phase=number, update_3d=update_3d)
+
+    def Update3D(self) -> None:
+        self.viewer.bus.Send(Event.UPDATE_SLICE_3D, orientations=["AXIAL", "CORONAL", "SAGITAL"])
+        self.viewer.bus.Send(Event.UPDATE_VOLUME)
@@ -0,0 +1,321 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from argparse import SUPPRESS, ArgumentParser, ArgumentTypeError
+from typing import Callable, Dict, List
+
+THREADS_VARIABLE = "MPR_THREADS"
+SMP_BACKEND_VARIABLE = "MPR_SMP_BACKEND"
+SETTINGS_VARIABLE = "MPR_CONCURRENCY_FILE"
+# Settings of the machine written by the autotune.
+SETTINGS_FILENAME = os.path.join(os.path.expanduser("~"), ".mpr_viewer", "concurrency.json")
+# Thread limits of the BLAS and OpenMP libraries NumPy may be linked with. They are
+# read when the libraries are loaded, and inherited by the worker processes.
+BLAS_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+# The Sequential backend of vtkSMPTools ignores the thread count.
+DEFAULT_SMP_BACKEND = "STDThread"
+# The autotune keeps the fewest threads within this fraction of the fastest time, so
+# the instances sharing a host do not take cores for a marginal gain.
+AUTOTUNE_TOLERANCE = 0.1
+
+# Resolved by configure, or on first use from the environment and the settings file.
+_settings = {"threads": None, "smp_backend": None}
+
+def get_settings_path() -> str:
+    return os.environ.get(SETTINGS_VARIABLE) or SETTINGS_FILENAME
+
+def load_settings(path: str = None) -> Dict:
+    try:
+        with open(path or get_settings_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_settings(settings: Dict, path: str = None) -> None:
+    path = path or get_settings_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(settings, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def parse_threads(value: str):
+    """
+    Type of the --threads options: "auto" or a positive thread count.
+    """
+    if value == "auto":
+        return value
+    try:
+        threads = int(value)
+    except ValueError:
+        threads = 0
+    if threads < 1:
+        raise ArgumentTypeError("expected auto or a positive number of threads, not %r" % value)
+    return threads
+
+def _as_threads(value):
+    # A thread count or "auto"; None if the value is not given or not valid.
+    if value is None or value == "":
+        return None
+    try:
+        return parse_threads(str(value))
+    except ArgumentTypeError:
+        return None
+
+def get_configured_threads(threads=None):
+    """
+    Thread count given to the application: threads (the --threads option), else the
+    MPR_THREADS variable, else the autotuned setting of the machine; None if none was
+    given. "auto" skips to the autotuned setting, and invalid values are ignored.
+    """
+    threads = _as_threads(threads)
+    if threads is None:
+        threads = _as_threads(os.environ.get(THREADS_VARIABLE))
+    if threads is None or threads == "auto":
+        threads = _as_threads(load_settings().get("threads"))
+    if threads == "auto":
+        return None
+    return threads
+
+def resolve_threads(threads=None) -> int:
+    # The configured thread count, else the number of cores.
+    configured = get_configured_threads(threads)
+    return configured if configured is not None else os.cpu_count() or 1
+
+def resolve_smp_backend(smp_backend: str = None) -> str:
+    return (
+        smp_backend
+        or os.environ.get(SMP_BACKEND_VARIABLE)
+        or load_settings().get("smp_backend")
+        or DEFAULT_SMP_BACKEND
+    )
+
+def peek_threads(argv: List[str]):
+    # --threads, before the parser of the application runs; None if it is not valid,
+    # which that parser then reports.
+    parser = ArgumentParser(add_help=False)
+    parser.add_argument("--threads", type=str, default=None)
+    return _as_threads(parser.parse_known_args(argv)[0].threads)
+
+def set_blas_threads(threads: int) -> None:
+    """
+    Limits the BLAS libraries to threads. Only effective before NumPy is imported, and
+    for the processes started after. The limits already in the environment are kept.
+    """
+    for name in BLAS_VARIABLES:
+        os.environ.setdefault(name, str(threads))
+
+def configure(threads=None, smp_backend: str = None) -> Dict:
+    """
+    Applies one thread count to the VTK SMP backend, the multi-threaded VTK filters and
+    the CPU ray cast mapper created after, the BLAS libraries of the worker processes
+    (if a thread count was configured) and the thread pools of the application (see
+    get_threads). Returns the settings.
+    """
+    from vtkmodules.vtkCommonCore import vtkMultiThreader, vtkSMPTools
+
+    configured = get_configured_threads(threads)
+    threads = resolve_threads(threads)
+    smp_backend = resolve_smp_backend(smp_backend)
+    _settings["threads"] = threads
+    _settings["smp_backend"] = smp_backend
+    if configured is not None:
+        set_blas_threads(configured)
+    # A backend this VTK was not built with falls back to another one.
+    vtkSMPTools.SetBackend(smp_backend)
+    vtkSMPTools.Initialize(threads)
+    vtkMultiThreader.SetGlobalDefaultNumberOfThreads(threads)
+    vtkMultiThreader.SetGlobalMaximumNumberOfThreads(threads)
+    return {"threads": threads, "smp_backend": vtkSMPTools.GetBackend()}
+
+def get_threads() -> int:
+    """
+    Workers of the thread and process pools of the application.
+    """
+    if _settings["threads"] is None:
+        _settings["threads"] = resolve_threads()
+    return _settings["threads"]
+
+def get_workloads(volume, render: bool) -> Dict[str, Callable[[], None]]:
+    """
+    The multi-threaded workloads of the viewer on volume: our thread pools, a VTK
+    image filter and, if render, CPU ray casting in an offscreen window.
+    """
+    from vtkmodules.vtkImagingGeneral import vtkImageGaussianSmooth
+
+    import converters
+    import resample
+
+    image = converters.to_vtk(volume, (1.0, 1.0, 1.0))
+    offset, scale = converters.get_quantization(-1000, 3071, "uint16")
+    workloads = {
+        "quantize": lambda: converters.quantize_volume(volume, offset, scale, "uint16"),
+        "resample": lambda: resample.resample_volume(volume, (1.0, 1.0, 1.0), (0.75, 0.75, 0.75)),
+    }
+
+    smooth = vtkImageGaussianSmooth()
+    smooth.SetInputData(image)
+    smooth.SetDimensionality(3)
+
+    def run_smooth():
+        smooth.Modified()
+        smooth.Update()
+
+    workloads["vtk_filter"] = run_smooth
+
+    if render:
+        from vtkmodules.vtkRenderingCore import vtkRenderer, vtkVolume, vtkVolumeProperty
+
+        import presets
+        from vtk_utils import create_volume_mapper, vtkRenderWindow
+
+        preset = presets.analyse_preset(presets.PRESETS[presets.DEFAULT_PRESET])
+        volume_properties = vtkVolumeProperty()
+        presets.fill_transfer_function(
+            preset,
+            volume_properties.GetRGBTransferFunction(),
+            volume_properties.GetScalarOpacity(),
+            volume_properties.GetGradientOpacity(),
+        )
+        presets.apply_lighting(preset, volume_properties)
+        volume_properties.SetInterpolationTypeToLinear()
+        # The mapper takes its thread count when it is created, so one is made per run.
+        state = {}
+        render_window = vtkRenderWindow()
+        render_window.SetOffScreenRendering(1)
+        render_window.SetSize(512, 512)
+        renderer = vtkRenderer()
+        render_window.AddRenderer(renderer)
+
+        def run_render():
+            if state.get("threads") != get_threads():
+                renderer.RemoveAllViewProps()
+                mapper = create_volume_mapper("CPU")
+                mapper.SetInputData(image)
+                prop = vtkVolume()
+                prop.SetMapper(mapper)
+                prop.SetProperty(volume_properties)
+                renderer.AddVolume(prop)
+                renderer.ResetCamera()
+                state["threads"] = get_threads()
+            renderer.GetActiveCamera().Azimuth(10)
+            render_window.Render()
+
+        workloads["render"] = run_render
+    return workloads
+
+def measure(threads: int, shape, repeat: int = 3, render: bool = True, smp_backend: str = None) -> Dict:
+    """
+    Times the workloads at threads (the best of repeat runs) and returns the timings
+    with the SMP backend in use.
+    """
+    from vtkmodules.vtkCommonCore import vtkSMPTools
+
+    from phantom import make_volume
+
+    configure(threads, smp_backend)
+    workloads = get_workloads(make_volume(shape), render)
+    timings = {}
+    for name, workload in workloads.items():
+        # The first run warms up the caches and the thread pools.
+        workload()
+        samples = []
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            workload()
+            samples.append((time.perf_counter() - t0) * 1000)
+        timings[name] = min(samples)
+    timings["total"] = sum(timings.values())
+    return {"timings_ms": timings, "smp_backend": vtkSMPTools.GetBackend()}
+
+def autotune(candidates: List[int], shape, repeat: int = 3, render: bool = True, smp_backend: str = None) -> Dict:
+    """
+    Measures each candidate thread count and returns the settings of the fewest
+    threads within AUTOTUNE_TOLERANCE of the fastest total, with the timings. Each
+    candidate runs in its own process: the BLAS libraries take their thread limit
+    when NumPy loads them.
+    """
+    timings = {}
+    smp_backends = set()
+    for threads in candidates:
+        env = dict(os.environ)
+        env.update({name: str(threads) for name in BLAS_VARIABLES})
+        env[THREADS_VARIABLE] = str(threads)
+        command = [
+            sys.executable, os.path.abspath(__file__),
+            "--measure", str(threads),
+            "--shape", ",".join(str(i) for i in shape),
+            "--repeat", str(repeat),
+        ]
+        if not render:
+            command.append("--no-render")
+        if smp_backend:
+            command += ["--smp-backend", smp_backend]
+        output = subprocess.run(command, env=env, stdout=subprocess.PIPE, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings[threads] = result["timings_ms"]
+        smp_backends.add(result["smp_backend"])
+        print(
+            "%3d threads: %s"
+            % (threads, ", ".join("%s %.1f ms" % (name, ms) for name, ms in timings[threads].items())),
+            flush=True,
+        )
+
+    fastest = min(timing["total"] for timing in timings.values())
+    threads = min(t for t, timing in timings.items() if timing["total"] <= fastest * (1 + AUTOTUNE_TOLERANCE))
+    return {
+        "threads": threads,
+        # The backend VTK used, which differs from the one asked for if this VTK was
+        # not built with it.
+        "smp_backend": smp_backends.pop(),
+        "machine": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "shape": list(shape),
+        "time": time.time(),
+        "timings_ms": {str(t): timing for t, timing in timings.items()},
+    }
+
+def get_candidates(cpu_count: int) -> List[int]:
+    # Powers of two up to the number of cores, and the number of cores.
+    candidates = []
+    threads = 1
+    while threads < cpu_count:
+        candidates.append(threads)
+        threads *= 2
+    return candidates + [cpu_count]
+
+def main():
+    parser = ArgumentParser("Autotune")
+    parser.add_argument("--threads", type=str, default=None, help="Comma separated thread counts to try (default powers of two up to the cores)")
+    parser.add_argument("--smp-backend", type=str, default=None, help="VTK SMP backend (STDThread, TBB, OpenMP, Sequential)")
+    parser.add_argument("--shape", type=str, default="128,512,512", help="Synthetic volume shape dz,dy,dx")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-render", action="store_true", help="Skip the ray casting workload")
+    parser.add_argument("--output", type=str, default=None, help="Settings file (default %s or $%s)" % (SETTINGS_FILENAME, SETTINGS_VARIABLE))
+    # One candidate, in the process started by autotune.
+    parser.add_argument("--measure", type=int, default=None, help=SUPPRESS)
+    args = parser.parse_args()
+    shape = tuple(int(i) for i in args.shape.split(","))
+
+    if args.measure is not None:
+        print(json.dumps(measure(args.measure, shape, args.repeat, not args.no_render, args.smp_backend)))
+        return
+
+    if args.threads:
+        candidates = sorted({int(i) for i in args.threads.split(",")})
+    else:
+        candidates = get_candidates(os.cpu_count() or 1)
+    settings = autotune(candidates, shape, args.repeat, not args.no_render, args.smp_backend)
+    save_settings(settings, args.output)
+    print("%d threads (%s) saved to %s" % (settings["threads"], settings["smp_backend"], args.output or get_settings_path()))
+
+if __name__ == "__main__":
+    main()
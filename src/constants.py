@@ -78,3 +78,58 @@ TEXT_POS_VCENTRE_LEFT = (X, 0.5)  # SetVerticalJustificationToCentered
 # ------------------------------------------------------------------
 
 SLICE_STATE_CROSS = 3006
+SLICE_STATE_ROI_RECTANGLE = 3007
+SLICE_STATE_ROI_ELLIPSE = 3008
+SLICE_STATE_LINE_PROFILE = 3009
+
+# Keyboard shortcuts to change the interaction style of the slice viewers
+SLICE_STATE_SHORTCUTS = {
+    "1": SLICE_STATE_CROSS,
+    "2": SLICE_STATE_ROI_RECTANGLE,
+    "3": SLICE_STATE_ROI_ELLIPSE,
+    "4": SLICE_STATE_LINE_PROFILE,
+}
+
+# ROI measures
+ROI_COLOUR = (1, 1, 0)
+ROI_ELLIPSE_RESOLUTION = 64
+TEXT_POS_LEFT_DOWN_ROI = (X, 0.2)
+
+# Instrumentation overlay
+INSTRUMENTATION_OVERLAY_KEY = "i"
+TEXT_POS_INSTRUMENTATION = (X, 0.9)
+
+# Cine playback
+CINE_KEY = "c"
+CINE_FASTER_KEYS = ("plus", "equal", "KP_Add")
+CINE_SLOWER_KEYS = ("minus", "KP_Subtract")
+CINE_FPS = 15
+CINE_FPS_STEP = 5
+CINE_MIN_FPS = 1
+CINE_MAX_FPS = 60
+# Rate of the updates of the 3D plane widget and of the other slice views
+CINE_3D_FPS = 5
+# Slices extracted ahead of the one shown
+CINE_PREFETCH = 8
+TEXT_POS_CINE = (1 - X, Y)  # SetJustificationToRight
+
+# 4D volumes
+PHASE_CINE_KEY = "p"
+PHASE_NEXT_KEY = "bracketright"
+PHASE_PREVIOUS_KEY = "bracketleft"
+PHASE_CINE_FPS = 10
+# Phases prefetched on each side of the one shown
+PHASE_PREFETCH = 2
+TEXT_POS_PHASE = (1 - X, 0.08)  # SetJustificationToRight
+TEXT_POS_PHASE_CINE = (1 - X, 0.92)  # SetJustificationToRight
+
+# Fusion of a secondary volume over the slices
+FUSION_OPACITY_MORE_KEY = "o"
+FUSION_OPACITY_LESS_KEY = "O"
+FUSION_OPACITY_STEP = 0.1
+
+# Transfer function presets of the 3D view
+PRESET_NEXT_KEY = "v"
+PRESET_PREVIOUS_KEY = "V"
+# Live edits of the transfer function are merged and applied at most this often
+TRANSFER_FUNCTION_EDIT_MS = 30
@@ -1,6 +1,21 @@
-import vtk
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+import numpy as np
+from numpy import ndarray
+from vtkmodules.vtkCommonDataModel import vtkImageData, vtkPiecewiseFunction
+from vtkmodules.vtkRenderingCore import vtkColorTransferFunction
 from vtkmodules.util import numpy_support
 
+import concurrency
+import instrumentation
+
+# Compact scalar types of the render volume of the ray casters.
+RENDER_DTYPES = ("uint8", "uint16")
+# Axial slices quantised by each task; bounds the float32 temporary of a worker.
+QUANTIZE_CHUNK_SIZE = 16
+
+@instrumentation.timed("to_vtk")
 def to_vtk(
     n_array,
     spacing=(1.0, 1.0, 1.0),
@@ -8,7 +23,7 @@ def to_vtk(
     orientation="AXIAL",
     origin=(0, 0, 0),
     padding=(0, 0, 0),
-) -> vtk.vtkImageData:
+) -> vtkImageData:
     if orientation == "SAGITTAL":
         orientation = "SAGITAL"
 
@@ -53,7 +68,7 @@ def to_vtk(
         )
 
     # Generating the vtkImageData
-    image = vtk.vtkImageData()
+    image = vtkImageData()
     image.SetOrigin(origin)
     image.SetSpacing(spacing)
     image.SetDimensions(dx, dy, dz)
@@ -62,3 +77,87 @@ def to_vtk(
     image.GetPointData().SetScalars(v_image)
 
     return image
+
+def get_transfer_function_range(scalar_color: vtkColorTransferFunction, scalar_opacity: vtkPiecewiseFunction) -> Tuple[float, float]:
+    # The functions are constant outside of their points, so the values beyond the
+    # range render the same as its ends.
+    color_range = scalar_color.GetRange()
+    opacity_range = scalar_opacity.GetRange()
+    return min(color_range[0], opacity_range[0]), max(color_range[1], opacity_range[1])
+
+def get_quantization(lower: float, upper: float, dtype: str) -> Tuple[float, float]:
+    """
+    Returns the (offset, scale) mapping [lower, upper] to the whole range of dtype:
+    q = (value - offset) * scale.
+    """
+    max_value = np.iinfo(dtype).max
+    return float(lower), max_value / max(upper - lower, 1e-6)
+
+def is_in_quantized_range(lower: float, upper: float, offset: float, scale: float, dtype: str) -> bool:
+    # The values of [lower, upper] are all represented by the quantisation.
+    return offset <= lower and upper <= offset + np.iinfo(dtype).max / scale * (1 + 1e-9)
+
+def _quantize_chunk(n_array, output, z_start, z_end, offset, scale, max_value) -> None:
+    chunk = n_array[z_start:z_end].astype(np.float32)
+    chunk -= offset
+    chunk *= scale
+    # Rounded by the truncation of the cast.
+    chunk += 0.5
+    np.clip(chunk, 0, max_value, out=chunk)
+    output[z_start:z_end] = chunk
+
+@instrumentation.timed("quantize")
+def quantize_volume(
+    n_array: ndarray,
+    offset: float,
+    scale: float,
+    dtype: str,
+    chunk_size: int = QUANTIZE_CHUNK_SIZE,
+    max_workers: int = None,
+) -> ndarray:
+    """
+    Maps the volume n_array (dz, dy, dx) to dtype with (value - offset) * scale,
+    clamped to the range of dtype, in chunks of axial slices on a thread pool.
+    """
+    if max_workers is None:
+        max_workers = concurrency.get_threads()
+    output = np.empty(n_array.shape, dtype=dtype)
+    max_value = np.iinfo(dtype).max
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_quantize_chunk, n_array, output, z, min(z + chunk_size, len(n_array)), offset, scale, max_value)
+            for z in range(0, len(n_array), chunk_size)
+        ]
+        for future in futures:
+            # Re-raise any exception raised inside the workers.
+            future.result()
+    return output
+
+def rescale_transfer_function(
+    scalar_color: vtkColorTransferFunction,
+    scalar_opacity: vtkPiecewiseFunction,
+    gradient_opacity: vtkPiecewiseFunction,
+    offset: float,
+    scale: float,
+) -> Tuple[vtkColorTransferFunction, vtkPiecewiseFunction, vtkPiecewiseFunction]:
+    """
+    Returns copies of the transfer functions for a volume quantised with offset and
+    scale. The gradient magnitudes are only scaled.
+    """
+    color = vtkColorTransferFunction()
+    node = [0.0] * 6
+    for i in range(scalar_color.GetSize()):
+        scalar_color.GetNodeValue(i, node)
+        x, r, g, b, midpoint, sharpness = node
+        color.AddRGBPoint((x - offset) * scale, r, g, b, midpoint, sharpness)
+
+    functions = []
+    for function, function_offset in ((scalar_opacity, offset), (gradient_opacity, 0.0)):
+        rescaled = vtkPiecewiseFunction()
+        node = [0.0] * 4
+        for i in range(function.GetSize()):
+            function.GetNodeValue(i, node)
+            x, value, midpoint, sharpness = node
+            rescaled.AddPoint((x - function_offset) * scale, value, midpoint, sharpness)
+        functions.append(rescaled)
+    return color, functions[0], functions[1]
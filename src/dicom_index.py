@@ -0,0 +1,409 @@
+import os
+import sqlite3
+import struct
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy import ndarray
+from vtkmodules.vtkIOImage import vtkDICOMImageReader
+from vtkmodules.util.numpy_support import vtk_to_numpy
+
+import concurrency
+
+CATALOGUE_FILENAME = "series.db"
+# Files parsed by a task of the pool.
+SCAN_CHUNK_SIZE = 64
+
+IMPLICIT_VR_LITTLE_ENDIAN = "1.2.840.10008.1.2"
+EXPLICIT_VR_BIG_ENDIAN = "1.2.840.10008.1.2.2"
+DEFLATED_EXPLICIT_VR_LITTLE_ENDIAN = "1.2.840.10008.1.2.1.99"
+
+TRANSFER_SYNTAX_UID = 0x00020010
+ITEM = 0xFFFEE000
+ITEM_DELIMITATION = 0xFFFEE00D
+SEQUENCE_DELIMITATION = 0xFFFEE0DD
+UNDEFINED_LENGTH = 0xFFFFFFFF
+# Explicit VRs with a 4 bytes length.
+LONG_VRS = {"OB", "OD", "OF", "OL", "OV", "OW", "SQ", "SV", "UC", "UN", "UR", "UT", "UV"}
+
+# Attributes stored in the catalogue: tag -> (column, VR).
+HEADER_TAGS = {
+    0x00080018: ("sop_uid", "UI"),
+    0x00080020: ("study_date", "DA"),
+    0x00080060: ("modality", "CS"),
+    0x0008103E: ("series_description", "LO"),
+    0x00100010: ("patient_name", "PN"),
+    0x00100020: ("patient_id", "LO"),
+    0x00180050: ("slice_thickness", "DS"),
+    0x0020000D: ("study_uid", "UI"),
+    0x0020000E: ("series_uid", "UI"),
+    0x00200013: ("instance_number", "IS"),
+    0x00200032: ("position", "DS"),
+    0x00200037: ("orientation", "DS"),
+    0x00280010: ("rows", "US"),
+    0x00280011: ("columns", "US"),
+    0x00280030: ("pixel_spacing", "DS"),
+}
+# Parsing stops at the first attribute after the last one needed, long before the
+# pixel data.
+LAST_HEADER_TAG = max(HEADER_TAGS)
+
+class _Reader:
+    """
+    Reads the data elements of a DICOM file, without reading their values.
+    """
+    def __init__(self, f, explicit: bool = True, little: bool = True) -> None:
+        self.f = f
+        self.SetTransferSyntax(explicit, little)
+
+    def SetTransferSyntax(self, explicit: bool, little: bool) -> None:
+        self.explicit = explicit
+        self.endian = "<" if little else ">"
+
+    def ReadElement(self) -> Tuple[int, str, int]:
+        header = self.f.read(8)
+        if len(header) < 8:
+            return None
+        group, element = struct.unpack(self.endian + "HH", header[:4])
+        tag = (group << 16) | element
+        if group == 0xFFFE:
+            # Items and delimiters have no VR.
+            return tag, None, struct.unpack(self.endian + "I", header[4:])[0]
+        if self.explicit:
+            vr = header[4:6].decode("latin-1")
+            if vr in LONG_VRS:
+                return tag, vr, struct.unpack(self.endian + "I", self.f.read(4))[0]
+            return tag, vr, struct.unpack(self.endian + "H", header[6:])[0]
+        return tag, None, struct.unpack(self.endian + "I", header[4:])[0]
+
+    def Skip(self, length: int) -> None:
+        self.f.seek(length, os.SEEK_CUR)
+
+    def SkipUndefinedLength(self) -> None:
+        """
+        Skips the items of a sequence (or of encapsulated pixel data) up to its
+        delimiter, recursing into the nested sequences of undefined length.
+        """
+        while True:
+            element = self.ReadElement()
+            if element is None or element[0] == SEQUENCE_DELIMITATION:
+                return
+            tag, vr, length = element
+            if tag == ITEM and length == UNDEFINED_LENGTH:
+                self.SkipItem()
+            elif length != UNDEFINED_LENGTH:
+                self.Skip(length)
+
+    def SkipItem(self) -> None:
+        while True:
+            element = self.ReadElement()
+            if element is None or element[0] == ITEM_DELIMITATION:
+                return
+            tag, vr, length = element
+            if length == UNDEFINED_LENGTH:
+                self.SkipUndefinedLength()
+            else:
+                self.Skip(length)
+
+def _decode(value: bytes, vr: str, endian: str):
+    if vr == "US":
+        return struct.unpack(endian + "H", value[:2])[0]
+    text = value.decode("latin-1").strip("\0 ")
+    if vr == "DS":
+        values = [float(v) for v in text.split("\\") if v.strip()]
+        return values[0] if len(values) == 1 else values
+    if vr == "IS":
+        return int(text) if text else None
+    return text
+
+def parse_header(path: str) -> Dict:
+    """
+    Parses the attributes of HEADER_TAGS of a DICOM file without reading the pixel
+    data. Returns None if the file is not DICOM (or uses a deflated syntax).
+    """
+    try:
+        with open(path, "rb") as f:
+            preamble = f.read(132)
+            reader = _Reader(f)
+            if preamble[128:132] != b"DICM":
+                # Files without preamble start directly with a dataset, with an
+                # explicit VR if the bytes after the first tag look like one.
+                f.seek(0)
+                if len(preamble) < 8 or preamble[:2] not in (b"\x02\x00", b"\x08\x00"):
+                    return None
+                reader.SetTransferSyntax(preamble[4:6].isalpha() and preamble[4:6].isupper(), True)
+
+            header = {}
+            transfer_syntax = None
+            while True:
+                position = f.tell()
+                element = reader.ReadElement()
+                if element is None:
+                    break
+                tag, vr, length = element
+
+                if transfer_syntax is not None and tag >> 16 != 0x0002:
+                    # The file meta information is always explicit little endian, the
+                    # dataset uses the transfer syntax.
+                    if transfer_syntax == DEFLATED_EXPLICIT_VR_LITTLE_ENDIAN:
+                        return None
+                    reader.SetTransferSyntax(
+                        transfer_syntax != IMPLICIT_VR_LITTLE_ENDIAN, transfer_syntax != EXPLICIT_VR_BIG_ENDIAN
+                    )
+                    transfer_syntax = None
+                    f.seek(position)
+                    continue
+
+                if tag > LAST_HEADER_TAG:
+                    break
+                if length == UNDEFINED_LENGTH:
+                    reader.SkipUndefinedLength()
+                elif tag == TRANSFER_SYNTAX_UID:
+                    transfer_syntax = f.read(length).decode("latin-1").strip("\0 ")
+                elif tag in HEADER_TAGS:
+                    name, default_vr = HEADER_TAGS[tag]
+                    header[name] = _decode(f.read(length), vr or default_vr, reader.endian)
+                else:
+                    reader.Skip(length)
+    except (OSError, struct.error, ValueError, UnicodeDecodeError):
+        return None
+    if "series_uid" not in header:
+        return None
+    return header
+
+def _parse_file(path: str) -> Tuple[str, Dict]:
+    return path, parse_header(path)
+
+def _as_list(value, size: int) -> List:
+    if isinstance(value, list) and len(value) == size:
+        return value
+    return None
+
+def get_slice_location(row: Dict) -> float:
+    """
+    Position of the slice along the normal of its plane, or its instance number when
+    the position is unknown.
+    """
+    if row["position_x"] is None or not row["orientation"]:
+        return float(row["instance_number"] or 0)
+    orientation = [float(v) for v in row["orientation"].split("\\")]
+    normal = np.cross(orientation[:3], orientation[3:])
+    return float(np.dot(normal, (row["position_x"], row["position_y"], row["position_z"])))
+
+# Rows of root and the files under it. The prefix is compared as is, a LIKE pattern
+# would match "_" and "%" in the directory names as wildcards.
+UNDER_ROOT = "path = ? OR substr(path, 1, ?) = ?"
+
+def _under_root_args(root: str) -> Tuple:
+    prefix = os.path.join(root, "")
+    return (root, len(prefix), prefix)
+
+class SeriesCatalogue:
+    """
+    SQLite catalogue of the DICOM files of directory trees, one row per file. Re-scans
+    only parse the files whose modification time or size changed.
+    """
+    COLUMNS = (
+        "path", "mtime", "size", "patient_id", "patient_name", "study_uid", "study_date",
+        "series_uid", "modality", "series_description", "sop_uid", "instance_number",
+        "position_x", "position_y", "position_z", "orientation", "spacing_x", "spacing_y",
+        "slice_thickness", "rows", "columns",
+    )
+
+    def __init__(self, path: str = CATALOGUE_FILENAME) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (%s, PRIMARY KEY (path))" % ", ".join(self.COLUMNS)
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS files_series ON files (series_uid)")
+        self.connection.commit()
+
+    def __get_row(self, path: str, mtime: float, size: int, header: Dict) -> Tuple:
+        # Files that are not DICOM are kept with no series, so they are not parsed again.
+        header = header or {}
+        position = _as_list(header.get("position"), 3) or (None, None, None)
+        orientation = _as_list(header.get("orientation"), 6)
+        # Pixel spacing is (row spacing, column spacing), i.e. (y, x).
+        pixel_spacing = _as_list(header.get("pixel_spacing"), 2) or (None, None)
+        return (
+            path, mtime, size, header.get("patient_id"), header.get("patient_name"),
+            header.get("study_uid"), header.get("study_date"), header.get("series_uid"),
+            header.get("modality"), header.get("series_description"), header.get("sop_uid"),
+            header.get("instance_number"), position[0], position[1], position[2],
+            "\\".join(str(v) for v in orientation) if orientation else None,
+            pixel_spacing[1], pixel_spacing[0], header.get("slice_thickness"),
+            header.get("rows"), header.get("columns"),
+        )
+
+    def Scan(self, root: str, max_workers: int = None) -> Dict:
+        """
+        Indexes the files under root in parallel and removes the rows of the files
+        that no longer exist.
+        """
+        t0 = time.perf_counter()
+        root = os.path.abspath(root)
+        known = {
+            row["path"]: (row["mtime"], row["size"])
+            for row in self.connection.execute(
+                "SELECT path, mtime, size FROM files WHERE %s" % UNDER_ROOT, _under_root_args(root)
+            )
+        }
+
+        found = {}
+        for directory, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found[path] = (stat.st_mtime, stat.st_size)
+
+        changed = [path for path, stat in found.items() if known.get(path) != stat]
+        removed = [path for path in known if path not in found]
+
+        rows = []
+        if changed:
+            with ProcessPoolExecutor(max_workers or concurrency.get_threads()) as executor:
+                for path, header in executor.map(_parse_file, changed, chunksize=SCAN_CHUNK_SIZE):
+                    rows.append(self.__get_row(path, *found[path], header))
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (%s)" % ", ".join("?" * len(self.COLUMNS)), rows
+            )
+            self.connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+
+        return {
+            "files": len(found),
+            "parsed": len(changed),
+            "added": len([path for path in changed if path not in known]),
+            "removed": len(removed),
+            "dicom": len([row for row in rows if row[7] is not None]),
+            "elapsed_s": time.perf_counter() - t0,
+        }
+
+    def GetSeries(self) -> List[Dict]:
+        rows = self.connection.execute(
+            "SELECT patient_id, patient_name, study_uid, study_date, series_uid, modality, "
+            "series_description, COUNT(*) AS files FROM files WHERE series_uid IS NOT NULL "
+            "GROUP BY series_uid ORDER BY patient_id, study_date, study_uid, series_uid"
+        )
+        return [dict(row) for row in rows]
+
+    def GetDirectorySeries(self, root: str) -> List[str]:
+        # Series with files under root.
+        root = os.path.abspath(root)
+        rows = self.connection.execute(
+            "SELECT DISTINCT series_uid FROM files WHERE series_uid IS NOT NULL AND (%s)" % UNDER_ROOT,
+            _under_root_args(root),
+        )
+        return [row["series_uid"] for row in rows]
+
+    def GetSeriesFiles(self, series_uid: str) -> List[Dict]:
+        """
+        Returns the rows of the files of the series, sorted along the slice normal.
+        """
+        rows = [dict(row) for row in self.connection.execute("SELECT * FROM files WHERE series_uid = ?", (series_uid,))]
+        if not rows:
+            raise KeyError("series %s is not in the catalogue" % series_uid)
+        rows.sort(key=lambda row: (get_slice_location(row), row["instance_number"] or 0))
+        return rows
+
+    def LoadSeries(self, series_uid: str) -> Tuple[ndarray, Tuple]:
+        """
+        Reads the files of the series in order and returns the volume (dz, dy, dx) and
+        its spacing (x, y, z).
+        """
+        rows = self.GetSeriesFiles(series_uid)
+        matrix = None
+        for z, row in enumerate(rows):
+            reader = vtkDICOMImageReader()
+            reader.SetFileName(row["path"])
+            reader.Update()
+            image = reader.GetOutput()
+            dx, dy, _ = image.GetDimensions()
+            n_image = vtk_to_numpy(image.GetPointData().GetScalars()).reshape(dy, dx)
+            if matrix is None:
+                matrix = np.empty((len(rows), dy, dx), dtype=n_image.dtype)
+            matrix[z] = n_image
+        return matrix, self.GetSeriesSpacing(series_uid, rows)
+
+    def GetSeriesSpacing(self, series_uid: str, rows: List[Dict] = None) -> Tuple:
+        if rows is None:
+            rows = self.GetSeriesFiles(series_uid)
+        locations = np.array([get_slice_location(row) for row in rows])
+        if len(rows) > 1 and rows[0]["position_x"] is not None:
+            spacing_z = float(np.median(np.abs(np.diff(locations))))
+        else:
+            spacing_z = rows[0]["slice_thickness"] or 1.0
+        return (rows[0]["spacing_x"] or 1.0, rows[0]["spacing_y"] or 1.0, spacing_z or 1.0)
+
+    def GetSeriesOrigin(self, series_uid: str, rows: List[Dict] = None) -> Tuple:
+        # Patient position of the first slice, as the origin of vtkDICOMImageReader.
+        if rows is None:
+            rows = self.GetSeriesFiles(series_uid)
+        if rows[0]["position_x"] is None:
+            return (0.0, 0.0, 0.0)
+        return (rows[0]["position_x"], rows[0]["position_y"], rows[0]["position_z"])
+
+    def LoadPhases(self, series_uids: List[str], path: str = None) -> Tuple[ndarray, Tuple]:
+        """
+        Loads series of the same geometry (e.g. the phases of a cardiac CT) in a single
+        array (phase, dz, dy, dx). With a path, the array is written once to a .npy
+        file and memory mapped from it afterwards.
+        """
+        spacing = self.GetSeriesSpacing(series_uids[0])
+        if path and os.path.exists(path):
+            phases = np.load(path, mmap_mode="r")
+            if len(phases) == len(series_uids):
+                return phases, spacing
+
+        phases = None
+        for phase, series_uid in enumerate(series_uids):
+            matrix, _ = self.LoadSeries(series_uid)
+            if phases is None:
+                shape = (len(series_uids),) + matrix.shape
+                if path:
+                    phases = np.lib.format.open_memmap(path, mode="w+", dtype=matrix.dtype, shape=shape)
+                else:
+                    phases = np.empty(shape, dtype=matrix.dtype)
+            if matrix.shape != phases.shape[1:]:
+                raise ValueError("series %s does not have the geometry of the first phase" % series_uid)
+            phases[phase] = matrix
+        if path:
+            phases.flush()
+            phases = np.load(path, mmap_mode="r")
+        return phases, spacing
+
+    def Close(self) -> None:
+        self.connection.close()
+
+def main():
+    parser = ArgumentParser("DICOM index")
+    parser.add_argument("roots", type=str, nargs="*", help="Directories to scan")
+    parser.add_argument("--catalogue", type=str, default=CATALOGUE_FILENAME)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    catalogue = SeriesCatalogue(args.catalogue)
+    for root in args.roots:
+        report = catalogue.Scan(root, args.workers)
+        print(
+            "%s: %d files, %d parsed (%d new), %d removed, %d DICOM in %.2f s"
+            % (root, report["files"], report["parsed"], report["added"], report["removed"], report["dicom"], report["elapsed_s"])
+        )
+    for series in catalogue.GetSeries():
+        print(
+            "%s %s %s %s %s (%d files)"
+            % (series["patient_id"], series["study_date"], series["modality"], series["series_uid"], series["series_description"], series["files"])
+        )
+    catalogue.Close()
+
+if __name__ == "__main__":
+    main()
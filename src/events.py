@@ -0,0 +1,136 @@
+import enum
+import time
+from typing import Callable, Dict
+
+from vtkmodules.vtkRenderingCore import vtkRenderWindowInteractor
+
+import instrumentation
+import utils
+
+class Event(enum.Enum):
+    """
+    Events of the viewer hot paths, sent through the EventBus instead of pubsub.
+    """
+    SET_CROSS_FOCAL_POINT = "Set cross focal point"
+    UPDATE_MPR = "Update mpr"
+    UPDATE_SLICE_3D = "Update slice 3d"
+    UPDATE_VOLUME = "Update volume"
+
+# Arguments of the handlers of each event.
+PAYLOADS = {
+    Event.SET_CROSS_FOCAL_POINT: frozenset({"position"}),
+    Event.UPDATE_MPR: frozenset(),
+    Event.UPDATE_SLICE_3D: frozenset({"orientations"}),
+    Event.UPDATE_VOLUME: frozenset(),
+}
+# Arguments merged as the union of the posted values; the others keep the last value.
+UNION_ARGUMENTS = frozenset({"orientations"})
+# Instrumentation stage of the dispatch of each event.
+STAGES = {event: "dispatch %s" % event.value for event in Event}
+# Delay of the flush of the posted events. The interactor handles the pending input
+# events before its timers, so the events they post are merged.
+FLUSH_DELAY_MS = 1
+
+class EventBus(metaclass=utils.StudySingleton):
+    """
+    Event bus of a study. Send calls the handlers directly; Post queues the event until
+    the next frame, merging it with the same event posted before, so a burst of mouse
+    moves or scroll steps renders once.
+    """
+    def __init__(self) -> None:
+        self.study_id = utils.get_active_study()
+        self.handlers = {event: [] for event in Event}
+        # Posted events and their merged arguments, in the order they were first posted.
+        self.pending = {}
+        self.interactor = None
+        self.observer = None
+        self.timer_id = None
+        self.stats = {"sent": 0, "posted": 0, "merged": 0, "dispatched": 0, "dispatch_ms": 0.0}
+
+    def SetInteractor(self, interactor: vtkRenderWindowInteractor) -> None:
+        """
+        Posted events are flushed by a timer of interactor. Without an initialized
+        interactor they are dispatched right away.
+        """
+        if self.interactor is not None:
+            self.interactor.RemoveObserver(self.observer)
+        self.interactor = interactor
+        self.observer = interactor.AddObserver("TimerEvent", self.OnTimer)
+        self.timer_id = None
+
+    def Subscribe(self, event: Event, handler: Callable) -> None:
+        if handler not in self.handlers[event]:
+            self.handlers[event].append(handler)
+
+    def Unsubscribe(self, event: Event, handler: Callable) -> None:
+        if handler in self.handlers[event]:
+            self.handlers[event].remove(handler)
+
+    def Check(self, event: Event, kwargs: Dict) -> None:
+        if kwargs.keys() != PAYLOADS[event]:
+            raise TypeError("%s takes the arguments %s, not %s" % (event, sorted(PAYLOADS[event]), sorted(kwargs)))
+
+    def Send(self, event: Event, **kwargs) -> None:
+        self.Check(event, kwargs)
+        self.stats["sent"] += 1
+        self.Dispatch(event, kwargs)
+
+    def Post(self, event: Event, **kwargs) -> None:
+        self.Check(event, kwargs)
+        self.stats["posted"] += 1
+        pending = self.pending.get(event)
+        if pending is None:
+            # The lists are copied, as the union extends them.
+            self.pending[event] = {
+                name: list(value) if name in UNION_ARGUMENTS else value for name, value in kwargs.items()
+            }
+        else:
+            self.stats["merged"] += 1
+            for name, value in kwargs.items():
+                if name in UNION_ARGUMENTS:
+                    pending[name].extend(item for item in value if item not in pending[name])
+                else:
+                    pending[name] = value
+        self.ScheduleFlush()
+
+    def ScheduleFlush(self) -> None:
+        if self.timer_id is not None:
+            return
+        if self.interactor is None or not self.interactor.GetInitialized():
+            self.Flush()
+            return
+        self.timer_id = self.interactor.CreateOneShotTimer(FLUSH_DELAY_MS)
+
+    def OnTimer(self, obj: vtkRenderWindowInteractor, event: str) -> None:
+        if self.timer_id is None or obj.GetTimerEventId() != self.timer_id:
+            return
+        self.timer_id = None
+        self.Flush()
+
+    def Flush(self) -> None:
+        """
+        Dispatches the posted events now. The events posted by the handlers wait for
+        the next flush.
+        """
+        pending = self.pending
+        self.pending = {}
+        for event, kwargs in pending.items():
+            self.Dispatch(event, kwargs)
+
+    def Dispatch(self, event: Event, kwargs: Dict) -> None:
+        start = time.perf_counter()
+        for handler in self.handlers[event]:
+            handler(**kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stats["dispatched"] += 1
+        self.stats["dispatch_ms"] += elapsed
+        if instrumentation.is_enabled():
+            instrumentation.record(STAGES[event], elapsed)
+
+def flush_all() -> None:
+    """
+    Dispatches the posted events of every study, e.g. to measure the whole cost of
+    an input event.
+    """
+    for bus in list(EventBus.instances.values()):
+        bus.Flush()
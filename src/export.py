@@ -0,0 +1,266 @@
+import os
+import time
+from argparse import ArgumentParser
+from multiprocessing import Pool
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy import ndarray
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkIOImage import vtkPNGWriter
+from vtkmodules.vtkImagingColor import vtkImageMapToWindowLevelColors
+from vtkmodules.vtkRenderingCore import vtkCamera, vtkWindowToImageFilter
+from vtkmodules.util import numpy_support
+
+import concurrency
+import shared_volume
+from loader import load_study
+from project import Project
+
+ORIENTATIONS = ("AXIAL", "CORONAL", "SAGITAL")
+# Slices rendered by a task of the pool. Small enough to balance the orientations
+# between the workers, large enough to amortise the task overhead.
+EXPORT_CHUNK_SIZE = 16
+
+def apply_window_level(n_image: ndarray, window: float, level: float) -> ndarray:
+    """
+    Pure NumPy equivalent of vtkImageMapToWindowLevelColors: maps
+    [level - window / 2, level + window / 2] linearly to [0, 255].
+    """
+    lower = level - window / 2.0
+    scale = 255.0 / max(window, 1e-6)
+    n_out = (n_image.astype(np.float32) - lower) * scale
+    np.clip(n_out, 0, 255, out=n_out)
+    return n_out.astype(np.uint8)
+
+def get_image_slice(matrix: ndarray, orientation: str, slice_number: int) -> ndarray:
+    # Same layout as Slice.get_image_slice.
+    if orientation == "AXIAL":
+        return matrix[slice_number]
+    elif orientation == "CORONAL":
+        return matrix[:, slice_number, :]
+    else:
+        return matrix[:, :, slice_number]
+
+def numpy_to_image(n_image: ndarray) -> vtkImageData:
+    """
+    Wraps a 2D (gray) or 3D (RGB) uint8 array as a vtkImageData. The first row is the
+    bottom of the image, as in the slice viewers.
+    """
+    height, width = n_image.shape[:2]
+    components = n_image.shape[2] if n_image.ndim == 3 else 1
+    image = vtkImageData()
+    image.SetDimensions(width, height, 1)
+    scalars = numpy_support.numpy_to_vtk(np.ascontiguousarray(n_image).reshape(-1, components), deep=1)
+    image.GetPointData().SetScalars(scalars)
+    return image
+
+def write_png(image: vtkImageData, filename: str) -> None:
+    writer = vtkPNGWriter()
+    writer.SetInputData(image)
+    writer.SetFileName(filename)
+    writer.Write()
+
+def encode_png(image: vtkImageData) -> bytes:
+    writer = vtkPNGWriter()
+    writer.SetInputData(image)
+    writer.WriteToMemoryOn()
+    writer.Write()
+    return bytes(numpy_support.vtk_to_numpy(writer.GetResult()))
+
+def get_filename(output: str, layout: str, orientation: str, number: int) -> str:
+    if layout == "stack":
+        # One directory of PNGs per orientation.
+        return os.path.join(output, orientation.lower(), "%04d.png" % number)
+    # A single sequence of numbered frames, e.g. for ffmpeg -i frame_%05d.png.
+    return os.path.join(output, "frame_%05d.png" % number)
+
+# State of the worker processes, set by init_worker.
+_worker = {}
+
+def init_worker(descriptor: Dict, options: Dict) -> None:
+    # The workers are the parallelism; each renders on a single thread.
+    concurrency.configure(1)
+    _worker["matrix"] = shared_volume.attach(descriptor)
+    _worker["spacing"] = tuple(descriptor["spacing"])
+    _worker["options"] = options
+
+def export_slices(orientation: str, slice_numbers: List[int], frame_offset: int) -> Tuple[int, float]:
+    """
+    Task of the pool: windows and writes the given slices of an orientation. Returns
+    the number of images and the time the worker spent on them.
+    """
+    t0 = time.perf_counter()
+    matrix = _worker["matrix"]
+    options = _worker["options"]
+    window, level = options["window"], options["level"]
+
+    for i, slice_number in enumerate(slice_numbers):
+        n_image = get_image_slice(matrix, orientation, slice_number)
+        if options["renderer"] == "vtk":
+            colorer = vtkImageMapToWindowLevelColors()
+            colorer.SetInputData(numpy_to_image(np.ascontiguousarray(n_image)))
+            colorer.SetWindow(window)
+            colorer.SetLevel(level)
+            colorer.SetOutputFormatToRGB()
+            colorer.Update()
+            image = colorer.GetOutput()
+        else:
+            image = numpy_to_image(apply_window_level(n_image, window, level))
+        number = slice_number if options["layout"] == "stack" else frame_offset + i
+        write_png(image, get_filename(options["output"], options["layout"], orientation, number))
+    return len(slice_numbers), time.perf_counter() - t0
+
+def export_snapshots(angles: List[float], frame_offset: int) -> Tuple[int, float]:
+    """
+    Task of the pool: renders the volume offscreen at the given azimuth angles.
+    """
+    from slice_ import Slice
+    from viewer_volume import VolumeViewer
+
+    t0 = time.perf_counter()
+    options = _worker["options"]
+
+    viewer = _worker.get("volume_viewer")
+    if viewer is None:
+        # The viewer reads the shared volume through the Slice of the worker.
+        slice = Slice()
+        slice.matrix = _worker["matrix"]
+        slice.spacing = _worker["spacing"]
+        viewer = _worker["volume_viewer"] = VolumeViewer(options["mode"])
+        render_window = viewer.interactor.GetRenderWindow()
+        render_window.SetOffScreenRendering(1)
+        render_window.SetSize(*options["size"])
+        viewer.LoadVolume()
+        _worker["camera"] = vtkCamera()
+        _worker["camera"].DeepCopy(viewer.renderer.GetActiveCamera())
+
+    render_window = viewer.interactor.GetRenderWindow()
+    camera = viewer.renderer.GetActiveCamera()
+    for i, angle in enumerate(angles):
+        camera.DeepCopy(_worker["camera"])
+        camera.Azimuth(angle)
+        viewer.renderer.ResetCameraClippingRange()
+        render_window.Render()
+
+        grabber = vtkWindowToImageFilter()
+        grabber.SetInput(render_window)
+        grabber.ReadFrontBufferOff()
+        grabber.Update()
+        number = i + frame_offset
+        if options["layout"] == "stack":
+            filename = os.path.join(options["output"], "volume", "%03d.png" % round(angle))
+        else:
+            filename = get_filename(options["output"], options["layout"], "VOLUME", number)
+        write_png(grabber.GetOutput(), filename)
+    return len(angles), time.perf_counter() - t0
+
+def chunk(items: List, size: int) -> List[List]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+def export(matrix, spacing: Tuple, options: Dict, orientations: List[str], step: int, angles: List[float], workers: int) -> Dict:
+    """
+    Exports every step-th slice of the orientations and the volume snapshots with a
+    pool of workers sharing the volume, and returns the throughput.
+    """
+    # A volume already in shared memory (--shared-memory) is attached to as it is.
+    shared = shared_volume.find_shared(matrix)
+    owned = shared is None
+    if owned:
+        shared = shared_volume.share_array(matrix)
+    try:
+        tasks = []
+        frame = 0
+        for orientation in orientations:
+            if options["layout"] == "stack":
+                os.makedirs(os.path.join(options["output"], orientation.lower()), exist_ok=True)
+            axis = {"AXIAL": 0, "CORONAL": 1, "SAGITAL": 2}[orientation]
+            for slice_numbers in chunk(list(range(0, matrix.shape[axis], step)), EXPORT_CHUNK_SIZE):
+                tasks.append((export_slices, (orientation, slice_numbers, frame)))
+                frame += len(slice_numbers)
+        if angles:
+            if options["layout"] == "stack":
+                os.makedirs(os.path.join(options["output"], "volume"), exist_ok=True)
+            # Loading the volume in a worker is expensive, so the angles are split in at
+            # most one task per worker.
+            for i in range(min(workers, len(angles))):
+                tasks.append((export_snapshots, (angles[i::workers], frame)))
+                frame += len(angles[i::workers])
+        os.makedirs(options["output"], exist_ok=True)
+
+        t0 = time.perf_counter()
+        with Pool(workers, init_worker, (shared.Describe(spacing=tuple(spacing)), options)) as pool:
+            results = [pool.apply_async(func, args) for func, args in tasks]
+            results = [result.get() for result in results]
+        elapsed = time.perf_counter() - t0
+    finally:
+        if owned:
+            shared.Release()
+
+    images = sum(n for n, busy in results)
+    busy = sum(busy for n, busy in results)
+    return {
+        "images": images,
+        "workers": workers,
+        "elapsed_s": elapsed,
+        "images_per_s": images / elapsed if elapsed else 0.0,
+        "images_per_s_per_core": images / elapsed / workers if elapsed else 0.0,
+        "images_per_busy_s": images / busy if busy else 0.0,
+    }
+
+def format_report(report: Dict) -> str:
+    return (
+        "%d images in %.2f s with %d workers: %.1f images/s, %.1f images/s per core"
+        % (report["images"], report["elapsed_s"], report["workers"], report["images_per_s"], report["images_per_s_per_core"])
+    )
+
+def main():
+    parser = ArgumentParser("Export")
+    parser.add_argument("path", type=str, help="DICOM directory of the study")
+    parser.add_argument("--output", type=str, default="export")
+    parser.add_argument("--orientations", type=str, default="AXIAL,CORONAL,SAGITAL")
+    parser.add_argument("--step", type=int, default=1, help="Export every step-th slice")
+    parser.add_argument("--ww", type=float, default=None, help="Window width (default of the project)")
+    parser.add_argument("--wl", type=float, default=None, help="Window level (default of the project)")
+    parser.add_argument(
+        "--renderer",
+        type=str,
+        default="numpy",
+        choices=("numpy", "vtk"),
+        help="Window/level the slices with NumPy or with vtkImageMapToWindowLevelColors",
+    )
+    parser.add_argument(
+        "--layout",
+        type=str,
+        default="stack",
+        choices=("stack", "frames"),
+        help="A directory of PNGs per orientation or a single sequence of numbered frames",
+    )
+    parser.add_argument("--angles", type=str, default="", help="Azimuth angles of the 3D snapshots, e.g. 0,90,180,270")
+    parser.add_argument("--mode", type=str, default="CPU", help="Volume rendering mode of the 3D snapshots")
+    parser.add_argument("--size", type=str, default="512,512", help="Size of the 3D snapshots")
+    parser.add_argument("--workers", type=int, default=concurrency.get_threads())
+    parser.add_argument("--spacing", type=str, default=None, help='Resample the volume: "iso" or "x,y,z" spacing in mm')
+    parser.add_argument("--bricks", type=str, default=None, help="Directory of the bricked copy of the volume")
+    parser.add_argument("--compress", action="store_true", help="Keep the volume compressed in memory")
+    args = parser.parse_args()
+
+    slice = load_study(args.path, args, args.bricks)
+    project = Project()
+    options = {
+        "output": args.output,
+        "renderer": args.renderer,
+        "layout": args.layout,
+        "window": args.ww if args.ww is not None else project.window_width,
+        "level": args.wl if args.wl is not None else project.window_level,
+        "mode": args.mode,
+        "size": [int(i) for i in args.size.split(",")],
+    }
+    orientations = [o.strip().upper() for o in args.orientations.split(",") if o.strip()]
+    angles = [float(a) for a in args.angles.split(",") if a.strip()]
+
+    report = export(slice.matrix, slice.spacing, options, orientations, args.step, angles, args.workers)
+    print(format_report(report))
+
+if __name__ == "__main__":
+    main()
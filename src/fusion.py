@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+from numpy import ndarray
+
+from resample import interpolate_axis
+
+# Slices of the secondary volume resampled onto the primary grid kept in the cache.
+FUSION_CACHE_SIZE = 64
+DEFAULT_LUT = "hot"
+# Colour maps of the secondary volume as (position, r, g, b) from the lower to the
+# upper bound of its window.
+LUTS = {
+    "hot": [(0.0, 0, 0, 0), (0.375, 1, 0, 0), (0.75, 1, 1, 0), (1.0, 1, 1, 1)],
+    "rainbow": [(0.0, 0, 0, 1), (0.25, 0, 1, 1), (0.5, 0, 1, 0), (0.75, 1, 1, 0), (1.0, 1, 0, 0)],
+    "gray": [(0.0, 0, 0, 0), (1.0, 1, 1, 1)],
+}
+LUT_SIZE = 256
+# Percentiles of the secondary volume used as its default window.
+DEFAULT_WINDOW_PERCENTILES = (1.0, 99.5)
+
+def make_lut(name: str, size: int = LUT_SIZE) -> ndarray:
+    # (size, 3) float32 colours in 0-255.
+    points = np.array(LUTS[name], dtype=np.float32)
+    positions = np.linspace(0, 1, size, dtype=np.float32)
+    return np.stack([np.interp(positions, points[:, 0], points[:, i]) * 255 for i in (1, 2, 3)], axis=1).astype(np.float32)
+
+def get_axis_weights(positions: ndarray, n_in: int, spacing: float, origin: float) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+    """
+    Lower and upper neighbours and weight of the upper one in an axis of n_in voxels
+    of the secondary volume for the positions in mm, and whether each position is
+    inside the volume.
+    """
+    f = (positions - origin) / spacing
+    valid = (f >= -1e-6) & (f <= n_in - 1 + 1e-6)
+    i0 = np.clip(np.floor(f), 0, n_in - 1).astype(np.intp)
+    i1 = np.minimum(i0 + 1, n_in - 1)
+    w = np.clip(f - i0, 0, 1).astype(np.float32)
+    return i0, i1, w, valid
+
+class FusionLayer:
+    """
+    Secondary volume (PET, another contrast phase, MR, ...) blended over the slices of
+    the primary one. It is resampled onto the primary grid lazily, one slice at a time
+    when the slice is shown, and the resampled and coloured slices are cached: the
+    blend of a cached slice, e.g. at another opacity, does not resample it again.
+    origin is the position in mm of the first voxel of the secondary volume in the
+    primary grid.
+    """
+    def __init__(
+        self,
+        matrix,
+        spacing: Tuple,
+        origin: Tuple = (0.0, 0.0, 0.0),
+        lut: str = DEFAULT_LUT,
+        window: Tuple = None,
+        cache_size: int = FUSION_CACHE_SIZE,
+    ) -> None:
+        self.matrix = matrix
+        self.spacing = tuple(float(i) for i in spacing)
+        self.origin = tuple(float(i) for i in origin)
+        self.cache_size = cache_size
+        self.lut_name = lut
+        self.lut = make_lut(lut)
+        self.window = tuple(window) if window is not None else self.GetDefaultWindow()
+        # Resampled values and coloured layers, keyed by the slice and the primary grid.
+        self.samples = OrderedDict()
+        self.layers = OrderedDict()
+
+    def GetDefaultWindow(self) -> Tuple[float, float]:
+        # From a subsample, so the volume is not read whole.
+        step = max(1, int(round((self.matrix.shape[0] * self.matrix.shape[1] * self.matrix.shape[2] / 2**20) ** (1 / 3))))
+        sample = np.asarray(self.matrix[::step, ::step, ::step])
+        lower, upper = np.percentile(sample, DEFAULT_WINDOW_PERCENTILES)
+        return float(lower), float(max(upper, lower + 1))
+
+    def SetLut(self, name: str) -> None:
+        self.lut_name = name
+        self.lut = make_lut(name)
+        self.layers.clear()
+
+    def SetWindow(self, lower: float, upper: float) -> None:
+        self.window = (float(lower), float(max(upper, lower + 1e-6)))
+        self.layers.clear()
+
+    def get_size(self) -> int:
+        size = sum(values.nbytes for values in self.samples.values() if values is not None)
+        size += sum(layer[0].nbytes + layer[1].nbytes for layer in self.layers.values() if layer is not None)
+        return size
+
+    def clear_cache(self) -> None:
+        self.samples.clear()
+        self.layers.clear()
+
+    def ResampleSlice(self, orientation: str, slice_number: int, shape: Tuple, spacing: Tuple) -> ndarray:
+        """
+        Values of the secondary volume on the slice of a primary grid of shape (dz, dy,
+        dx) and spacing (x, y, z), laid out like Slice.extract_image_slice, with NaN
+        outside the secondary volume; None if the slice misses it. Only the two
+        secondary planes around the slice are read.
+        """
+        axis = {"AXIAL": 0, "CORONAL": 1, "SAGITAL": 2}[orientation]
+        # Positions along the axes (z, y, x) of the primary grid and of the secondary volume.
+        positions = [np.arange(n, dtype=np.float64) * s for n, s in zip(shape, spacing[::-1])]
+        positions[axis] = np.array([slice_number * spacing[2 - axis]], dtype=np.float64)
+        weights = [
+            get_axis_weights(p, n, s, o)
+            for p, n, s, o in zip(positions, self.matrix.shape, self.spacing[::-1], self.origin[::-1])
+        ]
+        i0, i1, w, valid = weights[axis]
+        if not valid[0]:
+            return None
+
+        index = [slice(None)] * 3
+        index[axis] = slice(int(i0[0]), int(i1[0]) + 1)
+        values = np.asarray(self.matrix[tuple(index)])
+        # Between the two planes first, then in the plane of the slice.
+        values = interpolate_axis(values, axis, i0 - i0[0], i1 - i0[0], w)
+        for a, (i0, i1, w, valid) in enumerate(weights):
+            if a != axis:
+                values = interpolate_axis(values, a, i0, i1, w)
+
+        n_image = values.reshape([n for a, n in enumerate(shape) if a != axis])
+        in_plane = [valid for a, (i0, i1, w, valid) in enumerate(weights) if a != axis]
+        inside = in_plane[0][:, np.newaxis] & in_plane[1][np.newaxis, :]
+        if not inside.all():
+            n_image[~inside] = np.nan
+        return n_image
+
+    def get_layer(self, orientation: str, slice_number: int, shape: Tuple, spacing: Tuple) -> Tuple[ndarray, ndarray]:
+        # Colours (n, 3) and alpha (n,) of the slice, flattened, or None.
+        key = (orientation, slice_number, tuple(shape), tuple(spacing))
+        if key in self.layers:
+            self.layers.move_to_end(key)
+            return self.layers[key]
+
+        if key in self.samples:
+            self.samples.move_to_end(key)
+            values = self.samples[key]
+        else:
+            values = self.samples[key] = self.ResampleSlice(orientation, slice_number, shape, spacing)
+            while len(self.samples) > self.cache_size:
+                self.samples.popitem(last=False)
+
+        layer = None
+        if values is not None:
+            lower, upper = self.window
+            t = (values.reshape(-1) - lower) * ((len(self.lut) - 1) / (upper - lower))
+            # Outside the volume (NaN) and below the window, the primary shows through.
+            alpha = (t >= 0).astype(np.float32)
+            indices = np.clip(np.nan_to_num(t, nan=0.0), 0, len(self.lut) - 1).astype(np.intp)
+            layer = (self.lut[indices], alpha)
+        self.layers[key] = layer
+        while len(self.layers) > self.cache_size:
+            self.layers.popitem(last=False)
+        return layer
+
+    def Blend(self, n_rgb: ndarray, orientation: str, slice_number: int, shape: Tuple, spacing: Tuple, opacity: float) -> ndarray:
+        """
+        Alpha blends the coloured secondary slice at opacity over n_rgb, the (n, 3)
+        uint8 window/levelled colours of the primary slice, and returns the result.
+        """
+        layer = self.get_layer(orientation, slice_number, shape, spacing)
+        if layer is None:
+            return n_rgb
+        colour, alpha = layer
+        alpha = (alpha * opacity)[:, np.newaxis]
+        n_out = n_rgb.astype(np.float32)
+        n_out += (colour - n_out) * alpha
+        return np.rint(n_out, out=n_out).astype(np.uint8)
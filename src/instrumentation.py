@@ -0,0 +1,183 @@
+import atexit
+import functools
+import json
+import math
+import os
+import time
+from typing import Callable, Dict
+
+# Instrumentation is off unless MPR_PROFILE=1 or enable() is called. When it is off
+# the timers only cost a global lookup.
+_enabled = os.environ.get("MPR_PROFILE", "0") == "1"
+
+# Histogram buckets are spaced logarithmically, BUCKETS_PER_DECADE per power of ten,
+# from MIN_TIME_MS to 10 ** DECADES times it.
+MIN_TIME_MS = 0.001
+DECADES = 7
+BUCKETS_PER_DECADE = 20
+
+def is_enabled() -> bool:
+    return _enabled
+
+def enable(enabled: bool = True) -> None:
+    global _enabled
+    _enabled = enabled
+
+class Histogram:
+    """
+    Latency histogram with logarithmic buckets. Recording a sample is O(1) and the
+    percentiles are within one bucket (about 12%) of the exact value.
+    """
+    def __init__(self) -> None:
+        self.counts = [0] * (DECADES * BUCKETS_PER_DECADE + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, value_ms: float) -> None:
+        if value_ms <= MIN_TIME_MS:
+            index = 0
+        else:
+            index = int(math.log10(value_ms / MIN_TIME_MS) * BUCKETS_PER_DECADE) + 1
+            index = min(index, len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value_ms
+        self.min = min(self.min, value_ms)
+        self.max = max(self.max, value_ms)
+
+    def percentile(self, p: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = p / 100.0 * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                if index == len(self.counts) - 1:
+                    # The last bucket has no upper bound.
+                    return self.max
+                # Upper bound of the bucket, clamped to the observed range.
+                upper = MIN_TIME_MS * 10 ** (index / BUCKETS_PER_DECADE)
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.mean,
+            "min_ms": self.min if self.count else 0.0,
+            "max_ms": self.max,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+        }
+
+class _Stats:
+    def __init__(self) -> None:
+        self.stages = {}
+        self.frames = 0
+        self.last_frame = None
+
+    def reset(self) -> None:
+        self.__init__()
+
+_stats = _Stats()
+
+def record(stage: str, value_ms: float) -> None:
+    histogram = _stats.stages.get(stage)
+    if histogram is None:
+        histogram = _stats.stages[stage] = Histogram()
+    histogram.add(value_ms)
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str) -> None:
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        record(self.stage, (time.perf_counter() - self.start) * 1000)
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+_null_timer = _NullTimer()
+
+def stage(name: str):
+    """
+    Context manager that times the enclosed block as the given stage.
+    """
+    if _enabled:
+        return _Timer(name)
+    return _null_timer
+
+def timed(name: str) -> Callable:
+    """
+    Decorator that times each call of the function as the given stage.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kw):
+            if not _enabled:
+                return func(*args, **kw)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kw)
+            finally:
+                record(name, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorator
+
+def frame() -> None:
+    """
+    Counts a rendered frame and records the time since the previous one.
+    """
+    if not _enabled:
+        return
+    now = time.perf_counter()
+    if _stats.last_frame is not None:
+        record("frame interval", (now - _stats.last_frame) * 1000)
+    _stats.last_frame = now
+    _stats.frames += 1
+
+def reset() -> None:
+    _stats.reset()
+
+def get_report() -> Dict:
+    return {
+        "frames": _stats.frames,
+        "stages": {name: histogram.to_dict() for name, histogram in sorted(_stats.stages.items())},
+    }
+
+def format_report() -> str:
+    lines = ["Frames: %d" % _stats.frames, "%-18s %7s %7s %7s" % ("stage (ms)", "p50", "p95", "p99")]
+    for name, histogram in sorted(_stats.stages.items()):
+        lines.append(
+            "%-18s %7.2f %7.2f %7.2f"
+            % (name, histogram.percentile(50), histogram.percentile(95), histogram.percentile(99))
+        )
+    return "\n".join(lines)
+
+def dump(path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(get_report(), f, indent=2)
+
+def dump_at_exit(path: str) -> None:
+    atexit.register(dump, path)
+
+if os.environ.get("MPR_PROFILE_JSON"):
+    dump_at_exit(os.environ["MPR_PROFILE_JSON"])
@@ -0,0 +1,167 @@
+from typing import List
+
+from vtkmodules.vtkRenderingCore import (
+    vtkInteractorObserver,
+    vtkRenderer,
+    vtkWorldPointPicker,
+)
+
+import instrumentation
+from vtk_utils import vtkRenderWindow, vtkRenderWindowInteractor
+
+# Viewport of each view as (column, row) of a grid, row 0 at the top.
+LAYOUTS = {
+    "1x3": ((3, 1), {"AXIAL": (0, 0), "CORONAL": (1, 0), "SAGITAL": (2, 0)}),
+    "1x4": ((4, 1), {"AXIAL": (0, 0), "CORONAL": (1, 0), "SAGITAL": (2, 0), "VOLUME": (3, 0)}),
+    "2x2": ((2, 2), {"AXIAL": (0, 0), "CORONAL": (1, 0), "SAGITAL": (0, 1), "VOLUME": (1, 1)}),
+}
+VIEWPORT_SIZE = 350
+# Events that move the pointer to another viewport.
+POINTER_EVENTS = (
+    "MouseMoveEvent",
+    "LeftButtonPressEvent",
+    "MiddleButtonPressEvent",
+    "RightButtonPressEvent",
+    "MouseWheelForwardEvent",
+    "MouseWheelBackwardEvent",
+)
+BUTTON_RELEASE_EVENTS = ("LeftButtonReleaseEvent", "MiddleButtonReleaseEvent", "RightButtonReleaseEvent")
+
+class ViewportLayout:
+    """
+    One render window (one OpenGL context) holding the views as viewports. The
+    interactor style of the viewport under the pointer is made active, so each view
+    keeps its own style, and Render only draws the viewports whose content changed:
+    the other renderers are skipped and keep their pixels in the framebuffer of the
+    window.
+    """
+    def __init__(self, name: str = "1x3", viewport_size: int = VIEWPORT_SIZE) -> None:
+        (self.columns, self.rows), self.cells = LAYOUTS[name]
+
+        self.render_window = vtkRenderWindow()
+        self.render_window.SetWindowName("MPR")
+        self.render_window.SetSize(self.columns * viewport_size, self.rows * viewport_size)
+        self.render_window.SetPosition(0, 0)
+        # Turn off warning
+        self.render_window.GlobalWarningDisplayOff()
+
+        self.interactor = vtkRenderWindowInteractor()
+        self.interactor.SetRenderWindow(self.render_window)
+        self.interactor.SetPicker(vtkWorldPointPicker())
+
+        # view -> renderer, renderer -> style
+        self.renderers = {}
+        self.styles = {}
+        self.active = None
+        self.buttons = 0
+        # Modified time of the content of each renderer when it was last drawn.
+        self.drawn_mtimes = {}
+        self.full_redraw = True
+
+        for event in POINTER_EVENTS:
+            self.interactor.AddObserver(event, self.OnPointerEvent, 10.0)
+        for event in BUTTON_RELEASE_EVENTS:
+            self.interactor.AddObserver(event, self.OnButtonRelease, 10.0)
+        self.render_window.AddObserver("StartEvent", self.OnStartRender)
+        self.render_window.AddObserver("EndEvent", self.OnEndRender)
+        self.render_window.AddObserver("WindowResizeEvent", self.OnResize)
+        self.interactor.AddObserver("ExposeEvent", self.OnResize)
+
+    def HasView(self, view: str) -> bool:
+        return view in self.cells
+
+    def AddViewport(self, view: str, renderer: vtkRenderer) -> None:
+        column, row = self.cells[view]
+        renderer.SetViewport(
+            column / self.columns,
+            1 - (row + 1) / self.rows,
+            (column + 1) / self.columns,
+            1 - row / self.rows,
+        )
+        self.render_window.AddRenderer(renderer)
+        self.renderers[view] = renderer
+        self.full_redraw = True
+
+    def SetViewportStyle(self, view: str, style: vtkInteractorObserver) -> None:
+        renderer = self.renderers[view]
+        previous = self.styles.get(renderer)
+        self.styles[renderer] = style
+        if self.active is None or self.active is renderer or self.interactor.GetInteractorStyle() is previous:
+            self.active = renderer
+            self.interactor.SetInteractorStyle(style)
+
+    def GetViewportAt(self, x: int, y: int) -> vtkRenderer:
+        width, height = self.render_window.GetSize()
+        if not width or not height:
+            return None
+        nx, ny = x / width, y / height
+        for renderer in self.renderers.values():
+            x0, y0, x1, y1 = renderer.GetViewport()
+            if x0 <= nx < x1 and y0 <= ny < y1:
+                return renderer
+        return None
+
+    def OnPointerEvent(self, obj: vtkRenderWindowInteractor, event: str) -> None:
+        if event.endswith("PressEvent"):
+            self.buttons += 1
+        elif self.buttons:
+            # A drag stays in the viewport where it started.
+            return
+        renderer = self.GetViewportAt(*obj.GetEventPosition())
+        if renderer is None or renderer is self.active:
+            return
+        style = self.styles.get(renderer)
+        self.active = renderer
+        if style is not None:
+            obj.SetInteractorStyle(style)
+
+    def OnButtonRelease(self, obj: vtkRenderWindowInteractor, event: str) -> None:
+        self.buttons = max(self.buttons - 1, 0)
+
+    def OnResize(self, obj, event: str) -> None:
+        self.full_redraw = True
+
+    def GetContentMTime(self, renderer: vtkRenderer) -> int:
+        # The camera first, as creating it modifies the renderer.
+        camera = renderer.GetActiveCamera()
+        mtime = max(renderer.GetMTime(), camera.GetMTime(), renderer.GetViewProps().GetMTime())
+        props = renderer.GetViewProps()
+        props.InitTraversal()
+        for i in range(props.GetNumberOfItems()):
+            prop = props.GetNextProp()
+            mtime = max(mtime, prop.GetRedrawMTime())
+        return mtime
+
+    def GetModifiedViews(self) -> List[str]:
+        return [
+            view
+            for view, renderer in self.renderers.items()
+            if self.full_redraw or self.GetContentMTime(renderer) > self.drawn_mtimes.get(renderer, -1)
+        ]
+
+    def OnStartRender(self, obj: vtkRenderWindow, event: str) -> None:
+        # Every render of the window, also those of the interactor styles, skips the
+        # viewports that did not change.
+        modified = self.GetModifiedViews()
+        for view, renderer in self.renderers.items():
+            renderer.SetDraw(view in modified)
+
+    def OnEndRender(self, obj: vtkRenderWindow, event: str) -> None:
+        for renderer in self.renderers.values():
+            renderer.DrawOn()
+            # Toggling Draw modifies the renderers, so all the times are taken after.
+            self.drawn_mtimes[renderer] = self.GetContentMTime(renderer)
+        self.full_redraw = False
+
+    def Render(self) -> None:
+        """
+        Draws the modified viewports with a single render (and buffer swap) of the
+        window.
+        """
+        if not self.GetModifiedViews():
+            return
+        with instrumentation.stage("render layout"):
+            self.render_window.Render()
+
+    def Start(self) -> None:
+        self.interactor.Start()
@@ -0,0 +1,103 @@
+# Loading of the studies, shared by the viewer and the headless tools. It does not
+# import the viewers, so the tools start without the GUI modules.
+import os
+from typing import Tuple
+
+from numpy import ndarray
+from vtkmodules.vtkIOImage import vtkDICOMImageReader
+from vtkmodules.util.numpy_support import vtk_to_numpy
+
+from resample import get_isotropic_spacing
+from slice_ import Slice
+
+def read_dicom_directory(path: str) -> Tuple[ndarray, Tuple, Tuple, Tuple]:
+    """
+    Decodes the DICOM files of path, returns the volume with its spacing, origin and
+    center.
+    """
+    reader = vtkDICOMImageReader()
+    reader.SetDirectoryName(path)
+    reader.Update()
+    image = reader.GetOutput()
+    matrix = vtk_to_numpy(image.GetPointData().GetScalars()).reshape(image.GetDimensions()[::-1])
+    return matrix, tuple(image.GetSpacing()), tuple(image.GetOrigin()), tuple(image.GetCenter())
+
+def open_catalogue(args):
+    from dicom_index import CATALOGUE_FILENAME, SeriesCatalogue
+
+    return SeriesCatalogue(args.catalogue or CATALOGUE_FILENAME)
+
+def load_study(path: str, args, bricks: str = None, series: str = None) -> Slice:
+    """
+    Loads the volume of path, or the series of the catalogue if given, into the Slice
+    of the active study.
+    """
+    slice = Slice()
+    if series and "," in series:
+        # Several series of the same geometry are the phases of a 4D volume.
+        catalogue = open_catalogue(args)
+        phases, spacing = catalogue.LoadPhases(series.split(","), args.phases_cache)
+        slice.origin = catalogue.GetSeriesOrigin(series.split(",")[0])
+        catalogue.Close()
+        slice.SetPhases(phases, spacing)
+        return slice
+    elif bricks and os.path.exists(bricks):
+        # The volume is read from the bricked copy, without decoding the DICOM files.
+        from brick_store import BrickedVolume
+
+        matrix = BrickedVolume(bricks)
+        slice.matrix = matrix
+        slice.spacing = matrix.spacing
+        slice.origin = matrix.origin
+        dz, dy, dx = matrix.shape
+        slice.center = ((dx - 1) * matrix.spacing[0] / 2, (dy - 1) * matrix.spacing[1] / 2, (dz - 1) * matrix.spacing[2] / 2)
+    else:
+        if series:
+            # The files of the series are read from the catalogue, already sorted.
+            catalogue = open_catalogue(args)
+            matrix, spacing = catalogue.LoadSeries(series)
+            slice.origin = catalogue.GetSeriesOrigin(series)
+            catalogue.Close()
+            dz, dy, dx = matrix.shape
+            slice.matrix = matrix
+            slice.spacing = spacing
+            slice.center = ((dx - 1) * spacing[0] / 2, (dy - 1) * spacing[1] / 2, (dz - 1) * spacing[2] / 2)
+        else:
+            matrix, slice.spacing, slice.origin, slice.center = read_dicom_directory(path)
+            slice.matrix = matrix
+
+        if bricks:
+            from brick_store import BrickedVolume, create_brick_store
+
+            create_brick_store(bricks, matrix, matrix.shape, matrix.dtype, slice.spacing, origin=slice.origin)
+            slice.matrix = BrickedVolume(bricks)
+        elif args.compress:
+            from compressed_volume import CompressedVolume, compare_extraction, format_report
+
+            volume = CompressedVolume(matrix, slice.spacing)
+            print(format_report(compare_extraction(matrix, volume)))
+            slice.matrix = volume
+            # Release the uncompressed volume.
+            del matrix
+
+    if getattr(args, "shared_memory", False):
+        slice.ShareVolume()
+    if args.spacing == "iso":
+        slice.SetSpacing(get_isotropic_spacing(slice.spacing))
+    elif args.spacing:
+        slice.SetSpacing([float(i) for i in args.spacing.split(",")])
+    return slice
+
+def get_prior_series(path: str, args) -> str:
+    """
+    Series of the catalogue the prior study in path is loaded from: --prior-series,
+    else those of --series whose files are in path. None reads path.
+    """
+    if args.prior_series:
+        return args.prior_series
+    if not args.series:
+        return None
+    catalogue = open_catalogue(args)
+    in_path = set(catalogue.GetDirectorySeries(path))
+    catalogue.Close()
+    return ",".join(uid for uid in args.series.split(",") if uid in in_path) or None
@@ -1,12 +1,49 @@
-import vtk
-from vtkmodules.util.numpy_support import vtk_to_numpy
+# Marked before the other imports, so the report times them.
+import startup
+startup.mark("start")
+
+import atexit
+import json
+import sys
+
+import concurrency
+# NumPy loads its BLAS with the thread limit of the environment, before the arguments
+# are parsed. Without a configured thread count the libraries keep their defaults.
+_threads = concurrency.get_configured_threads(concurrency.peek_threads(sys.argv[1:]))
+if _threads is not None:
+    concurrency.set_blas_threads(_threads)
+
 from pubsub import pub as Publisher
 from argparse import ArgumentParser
 
+import instrumentation
 from slice_ import Slice
+from study import StudyManager
+from utils import DEFAULT_STUDY
 from viewer_slice import SliceViewer
 from viewer_volume import VolumeViewer
-from viewer_endoscopy import EndoscopyViewer
+from layout import LAYOUTS, ViewportLayout
+from converters import RENDER_DTYPES
+from loader import get_prior_series, load_study, read_dicom_directory
+
+startup.mark("import")
+
+def load_fusion(path: str, args) -> None:
+    """
+    Loads the series of path (e.g. a PET) as the fusion layer of the Slice of the
+    active study, placed from the patient positions of the two series.
+    """
+    from fusion import DEFAULT_LUT, LUTS
+
+    lut = args.fusion_lut or DEFAULT_LUT
+    if lut not in LUTS:
+        raise ValueError("unknown colour map %s, choose from %s" % (lut, ", ".join(sorted(LUTS))))
+    matrix, spacing, origin, _ = read_dicom_directory(path)
+
+    slice = Slice()
+    slice.SetFusion(matrix, spacing, origin, lut)
+    if args.fusion_opacity is not None:
+        slice.SetFusionOpacity(args.fusion_opacity)
 
 def main():
     parser = ArgumentParser("App")
@@ -15,33 +52,254 @@ def main():
         type=str,
         default="CPU",
     )
+    parser.add_argument(
+        "--render-dtype",
+        type=str,
+        default=None,
+        choices=RENDER_DTYPES,
+        help="Quantise the volume of the 3D view to this type in the range of its transfer function",
+    )
+    parser.add_argument(
+        "--presets",
+        type=str,
+        default=None,
+        help="Directory of transfer function presets (JSON files) added to the built-in ones",
+    )
+    parser.add_argument(
+        "--preset",
+        type=str,
+        default=None,
+        help="Transfer function preset of the 3D view: bone, soft tissue, lung, angio, endoluminal or one of --presets",
+    )
+    parser.add_argument(
+        "--spacing",
+        type=str,
+        default=None,
+        help='Resample the volume: "iso" or "x,y,z" spacing in mm',
+    )
+    parser.add_argument(
+        "--bricks",
+        type=str,
+        default=None,
+        help="Directory of the out-of-core bricked copy of the volume (created if missing)",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Keep the volume compressed in memory",
+    )
+    parser.add_argument(
+        "--shared-memory",
+        action="store_true",
+        help="Keep the volume in shared memory, so worker processes read it without a copy",
+    )
+    parser.add_argument(
+        "--catalogue",
+        type=str,
+        default=None,
+        help="SQLite series catalogue built by dicom_index.py (default series.db)",
+    )
+    parser.add_argument(
+        "--series",
+        type=str,
+        default=None,
+        help="Series instance UID of the catalogue to load instead of the DICOM directory, or comma separated UIDs of the phases of a 4D volume",
+    )
+    parser.add_argument(
+        "--phases-cache",
+        type=str,
+        default=None,
+        help="4D volumes: .npy file the phases are memory mapped from (created if missing)",
+    )
+    parser.add_argument(
+        "--layout",
+        type=str,
+        default=None,
+        choices=sorted(LAYOUTS),
+        help="Show the views as viewports of a single window instead of one window per view",
+    )
+    parser.add_argument(
+        "--prior",
+        type=str,
+        default=None,
+        help="DICOM directory of a second study opened side by side",
+    )
+    parser.add_argument(
+        "--prior-series",
+        type=str,
+        default=None,
+        help="Series instance UID of the catalogue to load as the prior study, or comma separated UIDs of its phases",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Enable the hot path instrumentation and dump it as JSON to this file at exit",
+    )
+    parser.add_argument(
+        "--record",
+        type=str,
+        default=None,
+        help="Record the input events of the session to this file",
+    )
+    parser.add_argument(
+        "--replay",
+        type=str,
+        default=None,
+        help="Replay a recorded session in offscreen viewers and print the timings",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="Replay the session with the recorded timing instead of as fast as possible",
+    )
+    parser.add_argument(
+        "--snapshot",
+        type=str,
+        default=None,
+        help="Save the session state and the decoded volume to this directory at exit",
+    )
+    parser.add_argument(
+        "--restore",
+        type=str,
+        default=None,
+        help="Restore the session saved by --snapshot from this directory instead of loading the study",
+    )
+    parser.add_argument(
+        "--startup-report",
+        type=str,
+        nargs="?",
+        const="",
+        default=None,
+        help="Print the cold start stages when the 3D view is ready, and write them as JSON to the given file",
+    )
+    parser.add_argument(
+        "--fusion",
+        type=str,
+        default=None,
+        help="DICOM directory of a secondary series (PET, contrast phase, MR) blended over the slices",
+    )
+    parser.add_argument(
+        "--fusion-lut",
+        type=str,
+        default=None,
+        help="Colour map of the fusion layer: hot (default), rainbow or gray",
+    )
+    parser.add_argument(
+        "--fusion-opacity",
+        type=float,
+        default=None,
+        help="Opacity of the fusion layer, changed with o/O in the slice views",
+    )
+    parser.add_argument(
+        "--threads",
+        type=concurrency.parse_threads,
+        default=None,
+        help="Threads of VTK, NumPy and the worker pools (default $MPR_THREADS, else the autotuned setting, else the cores)",
+    )
+    parser.add_argument(
+        "--smp-backend",
+        type=str,
+        default=None,
+        help="VTK SMP backend: STDThread, TBB, OpenMP or Sequential (default $MPR_SMP_BACKEND or the autotuned setting)",
+    )
+    parser.add_argument(
+        "--cprofile",
+        type=str,
+        default=None,
+        help="Write the cProfile stats of the replay to this file",
+    )
     args = parser.parse_args()
     mode = args.mode
+    # Before the viewers, as the mappers take their thread count when created.
+    concurrency.configure(args.threads, args.smp_backend)
+    if args.presets:
+        import presets
+
+        presets.load_presets(args.presets)
+    if args.profile:
+        instrumentation.enable(True)
+        instrumentation.dump_at_exit(args.profile)
+    if args.startup_report is not None:
+        startup.enable("3d ready", args.startup_report)
 
     path = "D:/workingspace/dicom/220277460 Nguyen Thanh Dat"
     # path = "D:/workingspace/dicom/DICOM_NGUYEN VAN HUONG78T_CT_9210255004/1.2.392.200036.9123.100.11.12.700001708.2024010308030744.44/1.2.392.200036.9123.100.11.15114374081372786170424474122344997"
     # path = "D:/workingspace/viewer/be_project/viewer-core/server3d/src/data/2.25.273770070420816203849299146355226291780/1.2.840.113619.2.428.3.678656.566.1723853370.188.3/data"
     # path = "D:/workingspace/viewer/be_project/viewer-core/server3d/src/data/2.25.273770070420816203849299146355226291780/1.2.840.113619.2.428.3.678656.566.1723853370.188.3/data"
     # path = "D:/workingspace/viewer/be_project/viewer-core/server3d/src/data/1.2.840.113619.2.472.3.2831157761.80.1725840678.120/1.2.840.113619.2.472.3.2831157761.80.1725840678.176.6/data"
-    dicomReader = vtk.vtkDICOMImageReader()
-    dicomReader.SetDirectoryName(path)
-    dicomReader.Update()
-    imageData = dicomReader.GetOutput()
+    state = None
+    if args.restore:
+        # The volume is memory mapped from the snapshot, without decoding the DICOM files.
+        import snapshot
 
-    slice = Slice()
-    dimensions = imageData.GetDimensions()
-    shape = dimensions[::-1]
-    matrix = vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(shape)
-    slice.matrix = matrix
-    slice.spacing = imageData.GetSpacing()
-    slice.center = imageData.GetCenter()
-    
-    sliceViewer = SliceViewer()
-    volumeViewer = VolumeViewer(mode)
+        state = snapshot.load_snapshot(args.restore)
+        snapshot.restore_study(state, args.restore)
+    else:
+        load_study(path, args, args.bricks, args.series)
+    if args.fusion:
+        load_fusion(args.fusion, args)
+    startup.mark("load")
+
+    layout = ViewportLayout(args.layout) if args.layout else None
+    sliceViewer = SliceViewer(layout)
+    volumeViewer = VolumeViewer(mode, layout, args.render_dtype)
+    sliceViewer.scheduler.AddInputInteractor(volumeViewer.interactor)
+    if args.preset:
+        volumeViewer.LoadPreset(args.preset)
     # endoViewer = EndoscopyViewer()
-    
+    startup.mark("viewers")
+
+    if args.prior:
+        # The prior exam is opened as a second study, with its own viewers.
+        study = StudyManager().CreateStudy("Prior")
+        load_study(args.prior, args, series=get_prior_series(args.prior, args))
+        study.slice_viewer = SliceViewer()
+        study.volume_viewer = VolumeViewer(mode, render_dtype=args.render_dtype)
+        study.slice_viewer.scheduler.AddInputInteractor(study.volume_viewer.interactor)
+        Publisher.sendMessage(study.Topic("Load mpr"))
+        Publisher.sendMessage(study.Topic("Load volume"))
+        StudyManager().GetStudy(DEFAULT_STUDY).Activate()
+
+    if args.replay or args.record:
+        from session import SessionRecorder, SessionReplayer, get_interactors, load_session
+
+    if args.replay:
+        for interactor in get_interactors(sliceViewer, volumeViewer).values():
+            interactor.GetRenderWindow().SetOffScreenRendering(1)
+
     Publisher.sendMessage("Load mpr")
-    Publisher.sendMessage("Load volume")
+    if state is not None:
+        snapshot.restore_views(state, sliceViewer)
+    startup.mark("first frame")
+
+    def on_volume_ready() -> None:
+        if state is not None:
+            snapshot.restore_volume_view(state, volumeViewer)
+        startup.mark("3d ready")
+
+    if args.replay:
+        Publisher.sendMessage("Load volume")
+        on_volume_ready()
+    else:
+        # The 3D scene is built once the event loop runs, after the first MPR frame.
+        volumeViewer.LoadVolumeInBackground(sliceViewer.scheduler, on_volume_ready)
+
+    if args.replay:
+        replayer = SessionReplayer(get_interactors(sliceViewer, volumeViewer))
+        report = replayer.Replay(load_session(args.replay), args.realtime, args.cprofile)
+        print(json.dumps(report, indent=2))
+        return
+
+    if args.record:
+        recorder = SessionRecorder(get_interactors(sliceViewer, volumeViewer))
+        recorder.Start()
+        atexit.register(recorder.Save, args.record)
+    if args.snapshot:
+        import snapshot
+
+        atexit.register(snapshot.save_snapshot, args.snapshot, sliceViewer, volumeViewer)
+
     Publisher.sendMessage("Start app")
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+import math
+from typing import Dict, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+import constants as const
+
+class SummedAreaTable:
+    """
+    Summed-area tables (integral images) of a 2D slice, used to compute the sum and
+    the sum of squares of any axis aligned rectangle in constant time.
+    """
+    def __init__(self, image: ndarray) -> None:
+        h, w = image.shape
+        values = image.astype(np.float64)
+
+        # The tables have one extra row and column of zeros so the rectangle lookup
+        # does not need to special case the borders.
+        table_sum = np.zeros((h + 1, w + 1), dtype=np.float64)
+        np.cumsum(values, axis=0, out=table_sum[1:, 1:])
+        np.cumsum(table_sum[1:, 1:], axis=1, out=table_sum[1:, 1:])
+
+        table_sum_sq = np.zeros((h + 1, w + 1), dtype=np.float64)
+        np.square(values, out=values)
+        np.cumsum(values, axis=0, out=table_sum_sq[1:, 1:])
+        np.cumsum(table_sum_sq[1:, 1:], axis=1, out=table_sum_sq[1:, 1:])
+
+        self.shape = (h, w)
+        self.table_sum = table_sum
+        self.table_sum_sq = table_sum_sq
+
+    def __lookup(self, table: ndarray, x0: int, y0: int, x1: int, y1: int) -> float:
+        return table[y1 + 1, x1 + 1] - table[y0, x1 + 1] - table[y1 + 1, x0] + table[y0, x0]
+
+    def rectangle_sums(self, x0: int, y0: int, x1: int, y1: int) -> Tuple[int, float, float]:
+        """
+        Returns the number of pixels, the sum and the sum of squares of the
+        rectangle [x0, x1] x [y0, y1] (inclusive, already clipped).
+        """
+        n = (x1 - x0 + 1) * (y1 - y0 + 1)
+        s = self.__lookup(self.table_sum, x0, y0, x1, y1)
+        s2 = self.__lookup(self.table_sum_sq, x0, y0, x1, y1)
+        return n, s, s2
+
+def clip_rectangle(shape: Tuple, p0: Tuple, p1: Tuple) -> Tuple:
+    """
+    Orders and clips the corners p0 = (x0, y0) and p1 = (x1, y1) to the image shape.
+    Returns None when the rectangle is completely outside the image.
+    """
+    h, w = shape
+    x0, x1 = sorted((int(p0[0]), int(p1[0])))
+    y0, y1 = sorted((int(p0[1]), int(p1[1])))
+    if x1 < 0 or y1 < 0 or x0 >= w or y0 >= h:
+        return None
+    return max(x0, 0), max(y0, 0), min(x1, w - 1), min(y1, h - 1)
+
+def _stats(n: int, s: float, s2: float, vmin: float, vmax: float) -> Dict:
+    mean = float(s / n)
+    # Guard against small negative values caused by floating point cancellation.
+    variance = max(s2 / n - mean * mean, 0.0)
+    return {"n": n, "mean": mean, "std": math.sqrt(variance), "min": float(vmin), "max": float(vmax)}
+
+def rectangle_stats(image: ndarray, sat: SummedAreaTable, p0: Tuple, p1: Tuple) -> Dict:
+    """
+    Mean and standard deviation of the rectangle are taken from the summed-area table
+    in O(1). Min and max are a vectorised reduction over the rectangle view.
+    """
+    rect = clip_rectangle(image.shape, p0, p1)
+    if rect is None:
+        return None
+    x0, y0, x1, y1 = rect
+    n, s, s2 = sat.rectangle_sums(x0, y0, x1, y1)
+    view = image[y0 : y1 + 1, x0 : x1 + 1]
+    return _stats(n, s, s2, view.min(), view.max())
+
+def ellipse_stats(image: ndarray, p0: Tuple, p1: Tuple) -> Dict:
+    """
+    Statistics of the ellipse inscribed in the rectangle defined by p0 and p1,
+    computed with a boolean mask over the bounding box.
+    """
+    # The centre and radii come from the unclipped rectangle so the ellipse keeps its
+    # shape when it is partially outside of the image.
+    cx = (p0[0] + p1[0]) / 2.0
+    cy = (p0[1] + p1[1]) / 2.0
+    rx = max(abs(p1[0] - p0[0]) / 2.0, 0.5)
+    ry = max(abs(p1[1] - p0[1]) / 2.0, 0.5)
+
+    rect = clip_rectangle(image.shape, p0, p1)
+    if rect is None:
+        return None
+    x0, y0, x1, y1 = rect
+    yy, xx = np.ogrid[y0 : y1 + 1, x0 : x1 + 1]
+    mask = ((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 <= 1.0
+
+    values = image[y0 : y1 + 1, x0 : x1 + 1][mask]
+    if values.size == 0:
+        return None
+    values = values.astype(np.float64)
+    return _stats(values.size, values.sum(), np.dot(values, values), values.min(), values.max())
+
+def line_profile(image: ndarray, p0: Tuple, p1: Tuple, spacing: Tuple = (1.0, 1.0)) -> Tuple[ndarray, ndarray]:
+    """
+    Samples the image along the segment p0 -> p1 (one sample per pixel) using bilinear
+    interpolation. Returns the distance of each sample in mm and its value.
+    """
+    h, w = image.shape
+    x0, y0 = p0
+    x1, y1 = p1
+    n = max(int(math.ceil(math.hypot(x1 - x0, y1 - y0))) + 1, 2)
+
+    t = np.linspace(0.0, 1.0, n)
+    xs = np.clip(x0 + t * (x1 - x0), 0, w - 1)
+    ys = np.clip(y0 + t * (y1 - y0), 0, h - 1)
+
+    xi = np.minimum(np.floor(xs).astype(np.intp), w - 2 if w > 1 else 0)
+    yi = np.minimum(np.floor(ys).astype(np.intp), h - 2 if h > 1 else 0)
+    fx = xs - xi
+    fy = ys - yi
+    xj = np.minimum(xi + 1, w - 1)
+    yj = np.minimum(yi + 1, h - 1)
+
+    values = (
+        image[yi, xi] * (1 - fx) * (1 - fy)
+        + image[yi, xj] * fx * (1 - fy)
+        + image[yj, xi] * (1 - fx) * fy
+        + image[yj, xj] * fx * fy
+    )
+    length = math.hypot((xs[-1] - xs[0]) * spacing[0], (ys[-1] - ys[0]) * spacing[1])
+    distances = t * length
+    return distances, values
+
+def get_pixel_spacing(spacing: Tuple, orientation: str) -> Tuple[float, float]:
+    # Spacing of the columns and rows of the 2D slice of the given orientation.
+    if orientation == "AXIAL":
+        return spacing[0], spacing[1]
+    elif orientation == "CORONAL":
+        return spacing[0], spacing[2]
+    else:
+        return spacing[1], spacing[2]
+
+def format_stats(roi_type: int, stats: Dict, area: float) -> str:
+    if stats is None:
+        return ""
+    if roi_type == const.SLICE_STATE_ROI_ELLIPSE:
+        label = "Ellipse"
+    else:
+        label = "Rectangle"
+    return "%s: %.1f mm²\nMean: %.1f SD: %.1f\nMin: %.0f Max: %.0f" % (
+        label,
+        area,
+        stats["mean"],
+        stats["std"],
+        stats["min"],
+        stats["max"],
+    )
+
+def format_profile(distances: ndarray, values: ndarray) -> str:
+    return "Line: %.1f mm\nMean: %.1f\nMin: %.0f Max: %.0f" % (
+        distances[-1],
+        values.mean(),
+        values.min(),
+        values.max(),
+    )
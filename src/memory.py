@@ -0,0 +1,83 @@
+import time
+from typing import Callable, Dict, List
+
+import utils
+
+# Memory used by the evictable caches of all the studies together.
+MEMORY_BUDGET = 2 * 1024 * 1024 * 1024
+# Interval of the viewers' check of the budget. Summing the sizes of the caches is too
+# slow for every slice step.
+ENFORCE_INTERVAL_MS = 500
+
+class CacheEntry:
+    def __init__(self, name: str, get_size: Callable[[], int], evict: Callable[[], None]) -> None:
+        self.name = name
+        self.get_size = get_size
+        self.evict = evict
+
+class MemoryManager(metaclass=utils.Singleton):
+    """
+    Global memory budget of the caches of all the studies (slice buffers, resampled
+    volumes, brick caches, ...). Each cache is registered with a function returning its
+    size in bytes and a function that empties it. When the total goes over the budget
+    the caches of the least recently viewed study are evicted first. The most recently
+    viewed study is never evicted, its buffers are the ones on screen.
+    """
+    def __init__(self, budget: int = MEMORY_BUDGET) -> None:
+        self.budget = budget
+        self.caches = {}
+        self.last_viewed = {}
+        self.evictions = 0
+
+    def RegisterCache(self, study_id: int, name: str, get_size: Callable[[], int], evict: Callable[[], None]) -> None:
+        self.caches.setdefault(study_id, {})[name] = CacheEntry(name, get_size, evict)
+
+    def UnregisterStudy(self, study_id: int) -> None:
+        self.caches.pop(study_id, None)
+        self.last_viewed.pop(study_id, None)
+
+    def GetUsage(self) -> Dict[int, Dict[str, int]]:
+        """
+        Returns the memory used by each cache of each study, in bytes.
+        """
+        return {
+            study_id: {name: entry.get_size() for name, entry in entries.items()}
+            for study_id, entries in self.caches.items()
+        }
+
+    def GetTotalUsage(self) -> int:
+        return sum(sum(usage.values()) for usage in self.GetUsage().values())
+
+    def Touch(self, study_id: int) -> None:
+        # The study was viewed now.
+        self.last_viewed[study_id] = time.monotonic()
+
+    def __get_eviction_order(self) -> List[int]:
+        study_ids = sorted(self.caches, key=lambda i: self.last_viewed.get(i, 0.0))
+        return study_ids[:-1]
+
+    def Enforce(self) -> None:
+        total = self.GetTotalUsage()
+        if total <= self.budget:
+            return
+        for study_id in self.__get_eviction_order():
+            # The largest caches of the study are evicted first.
+            entries = sorted(self.caches[study_id].values(), key=lambda e: e.get_size(), reverse=True)
+            for entry in entries:
+                size = entry.get_size()
+                if size == 0:
+                    continue
+                entry.evict()
+                self.evictions += 1
+                total -= size - entry.get_size()
+                if total <= self.budget:
+                    return
+
+    def FormatUsage(self) -> str:
+        lines = []
+        for study_id, usage in self.GetUsage().items():
+            lines.append("Study %d: %.1f MB" % (study_id, sum(usage.values()) / 2**20))
+            for cache_name, size in usage.items():
+                lines.append("    %s: %.1f MB" % (cache_name, size / 2**20))
+        lines.append("Total: %.1f / %.1f MB" % (self.GetTotalUsage() / 2**20, self.budget / 2**20))
+        return "\n".join(lines)
@@ -0,0 +1,241 @@
+from typing import List, Tuple
+
+import numpy as np
+from vtkmodules.vtkCommonCore import vtkPoints, vtkUnsignedCharArray
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkImageData, vtkPolyData
+from vtkmodules.vtkRenderingCore import (
+    vtkActor,
+    vtkActor2D,
+    vtkImageMapper,
+    vtkPolyDataMapper,
+    vtkRenderer,
+    vtkTextRenderer,
+)
+from vtkmodules.util import numpy_support
+
+from vtk_utils import TextZero
+
+class CrossOverlay:
+    """
+    Crosshair of a slice view: the three axes of the cursor through the focal point,
+    as the lines of one preallocated polydata (like vtkCursor3D with AxesOn). Moving
+    the cross writes the coordinates of the points in place, without a pipeline
+    update, and the colours of the lines are set once.
+    """
+    def __init__(self, colours: List[Tuple[int, int, int]]) -> None:
+        self.bounds = np.array([-1.0, 1.0, -1.0, 1.0, -1.0, 1.0])
+        self.focal_point = np.zeros(3)
+
+        # Points 2i and 2i + 1 are the ends of the line along the axis i.
+        self.n_points = np.zeros((6, 3))
+        points = vtkPoints()
+        points.SetData(numpy_support.numpy_to_vtk(self.n_points, deep=False))
+        self.points = points
+
+        lines = vtkCellArray()
+        for i in range(3):
+            lines.InsertNextCell(2)
+            lines.InsertCellPoint(2 * i)
+            lines.InsertCellPoint(2 * i + 1)
+
+        colour_array = vtkUnsignedCharArray()
+        colour_array.SetNumberOfComponents(3)
+        colour_array.SetNumberOfTuples(3)
+        for i, colour in enumerate(colours):
+            colour_array.SetTuple(i, colour)
+
+        polydata = vtkPolyData()
+        polydata.SetPoints(points)
+        polydata.SetLines(lines)
+        polydata.GetCellData().SetScalars(colour_array)
+        self.polydata = polydata
+
+        mapper = vtkPolyDataMapper()
+        mapper.SetInputData(polydata)
+        actor = vtkActor()
+        actor.SetMapper(mapper)
+        actor.VisibilityOn()
+        actor.PickableOff()
+        self.actor = actor
+        self.UpdatePoints()
+
+    def SetModelBounds(self, bounds: Tuple) -> None:
+        self.bounds[:] = bounds
+        self.UpdatePoints()
+
+    def SetFocalPoint(self, position: List) -> None:
+        self.focal_point[:] = position
+        self.UpdatePoints()
+
+    def GetFocalPoint(self) -> Tuple[float, float, float]:
+        return tuple(float(value) for value in self.focal_point)
+
+    def UpdatePoints(self) -> None:
+        # The focal point stays inside the bounds, as in vtkCursor3D.
+        np.clip(self.focal_point, self.bounds[0::2], self.bounds[1::2], out=self.focal_point)
+        self.n_points[:] = self.focal_point
+        for i in range(3):
+            self.n_points[2 * i, i] = self.bounds[2 * i]
+            self.n_points[2 * i + 1, i] = self.bounds[2 * i + 1]
+        self.points.Modified()
+        self.polydata.Modified()
+
+class TextBatch:
+    """
+    Draws the texts of a view as one RGBA image of the size of the viewport, shown by
+    one actor. Each string is rasterized only when its text or properties change, and
+    only the boxes of the texts that changed are blended again on the canvas, which
+    is kept between the renders. The texts keep their TextZero interface: their
+    actors are watched, not rendered.
+    """
+    def __init__(self, renderer: vtkRenderer) -> None:
+        self.renderer = renderer
+        self.texts = []
+        # Raster of each text: (key, RGBA array, x offset, y offset) from its anchor.
+        self.rasters = {}
+        # Where each text was drawn: (RGBA array, x, y) on the canvas.
+        self.placements = {}
+        self.observers = {}
+        self.size = (0, 0)
+        self.canvas = None
+        # Texts changed since the last composition, and boxes (x0, y0, x1, y1) of the
+        # canvas to draw again.
+        self.modified = set()
+        self.regions = []
+        self.text_renderer = vtkTextRenderer()
+
+        self.image = vtkImageData()
+        mapper = vtkImageMapper()
+        mapper.SetInputData(self.image)
+        mapper.SetColorWindow(255)
+        mapper.SetColorLevel(127.5)
+        actor = vtkActor2D()
+        actor.SetMapper(mapper)
+        actor.PickableOff()
+        self.actor = actor
+        renderer.AddActor2D(actor)
+        renderer.AddObserver("StartEvent", self.OnStartRender)
+
+    def Add(self, text: TextZero) -> None:
+        self.texts.append(text)
+        # Any change of the text, of its properties or of its position marks it.
+        objects = (text.actor, text.actor.GetTextProperty(), text.actor.GetPositionCoordinate())
+        callback = lambda obj, event: self.OnTextModified(text)
+        self.observers[text] = [(obj, obj.AddObserver("ModifiedEvent", callback)) for obj in objects]
+        self.OnTextModified(text)
+
+    def Remove(self, text: TextZero) -> None:
+        if text not in self.observers:
+            return
+        self.texts.remove(text)
+        for obj, tag in self.observers.pop(text):
+            obj.RemoveObserver(tag)
+        self.rasters.pop(text, None)
+        self.modified.discard(text)
+        placement = self.placements.pop(text, None)
+        if placement is not None:
+            self.regions.append(self.GetBox(*placement))
+        self.actor.Modified()
+
+    def OnTextModified(self, text: TextZero) -> None:
+        self.modified.add(text)
+        # Lets the render window know the view has to be drawn again.
+        self.actor.Modified()
+
+    def IsModified(self) -> bool:
+        return bool(self.modified or self.regions) or self.canvas is None
+
+    def OnStartRender(self, obj: vtkRenderer, event: str) -> None:
+        size = tuple(self.renderer.GetSize())
+        if size != self.size:
+            self.size = size
+            self.canvas = None
+        if self.IsModified():
+            self.Compose()
+
+    def GetRaster(self, text: TextZero, dpi: int) -> Tuple:
+        actor = text.actor
+        key = (actor.GetInput(), actor.GetTextProperty().GetMTime(), dpi)
+        raster = self.rasters.get(text)
+        if raster is not None and raster[0] == key:
+            return raster
+        image = vtkImageData()
+        if not actor.GetInput() or not self.text_renderer.RenderString(actor.GetTextProperty(), actor.GetInput(), image, [0, 0], dpi):
+            raster = (key, None, 0, 0)
+        else:
+            x0, x1, y0, y1 = image.GetExtent()[:4]
+            n_image = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+            raster = (key, n_image.reshape(y1 - y0 + 1, x1 - x0 + 1, 4), x0, y0)
+        self.rasters[text] = raster
+        return raster
+
+    def GetPlacement(self, text: TextZero, dpi: int) -> Tuple:
+        # None when the text is not drawn.
+        if not text.actor.GetVisibility():
+            return None
+        key, n_raster, dx, dy = self.GetRaster(text, dpi)
+        if n_raster is None:
+            return None
+        # The raster offsets are relative to the anchor, justification included.
+        width, height = self.size
+        x, y = text.actor.GetPositionCoordinate().GetValue()[:2]
+        return n_raster, int(round(x * width)) + dx, int(round(y * height)) + dy
+
+    def GetBox(self, n_raster: np.ndarray, x0: int, y0: int) -> Tuple[int, int, int, int]:
+        rh, rw = n_raster.shape[:2]
+        return x0, y0, x0 + rw, y0 + rh
+
+    def Compose(self) -> None:
+        width, height = self.size
+        if not width or not height:
+            return
+        render_window = self.renderer.GetRenderWindow()
+        dpi = render_window.GetDPI() if render_window is not None else 72
+
+        if self.canvas is None or self.canvas.shape[:2] != (height, width):
+            # A new canvas, with every text drawn.
+            self.canvas = np.zeros((height, width, 4), dtype=np.uint8)
+            # The image shares the memory of the canvas, which is kept alive with it.
+            self.image.SetDimensions(width, height, 1)
+            self.image.GetPointData().SetScalars(numpy_support.numpy_to_vtk(self.canvas.reshape(-1, 4), deep=False))
+            self.placements = {}
+            self.modified = set(self.texts)
+            self.regions = [(0, 0, width, height)]
+
+        # The old and the new box of each text that changed are drawn again.
+        for text in self.modified:
+            placement = self.placements.pop(text, None)
+            if placement is not None:
+                self.regions.append(self.GetBox(*placement))
+            placement = self.GetPlacement(text, dpi)
+            if placement is not None:
+                self.placements[text] = placement
+                self.regions.append(self.GetBox(*placement))
+
+        for x0, y0, x1, y1 in self.regions:
+            x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            self.canvas[y0:y1, x0:x1] = 0
+            # The texts over the region, in order, so the overlaps stay the same.
+            for text in self.texts:
+                placement = self.placements.get(text)
+                if placement is not None:
+                    self.Blend(*placement, (x0, y0, x1, y1))
+
+        self.modified = set()
+        self.regions = []
+        self.image.GetPointData().GetScalars().Modified()
+        self.image.Modified()
+
+    def Blend(self, n_raster: np.ndarray, x0: int, y0: int, region: Tuple[int, int, int, int]) -> None:
+        rx0, ry0, rx1, ry1 = region
+        rh, rw = n_raster.shape[:2]
+        cx0, cy0, cx1, cy1 = max(x0, rx0), max(y0, ry0), min(x0 + rw, rx1), min(y0 + rh, ry1)
+        if cx0 >= cx1 or cy0 >= cy1:
+            return
+        source = n_raster[cy0 - y0 : cy1 - y0, cx0 - x0 : cx1 - x0]
+        target = self.canvas[cy0:cy1, cx0:cx1]
+        alpha = source[..., 3:4].astype(np.uint16)
+        target[..., :3] = (source[..., :3] * alpha + target[..., :3] * (255 - alpha)) // 255
+        target[..., 3:4] = np.maximum(target[..., 3:4], source[..., 3:4])
@@ -0,0 +1,33 @@
+import numpy as np
+from numpy import ndarray
+
+def make_volume(shape=(256, 512, 512), dtype="int16", seed=0) -> ndarray:
+    """
+    Generates a CT-like volume (dz, dy, dx) in HU: air around an elliptic body of soft
+    tissue with two lungs, a bone ring and gaussian noise.
+    """
+    rng = np.random.default_rng(seed)
+    dz, dy, dx = shape
+    y, x = np.ogrid[-1 : 1 : dy * 1j, -1 : 1 : dx * 1j]
+
+    body = (x / 0.85) ** 2 + (y / 0.65) ** 2 <= 1
+    bone = body & ((x / 0.8) ** 2 + (y / 0.6) ** 2 >= 0.9)
+    lungs = ((x - 0.35) / 0.25) ** 2 + (y / 0.4) ** 2 <= 1
+    lungs |= ((x + 0.35) / 0.25) ** 2 + (y / 0.4) ** 2 <= 1
+
+    template = np.full((dy, dx), -1000, dtype=np.float32)
+    template[body] = 40
+    template[lungs] = -800
+    template[bone] = 700
+
+    volume = np.empty(shape, dtype=dtype)
+    info = np.iinfo(volume.dtype) if np.issubdtype(volume.dtype, np.integer) else None
+    for z in range(dz):
+        # The lungs shrink towards the ends of the volume.
+        scale = 1 - abs(2 * z / max(dz - 1, 1) - 1) * 0.5
+        n_slice = np.where(lungs, -1000 + (template + 1000) * scale, template)
+        n_slice = n_slice + rng.normal(0, 20, (dy, dx)).astype(np.float32)
+        if info is not None:
+            n_slice = np.clip(n_slice, info.min, info.max)
+        volume[z] = n_slice
+    return volume
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import time
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+import concurrency
+import export
+import snapshot
+from loader import read_dicom_directory
+from project import Project
+
+PYRAMID_LEVELS = 3
+HISTOGRAM_BINS = 512
+THUMBNAIL_SIZE = 128
+HISTOGRAM_FILENAME = "histogram.npz"
+# The peak memory of a study is about the decoded volume (the reader output and its
+# copy) plus the pyramid, estimated from the size of its files.
+MEMORY_FACTOR = 2.5
+
+def get_source_signature(path: str) -> Dict:
+    """
+    Number, total size and last modification of the files of a study directory. A
+    study whose signature did not change since it was pre-processed is up to date.
+    """
+    files = 0
+    size = 0
+    mtime = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                files += 1
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime_ns)
+    return {"path": os.path.abspath(path), "files": files, "size": size, "mtime_ns": mtime}
+
+def get_study_output(output: str, path: str) -> str:
+    # The hash keeps apart studies whose directories have the same name.
+    path = os.path.abspath(path)
+    name = os.path.basename(os.path.normpath(path))
+    return os.path.join(output, "%s_%s" % (name, hashlib.sha1(path.encode()).hexdigest()[:8]))
+
+def is_up_to_date(study_output: str, signature: Dict) -> bool:
+    try:
+        state = snapshot.load_snapshot(study_output)
+    except (OSError, ValueError):
+        return False
+    return state.get("source") == signature
+
+def build_pyramid(matrix: ndarray, spacing: Tuple, levels: int) -> List[Tuple[ndarray, Tuple]]:
+    """
+    Returns the volume downsampled by 2, 4, ... in each axis, each level from the
+    previous one, with their spacing.
+    """
+    pyramid = []
+    for level in range(levels):
+        if min(matrix.shape) < 2:
+            break
+        matrix = np.ascontiguousarray(matrix[::2, ::2, ::2])
+        spacing = tuple(s * 2 for s in spacing)
+        pyramid.append((matrix, spacing))
+    return pyramid
+
+def get_thumbnail(matrix: ndarray, spacing: Tuple, orientation: str, size: int, window: float, level: float) -> ndarray:
+    """
+    Windowed middle slice of the orientation, sampled to at most size pixels on its
+    longest side with the aspect ratio of the physical slice.
+    """
+    axis = {"AXIAL": 0, "CORONAL": 1, "SAGITAL": 2}[orientation]
+    n_image = export.get_image_slice(matrix, orientation, matrix.shape[axis] // 2)
+    # Spacing of the rows and the columns of the slice.
+    dx, dy, dz = spacing
+    row_spacing, column_spacing = {"AXIAL": (dy, dx), "CORONAL": (dz, dx), "SAGITAL": (dz, dy)}[orientation]
+    height, width = n_image.shape
+    extent_y, extent_x = height * row_spacing, width * column_spacing
+    scale = size / max(extent_y, extent_x)
+    rows = np.minimum((np.arange(max(int(extent_y * scale), 1)) / scale / row_spacing).astype(int), height - 1)
+    columns = np.minimum((np.arange(max(int(extent_x * scale), 1)) / scale / column_spacing).astype(int), width - 1)
+    return export.apply_window_level(n_image[np.ix_(rows, columns)], window, level)
+
+def preprocess_study(path: str, study_output: str, signature: Dict, options: Dict) -> Dict:
+    """
+    Task of the pool: decodes a study and writes the files the viewer restores from
+    (see snapshot.restore_study), with its pyramid, histogram and thumbnails. The
+    state file is written last, so an interrupted study is done again on the next run.
+    """
+    t0 = time.perf_counter()
+    os.makedirs(study_output, exist_ok=True)
+    # The files of the previous run are replaced, so its state no longer holds.
+    state_path = os.path.join(study_output, snapshot.STATE_FILENAME)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+
+    matrix, spacing, origin, center = read_dicom_directory(path)
+    t_decode = time.perf_counter()
+
+    np.save(os.path.join(study_output, snapshot.VOLUME_FILENAME), matrix)
+
+    pyramid = []
+    for i, (level_matrix, level_spacing) in enumerate(build_pyramid(matrix, spacing, options["levels"]), 1):
+        filename = "pyramid_%d.npy" % i
+        np.save(os.path.join(study_output, filename), level_matrix)
+        pyramid.append({"file": filename, "spacing": level_spacing, "shape": level_matrix.shape})
+
+    counts, edges = np.histogram(matrix, bins=HISTOGRAM_BINS)
+    np.savez(os.path.join(study_output, HISTOGRAM_FILENAME), counts=counts, edges=edges)
+
+    project = Project()
+    thumbnails = {}
+    for orientation in snapshot.ORIENTATIONS:
+        filename = "thumbnail_%s.png" % orientation.lower()
+        n_thumbnail = get_thumbnail(matrix, spacing, orientation, options["thumbnail_size"], project.window_width, project.window_level)
+        export.write_png(export.numpy_to_image(n_thumbnail), os.path.join(study_output, filename))
+        thumbnails[orientation] = filename
+
+    state = {
+        "version": snapshot.SNAPSHOT_VERSION,
+        "time": time.time(),
+        "source": signature,
+        "project": {
+            "modality": project.modality,
+            "window_level": project.window_level,
+            "window_width": project.window_width,
+        },
+        "volume": {
+            "kind": "volume",
+            "file": snapshot.VOLUME_FILENAME,
+            "spacing": spacing,
+            "center": center,
+            "origin": origin,
+            "shape": matrix.shape,
+            "dtype": matrix.dtype.str,
+        },
+        "pyramid": pyramid,
+        "histogram": HISTOGRAM_FILENAME,
+        "thumbnails": thumbnails,
+    }
+    snapshot.write_state(study_output, state)
+
+    elapsed = time.perf_counter() - t0
+    return {
+        "path": path,
+        "output": study_output,
+        "shape": matrix.shape,
+        "nbytes": matrix.nbytes,
+        "decode_s": t_decode - t0,
+        "elapsed_s": elapsed,
+        "mb_per_s": matrix.nbytes / 2**20 / elapsed if elapsed else 0.0,
+    }
+
+def preprocess(paths: List[str], output: str, workers: int, memory_limit: int, options: Dict, force: bool = False) -> List[Dict]:
+    """
+    Pre-processes the studies of paths on a pool of workers, skipping those that are
+    up to date. A study starts only when the estimated memory of the studies in
+    progress stays within memory_limit bytes; one study always runs, whatever its size.
+    """
+    reports = []
+    pending = deque()
+    for path in paths:
+        try:
+            signature = get_source_signature(path)
+        except OSError as e:
+            # A missing or unreadable directory does not stop the worklist either.
+            print("%s: failed: %s" % (path, e), flush=True)
+            reports.append({"path": path, "error": str(e)})
+            continue
+        study_output = get_study_output(output, path)
+        if not force and is_up_to_date(study_output, signature):
+            print("%s: up to date" % path, flush=True)
+            reports.append({"path": path, "output": study_output, "skipped": True})
+            continue
+        pending.append((path, study_output, signature, int(signature["size"] * MEMORY_FACTOR)))
+
+    t0 = time.perf_counter()
+    # Estimated memory and path of the studies in progress.
+    running = {}
+    paths_running = {}
+    with ProcessPoolExecutor(workers) as executor:
+        while pending or running:
+            while pending and len(running) < workers:
+                path, study_output, signature, estimate = pending[0]
+                if running and sum(running.values()) + estimate > memory_limit:
+                    break
+                pending.popleft()
+                future = executor.submit(preprocess_study, path, study_output, signature, options)
+                running[future] = estimate
+                paths_running[future] = path
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                path = paths_running.pop(future)
+                try:
+                    report = future.result()
+                except Exception as e:
+                    # A study that fails does not stop the worklist.
+                    print("%s: failed: %s" % (path, e), flush=True)
+                    reports.append({"path": path, "error": str(e)})
+                    continue
+                print(
+                    "%s: %s voxels, %.1f MB in %.2f s (decode %.2f s), %.1f MB/s"
+                    % (report["path"], "x".join(str(i) for i in report["shape"][::-1]), report["nbytes"] / 2**20,
+                       report["elapsed_s"], report["decode_s"], report["mb_per_s"]),
+                    flush=True,
+                )
+                reports.append(report)
+    elapsed = time.perf_counter() - t0
+
+    done = [r for r in reports if "elapsed_s" in r]
+    nbytes = sum(r["nbytes"] for r in done)
+    print(
+        "%d studies pre-processed, %d up to date, %d failed: %.1f MB in %.2f s with %d workers, %.1f MB/s"
+        % (len(done), sum(1 for r in reports if r.get("skipped")), sum(1 for r in reports if "error" in r),
+           nbytes / 2**20, elapsed, workers, nbytes / 2**20 / elapsed if elapsed else 0.0),
+        flush=True,
+    )
+    return reports
+
+def read_worklist(filename: str) -> List[str]:
+    with open(filename) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def main():
+    parser = ArgumentParser("Pre-process")
+    parser.add_argument("paths", type=str, nargs="*", help="DICOM directories of the studies")
+    parser.add_argument("--worklist", type=str, default=None, help="File with a DICOM directory per line")
+    parser.add_argument("--output", type=str, default="cache", help="Directory of the pre-processed studies")
+    parser.add_argument("--workers", type=int, default=concurrency.get_threads())
+    parser.add_argument("--memory-limit", type=int, default=4096, help="Memory of the studies in progress, in MB")
+    parser.add_argument("--levels", type=int, default=PYRAMID_LEVELS, help="Levels of the downsampled pyramid")
+    parser.add_argument("--thumbnail-size", type=int, default=THUMBNAIL_SIZE)
+    parser.add_argument("--force", action="store_true", help="Pre-process the studies that are up to date too")
+    parser.add_argument("--report", type=str, default=None, help="Write the report of each study as JSON to this file")
+    args = parser.parse_args()
+
+    paths = list(args.paths)
+    if args.worklist:
+        paths += read_worklist(args.worklist)
+    options = {"levels": args.levels, "thumbnail_size": args.thumbnail_size}
+    reports = preprocess(paths, args.output, args.workers, args.memory_limit * 2**20, options, args.force)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import json
+import os
+from typing import Dict, List
+
+from vtkmodules.vtkCommonDataModel import vtkPiecewiseFunction
+from vtkmodules.vtkRenderingCore import vtkColorTransferFunction, vtkVolumeProperty
+
+PRESET_EXTENSION = ".json"
+DEFAULT_PRESET = "bone"
+# Interior points closer than this to the line through their neighbours are dropped.
+SIMPLIFY_TOLERANCE = 1e-4
+# Lighting of the presets that do not set it.
+LIGHTING = {"shade": True, "ambient": 0.15, "diffuse": 0.9, "specular": 0.3, "specular_power": 15}
+
+# Built-in presets, in voxel values (HU): colour points (x, r, g, b), opacity points
+# (x, opacity) and gradient opacity points (gradient magnitude, opacity).
+PRESETS = {
+    "bone": {
+        "colour": [
+            [-3024, 0, 0, 0],
+            [143.556, 0.615686, 0.356863, 0.184314],
+            [166.222, 0.882353, 0.603922, 0.290196],
+            [214.389, 1, 1, 1],
+            [419.736, 1, 0.937033, 0.954531],
+            [3071, 0.827451, 0.658824, 1],
+        ],
+        "opacity": [[-3024, 0], [143.556, 0], [166.222, 0.686275], [214.389, 0.696078], [419.736, 0.833333], [3071, 0.803922]],
+        "gradient_opacity": [[0, 1], [255, 1]],
+    },
+    "soft tissue": {
+        "colour": [
+            [-2048, 0, 0, 0],
+            [-167, 0, 0, 0],
+            [-160, 0.0556, 0, 0],
+            [240, 1, 1, 1],
+            [3071, 1, 1, 1],
+        ],
+        "opacity": [[-2048, 0], [-167, 0], [-160, 1], [240, 1], [3071, 1]],
+    },
+    "lung": {
+        "colour": [
+            [-1000, 0.3, 0.3, 1],
+            [-600, 0, 0, 1],
+            [-530, 0.134704, 0.781726, 0.0724558],
+            [-460, 0.929244, 1, 0.109473],
+            [-400, 0.888889, 0.254949, 0.0240258],
+            [2952, 1, 0.3, 0.3],
+        ],
+        "opacity": [[-1000, 0], [-600, 0], [-599, 0.15], [-400, 0.15], [-399, 0], [2952, 0]],
+        "ambient": 0.2,
+        "diffuse": 1.0,
+        "specular": 0.0,
+        "specular_power": 1,
+    },
+    "angio": {
+        "colour": [
+            [-2048, 0, 0, 0],
+            [136.47, 0, 0, 0],
+            [159.215, 0.159804, 0.0475, 0],
+            [318.43, 0.973333, 0.809412, 0.707843],
+            [1553.71, 0.9, 0.9, 0.9],
+            [3071, 1, 1, 1],
+        ],
+        "opacity": [[-2048, 0], [136.47, 0], [159.215, 0.258929], [318.43, 0.571429], [1553.71, 0.75], [3071, 0.75]],
+        "ambient": 0.2,
+        "diffuse": 1.0,
+        "specular": 0.0,
+        "specular_power": 1,
+    },
+    "endoluminal": {
+        "colour": [
+            [-1000, 0, 0, 0],
+            [-600, 194 / 255, 105 / 255, 82 / 255],
+            [-400, 194 / 255, 105 / 255, 82 / 255],
+            [-100, 194 / 255, 166 / 255, 115 / 255],
+            [-60, 194 / 255, 166 / 255, 115 / 255],
+            [40, 102 / 255, 0, 0],
+            [80, 153 / 255, 0, 0],
+            [400, 255 / 255, 217 / 255, 163 / 255],
+            [1000, 255 / 255, 217 / 255, 163 / 255],
+        ],
+        "opacity": [[-1000, 0], [-400, 0], [400, 1], [1000, 1]],
+        "gradient_opacity": [[0, 1], [255, 1]],
+    },
+}
+
+def validate_preset(preset: Dict) -> None:
+    for name, size in (("colour", 4), ("opacity", 2), ("gradient_opacity", 2)):
+        points = preset.get(name)
+        if points is None and name == "gradient_opacity":
+            continue
+        if not points or any(len(point) != size for point in points):
+            raise ValueError("%s needs a list of points of %d values" % (name, size))
+        if any(a[0] > b[0] for a, b in zip(points, points[1:])):
+            raise ValueError("the points of %s are not sorted" % name)
+
+def load_preset(path: str) -> Dict:
+    """
+    Reads a preset from a JSON file with the keys of PRESETS (and optionally those of
+    LIGHTING). The name of the preset is the name of the file.
+    """
+    with open(path) as f:
+        preset = json.load(f)
+    validate_preset(preset)
+    return preset
+
+def load_presets(directory: str) -> List[str]:
+    """
+    Adds the presets of the JSON files of directory to PRESETS, replacing the built-in
+    presets of the same name, and returns their names.
+    """
+    names = []
+    for filename in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(filename)
+        if extension == PRESET_EXTENSION:
+            PRESETS[name] = load_preset(os.path.join(directory, filename))
+            names.append(name)
+    return names
+
+def simplify_points(points: List[List[float]]) -> List[List[float]]:
+    # A point on the line through its neighbours does not change the interpolation.
+    if len(points) < 3:
+        return [list(point) for point in points]
+    simplified = [list(points[0])]
+    for point, following in zip(points[1:-1], points[2:]):
+        previous = simplified[-1]
+        dx = following[0] - previous[0]
+        t = (point[0] - previous[0]) / dx if dx else 0.0
+        interpolated = [a + t * (b - a) for a, b in zip(previous[1:], following[1:])]
+        if dx == 0 or any(abs(v - i) > SIMPLIFY_TOLERANCE for v, i in zip(point[1:], interpolated)):
+            simplified.append(list(point))
+    simplified.append(list(points[-1]))
+    return simplified
+
+def analyse_preset(preset: Dict) -> Dict:
+    """
+    Returns the preset ready to render: its points simplified, the lighting defaults
+    filled in, and a constant gradient opacity folded into the scalar opacity, so the
+    mapper does not compute gradient magnitudes for it ("gradient_opacity" is None).
+    Without shading either, the ray casters skip the gradients altogether.
+    """
+    analysed = dict(LIGHTING)
+    analysed.update(preset)
+    analysed["colour"] = simplify_points(preset["colour"])
+    opacity = simplify_points(preset["opacity"])
+    gradient_opacity = preset.get("gradient_opacity")
+    if gradient_opacity is not None:
+        values = {value for x, value in gradient_opacity}
+        if len(values) == 1:
+            factor = values.pop()
+            if factor != 1:
+                opacity = [[x, value * factor] for x, value in opacity]
+            gradient_opacity = None
+        else:
+            gradient_opacity = simplify_points(gradient_opacity)
+    analysed["opacity"] = opacity
+    analysed["gradient_opacity"] = gradient_opacity
+    return analysed
+
+def fill_transfer_function(
+    preset: Dict,
+    scalar_color: vtkColorTransferFunction,
+    scalar_opacity: vtkPiecewiseFunction,
+    gradient_opacity: vtkPiecewiseFunction,
+) -> None:
+    """
+    Replaces the points of the functions with those of an analysed preset, in place,
+    so the volume properties using them keep them.
+    """
+    scalar_color.RemoveAllPoints()
+    for x, r, g, b in preset["colour"]:
+        scalar_color.AddRGBPoint(x, r, g, b)
+    scalar_opacity.RemoveAllPoints()
+    for x, value in preset["opacity"]:
+        scalar_opacity.AddPoint(x, value)
+    gradient_opacity.RemoveAllPoints()
+    for x, value in preset["gradient_opacity"] or [[0, 1], [255, 1]]:
+        gradient_opacity.AddPoint(x, value)
+
+def apply_lighting(preset: Dict, volume_properties: vtkVolumeProperty) -> None:
+    volume_properties.SetShade(preset["shade"])
+    volume_properties.SetAmbient(preset["ambient"])
+    volume_properties.SetDiffuse(preset["diffuse"])
+    volume_properties.SetSpecular(preset["specular"])
+    volume_properties.SetSpecularPower(preset["specular_power"])
+    volume_properties.SetDisableGradientOpacity(preset["gradient_opacity"] is None)
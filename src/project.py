@@ -1,6 +1,6 @@
-from utils import Singleton
+from utils import StudySingleton
 
-class Project(metaclass=Singleton):
+class Project(metaclass=StudySingleton):
     def __init__(self) -> None:
         self.modality = "CT"
         self.window_level = -650
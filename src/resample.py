@@ -0,0 +1,102 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+import numpy as np
+from numpy import ndarray
+
+import concurrency
+
+# Number of output slices processed by each task. It bounds the temporary memory
+# used by one worker to about chunk_size * dy * dx * 4 bytes per interpolation pass.
+RESAMPLE_CHUNK_SIZE = 8
+
+def get_isotropic_spacing(spacing: Tuple) -> Tuple:
+    s = min(spacing)
+    return (s, s, s)
+
+def get_resampled_shape(shape: Tuple, spacing: Tuple, new_spacing: Tuple) -> Tuple:
+    """
+    Returns the shape (dz, dy, dx) of the volume resampled to new_spacing. The spacings
+    are given as (x, y, z), as in vtkImageData, and the resampled grid keeps the origin.
+    """
+    dz, dy, dx = shape
+    nx = int(math.floor((dx - 1) * spacing[0] / new_spacing[0] + 1e-6)) + 1
+    ny = int(math.floor((dy - 1) * spacing[1] / new_spacing[1] + 1e-6)) + 1
+    nz = int(math.floor((dz - 1) * spacing[2] / new_spacing[2] + 1e-6)) + 1
+    return (nz, ny, nx)
+
+def _get_weights(n_in: int, n_out: int, step: float) -> Tuple[ndarray, ndarray, ndarray]:
+    # Index of the lower neighbour, of the upper neighbour and the weight of the upper
+    # one for each output position along an axis.
+    pos = np.arange(n_out, dtype=np.float64) * step
+    i0 = np.minimum(np.floor(pos).astype(np.intp), n_in - 1)
+    i1 = np.minimum(i0 + 1, n_in - 1)
+    w = (pos - i0).astype(np.float32)
+    return i0, i1, w
+
+def interpolate_axis(array: ndarray, axis: int, i0: ndarray, i1: ndarray, w: ndarray) -> ndarray:
+    a0 = np.take(array, i0, axis=axis).astype(np.float32, copy=False)
+    a1 = np.take(array, i1, axis=axis).astype(np.float32, copy=False)
+    shape = [1, 1, 1]
+    shape[axis] = -1
+    w = w.reshape(shape)
+    a1 -= a0
+    a1 *= w
+    a0 += a1
+    return a0
+
+def _resample_chunk(matrix, output, z_start, z_end, wz, wy, wx) -> None:
+    i0, i1, w = wz
+    i0 = i0[z_start:z_end]
+    i1 = i1[z_start:z_end]
+    w = w[z_start:z_end]
+
+    # Only the input slices used by this chunk are read.
+    z_min = int(i0[0])
+    z_max = int(i1[-1]) + 1
+    block = matrix[z_min:z_max]
+
+    tmp = interpolate_axis(block, 0, i0 - z_min, i1 - z_min, w)
+    tmp = interpolate_axis(tmp, 1, *wy)
+    tmp = interpolate_axis(tmp, 2, *wx)
+
+    if np.issubdtype(output.dtype, np.integer):
+        np.rint(tmp, out=tmp)
+        info = np.iinfo(output.dtype)
+        np.clip(tmp, info.min, info.max, out=tmp)
+    output[z_start:z_end] = tmp
+
+def resample_volume(
+    matrix: ndarray,
+    spacing: Tuple,
+    new_spacing: Tuple,
+    chunk_size: int = RESAMPLE_CHUNK_SIZE,
+    max_workers: int = None,
+) -> ndarray:
+    """
+    Resamples the volume matrix (dz, dy, dx) from spacing to new_spacing using trilinear
+    interpolation. The output is computed in chunks of chunk_size axial slices on a
+    thread pool, so the peak memory is the output plus one chunk per worker.
+    """
+    if max_workers is None:
+        max_workers = concurrency.get_threads()
+
+    dz, dy, dx = matrix.shape
+    shape = get_resampled_shape(matrix.shape, spacing, new_spacing)
+    nz, ny, nx = shape
+
+    wx = _get_weights(dx, nx, new_spacing[0] / spacing[0])
+    wy = _get_weights(dy, ny, new_spacing[1] / spacing[1])
+    wz = _get_weights(dz, nz, new_spacing[2] / spacing[2])
+
+    output = np.empty(shape, dtype=matrix.dtype)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_resample_chunk, matrix, output, z, min(z + chunk_size, nz), wz, wy, wx)
+            for z in range(0, nz, chunk_size)
+        ]
+        for future in futures:
+            # Re-raise any exception raised inside the workers.
+            future.result()
+    return output
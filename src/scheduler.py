@@ -0,0 +1,263 @@
+import collections
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Hashable
+
+from vtkmodules.vtkRenderingCore import vtkRenderWindowInteractor
+
+import instrumentation
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_IDLE = 2
+# Interval of the timer delivering the results, about a frame at 60 Hz.
+DELIVERY_INTERVAL_MS = 16
+# Time of each timer tick the completion handlers may take.
+FRAME_BUDGET_MS = 4.0
+# Ticks a handler that does not fit in the budget waits before it runs alone, so every
+# result gets through.
+MAX_STARVED_TICKS = 4
+# Idle tasks only start when there was no input for this time.
+IDLE_DELAY_MS = 150
+INPUT_EVENTS = (
+    "MouseMoveEvent",
+    "LeftButtonPressEvent",
+    "MiddleButtonPressEvent",
+    "RightButtonPressEvent",
+    "MouseWheelForwardEvent",
+    "MouseWheelBackwardEvent",
+    "KeyPressEvent",
+)
+# Weight of the last run in the estimate of the cost of a completion handler.
+COST_SMOOTHING = 0.3
+# Kinds of task whose handler cost is estimated; the oldest estimates are dropped.
+MAX_COST_KINDS = 64
+
+class Task:
+    """
+    Job of the scheduler. Cancelling a task removes it from the queue, or discards
+    its result if it is already running.
+    """
+    def __init__(self, function: Callable, args: tuple, priority: int, callback: Callable, key: Hashable, kind: Hashable = None) -> None:
+        self.function = function
+        self.args = args
+        self.priority = priority
+        self.callback = callback
+        self.key = key
+        # The callbacks are often new closures; the cost of the handler is estimated
+        # per function of the task, which is the same for every submission.
+        self.kind = kind if kind is not None else getattr(function, "__func__", function)
+        self.cancelled = False
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def Cancel(self) -> None:
+        self.cancelled = True
+
+    def IsCancelled(self) -> bool:
+        return self.cancelled
+
+class TaskScheduler:
+    """
+    Runs prioritised background jobs on worker threads while the VTK event loop runs.
+    The idle jobs (prefetching, cache warm-up) wait until the user stops interacting.
+    The completion handlers run on the UI thread from a repeating timer of the
+    interactor, within a time budget per tick, so they never delay a frame for long:
+    the results that do not fit are delivered on the next ticks.
+    """
+    def __init__(self, interactor: vtkRenderWindowInteractor, workers: int = 2, budget_ms: float = FRAME_BUDGET_MS) -> None:
+        self.interactor = interactor
+        # Interactors whose input delays the idle tasks, the one of the timer first.
+        self.input_interactors = [interactor]
+        self.budget_ms = budget_ms
+        self.condition = threading.Condition()
+        # Heap of (priority, sequence, task): the same priority runs in submission order.
+        self.queue = []
+        self.sequence = itertools.count()
+        # Tasks finished by the workers, waiting for their completion handler.
+        self.completed = collections.deque()
+        # Last task submitted with each key, which a new submission supersedes.
+        self.keys = {}
+        # Estimated cost in ms of the completion handlers, by kind of task.
+        self.costs = {}
+        # Ticks in a row no completion handler ran.
+        self.starved_ticks = 0
+        self.last_input = 0.0
+        self.running = False
+        self.threads = [threading.Thread(target=self.Work, name="scheduler-%d" % i, daemon=True) for i in range(workers)]
+        self.timer_id = None
+        # (interactor, observer tag) pairs.
+        self.observers = []
+        self.stats = {"submitted": 0, "completed": 0, "cancelled": 0, "failed": 0, "deferred": 0}
+
+    def Start(self) -> None:
+        if self.running:
+            return
+        self.running = True
+        for thread in self.threads:
+            thread.start()
+        for interactor in self.input_interactors:
+            self.ObserveInput(interactor)
+        self.observers.append((self.interactor, self.interactor.AddObserver("TimerEvent", self.OnTimer)))
+        # Timers need an initialized interactor; Start does it otherwise.
+        if not self.interactor.GetInitialized():
+            self.interactor.Initialize()
+        self.timer_id = self.interactor.CreateRepeatingTimer(DELIVERY_INTERVAL_MS)
+
+    def Stop(self) -> None:
+        with self.condition:
+            self.running = False
+            for priority, sequence, task in self.queue:
+                task.Cancel()
+            self.queue = []
+            self.condition.notify_all()
+        if self.timer_id is not None:
+            self.interactor.DestroyTimer(self.timer_id)
+            self.timer_id = None
+        for interactor, tag in self.observers:
+            interactor.RemoveObserver(tag)
+        self.observers = []
+        self.completed.clear()
+        self.keys = {}
+
+    def AddInputInteractor(self, interactor: vtkRenderWindowInteractor) -> None:
+        """
+        Delays the idle tasks on the input of another window too. The views of a
+        layout share one interactor, which is only observed once.
+        """
+        if interactor in self.input_interactors:
+            return
+        self.input_interactors.append(interactor)
+        if self.running:
+            self.ObserveInput(interactor)
+
+    def ObserveInput(self, interactor: vtkRenderWindowInteractor) -> None:
+        for event in INPUT_EVENTS:
+            self.observers.append((interactor, interactor.AddObserver(event, self.OnInput, 20.0)))
+
+    def Submit(
+        self,
+        function: Callable,
+        *args: Any,
+        priority: int = PRIORITY_NORMAL,
+        callback: Callable = None,
+        key: Hashable = None,
+        kind: Hashable = None,
+    ) -> Task:
+        """
+        Queues function(*args) and returns its task. callback(result) runs on the UI
+        thread when it finishes. A task with a key cancels the previous task of the
+        key, e.g. the prefetch of a slice that is no longer shown. The cost of the
+        callbacks is estimated per kind, by default the function.
+        """
+        task = Task(function, args, priority, callback, key, kind)
+        with self.condition:
+            if key is not None:
+                previous = self.keys.get(key)
+                if previous is not None:
+                    previous.Cancel()
+                self.keys[key] = task
+            heapq.heappush(self.queue, (priority, next(self.sequence), task))
+            self.stats["submitted"] += 1
+            self.condition.notify()
+        return task
+
+    def Cancel(self, key: Hashable) -> None:
+        with self.condition:
+            task = self.keys.pop(key, None)
+        if task is not None:
+            task.Cancel()
+
+    def IsIdle(self) -> bool:
+        return (time.perf_counter() - self.last_input) * 1000 >= IDLE_DELAY_MS
+
+    def GetNextTask(self) -> Task:
+        # Called with the condition held. Waits until a task can start.
+        while self.running:
+            while self.queue and self.queue[0][2].IsCancelled():
+                heapq.heappop(self.queue)
+                self.stats["cancelled"] += 1
+            if not self.queue:
+                self.condition.wait()
+            elif self.queue[0][0] >= PRIORITY_IDLE and not self.IsIdle():
+                # Idle tasks wait for the end of the interaction.
+                self.condition.wait(IDLE_DELAY_MS / 1000)
+            else:
+                return heapq.heappop(self.queue)[2]
+        return None
+
+    def Work(self) -> None:
+        while True:
+            with self.condition:
+                task = self.GetNextTask()
+            if task is None:
+                return
+            try:
+                task.result = task.function(*task.args)
+            except Exception as e:
+                task.error = e
+            task.done = True
+            self.completed.append(task)
+
+    def OnInput(self, obj: vtkRenderWindowInteractor, event: str) -> None:
+        self.last_input = time.perf_counter()
+
+    def OnTimer(self, obj: vtkRenderWindowInteractor, event: str) -> None:
+        if obj.GetTimerEventId() != self.timer_id or not self.completed:
+            return
+        with instrumentation.stage("scheduler callbacks"):
+            self.Deliver()
+
+    def Deliver(self) -> None:
+        start = time.perf_counter()
+        ran = False
+        while self.completed:
+            task = self.completed[0]
+            if task.IsCancelled():
+                self.completed.popleft()
+                self.Release(task)
+                self.stats["cancelled"] += 1
+                continue
+            remaining = self.budget_ms - (time.perf_counter() - start) * 1000
+            # A handler runs if its estimated cost fits in what is left of the budget.
+            # One that does not fit in a whole tick runs alone once no handler ran for
+            # MAX_STARVED_TICKS ticks.
+            if self.costs.get(task.kind, 0.0) > remaining and (ran or self.starved_ticks < MAX_STARVED_TICKS):
+                if not ran:
+                    self.starved_ticks += 1
+                self.stats["deferred"] += 1
+                return
+            self.completed.popleft()
+            self.Release(task)
+            ran = True
+            self.starved_ticks = 0
+            if task.error is not None:
+                self.stats["failed"] += 1
+                traceback.print_exception(task.error)
+                continue
+            self.stats["completed"] += 1
+            if task.callback is not None:
+                callback_start = time.perf_counter()
+                task.callback(task.result)
+                cost = (time.perf_counter() - callback_start) * 1000
+                previous = self.costs.pop(task.kind, cost)
+                # Re-inserted last, so the dict is ordered by the last use of each kind.
+                self.costs[task.kind] = previous + COST_SMOOTHING * (cost - previous)
+                while len(self.costs) > MAX_COST_KINDS:
+                    del self.costs[next(iter(self.costs))]
+
+    def Release(self, task: Task) -> None:
+        # The key is free for the next submission.
+        if self.keys.get(task.key) is task:
+            del self.keys[task.key]
+
+    def GetStats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        with self.condition:
+            stats["queued"] = len(self.queue)
+        stats["waiting"] = len(self.completed)
+        return stats
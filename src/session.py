@@ -0,0 +1,167 @@
+import cProfile
+import json
+import time
+from typing import Dict, List
+
+from vtkmodules.vtkRenderingCore import vtkRenderWindowInteractor
+
+import events
+import instrumentation
+
+# Input events captured from the interactors of the viewers.
+RECORDED_EVENTS = (
+    "MouseMoveEvent",
+    "LeftButtonPressEvent",
+    "LeftButtonReleaseEvent",
+    "MiddleButtonPressEvent",
+    "MiddleButtonReleaseEvent",
+    "RightButtonPressEvent",
+    "RightButtonReleaseEvent",
+    "MouseWheelForwardEvent",
+    "MouseWheelBackwardEvent",
+    "KeyPressEvent",
+    "KeyReleaseEvent",
+    "CharEvent",
+)
+
+def get_interactors(slice_viewer=None, volume_viewer=None) -> Dict[str, vtkRenderWindowInteractor]:
+    interactors = {}
+    if slice_viewer is not None and slice_viewer.layout is not None:
+        # The views of a layout share one interactor, which routes the events by position.
+        interactors["LAYOUT"] = slice_viewer.layout.interactor
+    elif slice_viewer is not None:
+        interactors["AXIAL"] = slice_viewer.interactor_axial
+        interactors["CORONAL"] = slice_viewer.interactor_coronal
+        interactors["SAGITAL"] = slice_viewer.interactor_sagital
+    if volume_viewer is not None and volume_viewer.interactor not in interactors.values():
+        interactors["VOLUME"] = volume_viewer.interactor
+    return interactors
+
+class SessionRecorder:
+    """
+    Records the timestamped input events of the interactors of the viewers. The
+    observers are added to the interactors, so the events are seen by the recorder
+    before the interactor styles handle them, whatever style is active.
+    """
+    def __init__(self, interactors: Dict[str, vtkRenderWindowInteractor]) -> None:
+        self.interactors = interactors
+        self.events = []
+        self.observers = []
+        self.start_time = None
+
+    def Start(self) -> None:
+        self.start_time = time.perf_counter()
+        for view, interactor in self.interactors.items():
+            for event in RECORDED_EVENTS:
+                # The closure keeps the name of the view that generated the event.
+                callback = lambda obj, evt, view=view: self.OnEvent(view, obj, evt)
+                tag = interactor.AddObserver(event, callback, 1.0)
+                self.observers.append((interactor, tag))
+
+    def Stop(self) -> None:
+        for interactor, tag in self.observers:
+            interactor.RemoveObserver(tag)
+        self.observers = []
+
+    def OnEvent(self, view: str, interactor: vtkRenderWindowInteractor, event: str) -> None:
+        x, y = interactor.GetEventPosition()
+        self.events.append(
+            {
+                "t": time.perf_counter() - self.start_time,
+                "view": view,
+                "event": event,
+                "x": x,
+                "y": y,
+                "ctrl": interactor.GetControlKey(),
+                "shift": interactor.GetShiftKey(),
+                "key": interactor.GetKeySym() or "",
+                "keycode": ord(interactor.GetKeyCode() or "\0"),
+            }
+        )
+
+    def GetWindowSizes(self) -> Dict[str, List[int]]:
+        return {view: list(i.GetRenderWindow().GetSize()) for view, i in self.interactors.items()}
+
+    def Save(self, path: str) -> None:
+        """
+        Saves the session as JSON lines: a header with the window sizes followed by one
+        line per event.
+        """
+        with open(path, "w") as f:
+            f.write(json.dumps({"window_sizes": self.GetWindowSizes()}) + "\n")
+            for event in self.events:
+                f.write(json.dumps(event) + "\n")
+
+def load_session(path: str) -> Dict:
+    with open(path) as f:
+        header = json.loads(f.readline())
+        events = [json.loads(line) for line in f if line.strip()]
+    header["events"] = events
+    return header
+
+class SessionReplayer:
+    """
+    Drives a recorded event stream into the interactors of (usually offscreen) viewers,
+    as fast as possible or in real time, measuring the time each event takes to be
+    handled, including the renders it causes.
+    """
+    def __init__(self, interactors: Dict[str, vtkRenderWindowInteractor]) -> None:
+        self.interactors = interactors
+
+    def SetWindowSizes(self, window_sizes: Dict[str, List[int]]) -> None:
+        # Event positions are only meaningful with the window sizes of the recording.
+        for view, size in window_sizes.items():
+            if view in self.interactors:
+                self.interactors[view].GetRenderWindow().SetSize(*size)
+
+    def Replay(self, session: Dict, realtime: bool = False, profile_path: str = None) -> Dict:
+        self.SetWindowSizes(session.get("window_sizes", {}))
+
+        was_enabled = instrumentation.is_enabled()
+        instrumentation.enable(True)
+        instrumentation.reset()
+
+        histograms = {}
+        profiler = cProfile.Profile() if profile_path else None
+        if profiler is not None:
+            profiler.enable()
+
+        start = time.perf_counter()
+        for event in session["events"]:
+            interactor = self.interactors.get(event["view"])
+            if interactor is None:
+                continue
+            if realtime:
+                delay = event["t"] - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+
+            interactor.SetEventInformation(
+                event["x"], event["y"], event["ctrl"], event["shift"], chr(event["keycode"]), 0, event["key"]
+            )
+            t0 = time.perf_counter()
+            interactor.InvokeEvent(event["event"])
+            # The work the event posted to the next frame is part of its cost.
+            events.flush_all()
+            elapsed = (time.perf_counter() - t0) * 1000
+
+            histogram = histograms.get(event["event"])
+            if histogram is None:
+                histogram = histograms[event["event"]] = instrumentation.Histogram()
+            histogram.add(elapsed)
+        total = time.perf_counter() - start
+
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+
+        report = {
+            "events": len(session["events"]),
+            "total_s": total,
+            "recorded_s": session["events"][-1]["t"] if session["events"] else 0.0,
+            "event_latency": {name: h.to_dict() for name, h in sorted(histograms.items())},
+            "instrumentation": instrumentation.get_report(),
+            "event_bus": {study_id: dict(bus.stats) for study_id, bus in events.EventBus.instances.items()},
+        }
+        instrumentation.enable(was_enabled)
+        return report
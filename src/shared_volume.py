@@ -0,0 +1,126 @@
+import atexit
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+from numpy import ndarray
+
+import concurrency
+
+# Axial slabs copied at a time to a segment, so bricked and compressed volumes are
+# never decoded whole.
+SHARED_COPY_SLAB = 32
+# Axial slices of the volume given to each task of map_chunks.
+MAP_CHUNK_SIZE = 16
+
+_sequence = itertools.count()
+# Segments created by this process, by name, and segments attached to.
+_owned = {}
+_attached = {}
+
+class SharedArray:
+    """
+    Array in a named shared memory segment owned by this process. Other processes
+    attach to it from its descriptor (see attach) without copying it. The segment is
+    removed by Release, at exit for those still alive, and by the resource tracker of
+    multiprocessing if the process crashes.
+    """
+    def __init__(self, shape: tuple, dtype) -> None:
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        name = "mpr_%d_%d" % (os.getpid(), next(_sequence))
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self.shm.name
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        _owned[self.name] = self
+
+    def Describe(self, **extra) -> Dict:
+        """
+        Returns the picklable descriptor of the array (name, shape, dtype) with the
+        extra items, e.g. the spacing of a volume.
+        """
+        descriptor = {"name": self.name, "shape": tuple(self.array.shape), "dtype": self.array.dtype.str}
+        descriptor.update(extra)
+        return descriptor
+
+    def Release(self) -> None:
+        if _owned.pop(self.name, None) is None:
+            return
+        self.array = None
+        # The name is removed at once; the memory is freed when the last array using
+        # the segment is.
+        self.shm.unlink()
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+
+def share_array(matrix) -> SharedArray:
+    """
+    Copies matrix (an ndarray or any volume supporting the slicing of axial slabs)
+    to a new segment.
+    """
+    shared = SharedArray(matrix.shape, matrix.dtype)
+    for z in range(0, matrix.shape[0], SHARED_COPY_SLAB):
+        shared.array[z : z + SHARED_COPY_SLAB] = matrix[z : z + SHARED_COPY_SLAB]
+    return shared
+
+def find_shared(matrix) -> SharedArray:
+    # The segment of an array created by this process, if it is one.
+    for shared in _owned.values():
+        if shared.array is matrix:
+            return shared
+    return None
+
+def attach(descriptor: Dict) -> ndarray:
+    """
+    Returns a read only view of the array of a descriptor, in any process. The
+    segment stays mapped until the process exits.
+    """
+    name = descriptor["name"]
+    shm = _attached.get(name)
+    if shm is None:
+        shm = _attached[name] = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(descriptor["shape"], dtype=descriptor["dtype"], buffer=shm.buf)
+    array.flags.writeable = False
+    return array
+
+def release_all() -> None:
+    for shared in list(_owned.values()):
+        shared.Release()
+
+atexit.register(release_all)
+
+# Volume of the worker processes of map_chunks, set by _init_worker.
+_worker = {}
+
+def _init_worker(descriptor: Dict) -> None:
+    _worker["matrix"] = attach(descriptor)
+
+def _run_chunk(function: Callable, z_start: int, z_end: int, args: tuple) -> Any:
+    return function(_worker["matrix"][z_start:z_end], z_start, *args)
+
+def map_chunks(
+    function: Callable,
+    descriptor: Dict,
+    *args: Any,
+    chunk_size: int = MAP_CHUNK_SIZE,
+    workers: int = None,
+) -> List:
+    """
+    Runs function(chunk, z_start, *args) over the chunks of chunk_size axial slices
+    of the shared volume of descriptor on a process pool, and returns the results in
+    the order of the chunks. function must be picklable (defined at the top level of
+    a module); the workers read the volume from the segment, the chunks are never
+    copied between the processes.
+    """
+    dz = descriptor["shape"][0]
+    with ProcessPoolExecutor(workers or concurrency.get_threads(), initializer=_init_worker, initargs=(descriptor,)) as executor:
+        futures = [
+            executor.submit(_run_chunk, function, z, min(z + chunk_size, dz), args)
+            for z in range(0, dz, chunk_size)
+        ]
+        return [future.result() for future in futures]
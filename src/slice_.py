@@ -1,11 +1,27 @@
 import numpy as np
 from numpy import ndarray
-import vtk
+from typing import TYPE_CHECKING, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from vtkmodules.vtkCommonDataModel import vtkImageData
+from vtkmodules.vtkImagingColor import vtkImageMapToWindowLevelColors
+from vtkmodules.vtkImagingCore import vtkImageCast
+from vtkmodules.util import numpy_support
+from pubsub import pub as Publisher
 
 import utils
+import constants as const
 import converters
+import fusion
+import instrumentation
+import resample
+import shared_volume
+from measures import SummedAreaTable
+from memory import MemoryManager
 from project import Project
 
+if TYPE_CHECKING:
+    from vtkmodules.vtkInteractionWidgets import vtkImagePlaneWidget
+
 class SliceBuffer:
     """
     This class is used as buffer that mantains the vtkImageData and numpy array
@@ -17,6 +33,7 @@ class SliceBuffer:
         self.mask = None
         self.vtk_image = None
         self.vtk_mask = None
+        self.sat = None
 
     def discard_vtk_mask(self) -> None:
         self.vtk_mask = None
@@ -29,6 +46,22 @@ class SliceBuffer:
 
     def discard_image(self) -> None:
         self.image = None
+        self.sat = None
+
+    def discard_sat(self) -> None:
+        self.sat = None
+
+    def get_size(self) -> int:
+        size = 0
+        for array in (self.image, self.mask):
+            if array is not None:
+                size += array.nbytes
+        for image in (self.vtk_image, self.vtk_mask):
+            if image is not None:
+                size += image.GetActualMemorySize() * 1024
+        if self.sat is not None:
+            size += self.sat.table_sum.nbytes + self.sat.table_sum_sq.nbytes
+        return size
 
     def discard_buffer(self) -> None:
         self.index = -1
@@ -36,23 +69,315 @@ class SliceBuffer:
         self.mask = None
         self.vtk_image = None
         self.vtk_mask = None
+        self.sat = None
 
-class Slice(metaclass=utils.Singleton):
+class Slice(metaclass=utils.StudySingleton):
     def __init__(self) -> None:
+        self.study_id = utils.get_active_study()
+        self.project = Project()
+
         self.matrix = None
         self.spacing = (1.0, 1.0, 1.0)
         self.center = [0, 0, 0]
+        # Patient position of the first voxel, which the fusion layers are placed from.
+        self.origin = (0.0, 0.0, 0.0)
+        # Secondary volume blended over the slices at opacity (see SetFusion).
+        self.fusion = None
         self.opacity = 0.8
 
+        # The volume as loaded and the resampled copies of it, keyed by spacing.
+        self.matrix_native = None
+        self.spacing_native = None
+        self.resampled_matrices = {}
+        # The in-memory volumes are kept in shared memory segments (see ShareVolume).
+        self.shared_memory = False
+
+        # 4D volumes: the phases (phase, dz, dy, dx) share the geometry and matrix is
+        # a view of the phase shown. The slices shown are extracted ahead of time in
+        # the neighbouring phases, keyed by (orientation, phase, slice number).
+        self.phases = None
+        self.phase = 0
+        self.phase_prefetched = {}
+        self.phase_executor = None
+        # Counts the phase sets loaded, so the extractions of a replaced one are dropped.
+        self.phase_generation = 0
+
         self.buffer_slices = {
             "AXIAL": SliceBuffer(),
             "CORONAL": SliceBuffer(),
             "SAGITAL": SliceBuffer()
         }
 
-    def do_ww_wl(self, image: vtk.vtkImageData) -> vtk.vtkImageData:
-        project = Project()
-        colorer = vtk.vtkImageMapToWindowLevelColors()
+        self.__bind_events()
+        self.__register_caches()
+
+    def __bind_events(self) -> None:
+        Publisher.subscribe(self.SetSpacing, utils.get_topic("Set volume spacing", self.study_id))
+        Publisher.subscribe(self.SetPhase, utils.get_topic("Set phase", self.study_id))
+        Publisher.subscribe(self.SetFusionOpacity, utils.get_topic("Set fusion opacity", self.study_id))
+
+    def __register_caches(self) -> None:
+        memory_manager = MemoryManager()
+        memory_manager.RegisterCache(
+            self.study_id,
+            "slice buffers",
+            lambda: sum(buffer.get_size() for buffer in self.buffer_slices.values()),
+            self.discard_all_buffers,
+        )
+        memory_manager.RegisterCache(
+            self.study_id,
+            "resampled volumes",
+            lambda: sum(m.nbytes for m in self.resampled_matrices.values() if m is not self.matrix),
+            self.discard_resampled_matrices,
+        )
+        memory_manager.RegisterCache(
+            self.study_id,
+            "volume cache",
+            lambda: getattr(self.matrix, "cache_nbytes", 0),
+            lambda: self.matrix.clear_cache(),
+        )
+        # The downsampled copy of a bricked or compressed volume given to the 3D view,
+        # the only volume pyramid level the viewer keeps in memory.
+        memory_manager.RegisterCache(
+            self.study_id,
+            "volume preview",
+            lambda: self.get_preview_size(),
+            self.discard_preview,
+        )
+        memory_manager.RegisterCache(
+            self.study_id,
+            "fusion layers",
+            lambda: self.fusion.get_size() if self.fusion is not None else 0,
+            lambda: self.fusion.clear_cache() if self.fusion is not None else None,
+        )
+
+    def get_preview_size(self) -> int:
+        preview = getattr(self.matrix, "preview", None)
+        return preview[0].nbytes if preview is not None else 0
+
+    def discard_preview(self) -> None:
+        # Downsampled again from the bricks when the 3D view needs it.
+        if getattr(self.matrix, "preview", None) is not None:
+            self.matrix.preview = None
+
+    def discard_resampled_matrices(self) -> None:
+        # The resampled volume being shown is kept.
+        for m in self.resampled_matrices.values():
+            shared = shared_volume.find_shared(m)
+            if m is not self.matrix and shared is not None:
+                shared.Release()
+        self.resampled_matrices = {
+            spacing: m for spacing, m in self.resampled_matrices.items() if m is self.matrix
+        }
+
+    def __share(self, matrix):
+        # Bricked, compressed and memory mapped volumes are left where they are.
+        if type(matrix) is not ndarray or shared_volume.find_shared(matrix) is not None:
+            return matrix
+        return shared_volume.share_array(matrix).array
+
+    def ShareVolume(self) -> None:
+        """
+        Moves the in-memory volume and its resampled copies, and those resampled from
+        now on, to shared memory, so worker processes attach to them (see
+        GetSharedDescriptor) instead of receiving a copy.
+        """
+        self.shared_memory = True
+        native_is_shown = self.matrix is self.matrix_native
+        shared = {}
+        for spacing, m in self.resampled_matrices.items():
+            shared[spacing] = self.__share(m)
+            if m is self.matrix:
+                self.matrix = shared[spacing]
+        self.resampled_matrices = shared
+        if self.matrix_native is not None:
+            self.matrix_native = self.__share(self.matrix_native)
+            if native_is_shown:
+                self.matrix = self.matrix_native
+        self.matrix = self.__share(self.matrix)
+        self.discard_all_buffers()
+
+    def GetSharedDescriptor(self) -> Dict:
+        """
+        Descriptor of the shared volume shown, with its spacing, for shared_volume.attach
+        in another process; None if the volume is not in shared memory.
+        """
+        shared = shared_volume.find_shared(self.matrix)
+        if shared is None:
+            return None
+        return shared.Describe(spacing=tuple(self.spacing))
+
+    def discard_all_buffers(self) -> None:
+        for buffer in self.buffer_slices.values():
+            buffer.discard_buffer()
+
+    def discard_vtk_images(self) -> None:
+        # The extracted slices are kept, only the coloured images are built again.
+        for buffer in self.buffer_slices.values():
+            buffer.discard_vtk_image()
+
+    def SetFusion(self, matrix, spacing: Tuple, origin: Tuple = (0.0, 0.0, 0.0), lut: str = fusion.DEFAULT_LUT, window: Tuple = None) -> None:
+        """
+        Blends the secondary volume matrix (e.g. a PET) of spacing (x, y, z) and first
+        voxel at the patient position origin over the slices, coloured with lut; None
+        removes it. The slices of the secondary are resampled when they are shown.
+        """
+        if matrix is None:
+            self.fusion = None
+        else:
+            offset = tuple(o - p for o, p in zip(origin, self.origin))
+            self.fusion = fusion.FusionLayer(matrix, spacing, offset, lut, window)
+        self.discard_vtk_images()
+
+    def SetFusionOpacity(self, opacity: float) -> None:
+        opacity = min(max(opacity, 0.0), 1.0)
+        if opacity == self.opacity:
+            return
+        self.opacity = opacity
+        # The cached layers are blended again, without resampling.
+        self.discard_vtk_images()
+        Publisher.sendMessage(utils.get_topic("Change fusion", self.study_id))
+
+    def SetSpacing(self, spacing=None) -> None:
+        """
+        Switches the data shown by the viewers between the native volume (spacing is None)
+        and a copy resampled to spacing (x, y, z). The resampled copies are cached, so
+        switching back and forth only resamples once.
+        """
+        if self.phases is not None:
+            # 4D volumes are shown at their native spacing.
+            return
+        known_matrices = [self.matrix_native, *self.resampled_matrices.values()]
+        if not any(self.matrix is m for m in known_matrices):
+            # A new volume was loaded.
+            # The segments of the previous volume are released.
+            for m in known_matrices:
+                shared = shared_volume.find_shared(m)
+                if shared is not None:
+                    shared.Release()
+            if self.shared_memory:
+                self.matrix = self.__share(self.matrix)
+            self.matrix_native = self.matrix
+            self.spacing_native = tuple(self.spacing)
+            self.resampled_matrices = {}
+
+        if spacing is None or tuple(spacing) == self.spacing_native:
+            matrix = self.matrix_native
+            spacing = self.spacing_native
+        else:
+            spacing = tuple(float(i) for i in spacing)
+            if spacing not in self.resampled_matrices:
+                matrix = resample.resample_volume(self.matrix_native, self.spacing_native, spacing)
+                if self.shared_memory:
+                    matrix = self.__share(matrix)
+                self.resampled_matrices[spacing] = matrix
+            matrix = self.resampled_matrices[spacing]
+
+        if matrix is self.matrix:
+            return
+
+        old_spacing = tuple(self.spacing)
+        self.matrix = matrix
+        self.spacing = spacing
+        dz, dy, dx = matrix.shape
+        self.center = [(dx - 1) * spacing[0] / 2, (dy - 1) * spacing[1] / 2, (dz - 1) * spacing[2] / 2]
+        self.discard_all_buffers()
+
+        Publisher.sendMessage(utils.get_topic("Reload volume data", self.study_id), old_spacing=old_spacing)
+
+    def SetPhases(self, phases: ndarray, spacing: Tuple) -> None:
+        """
+        Loads a 4D volume (phase, dz, dy, dx), in memory or memory mapped.
+        """
+        self.phases = phases
+        self.spacing = tuple(spacing)
+        self.phase = 0
+        self.matrix = phases[0]
+        dz, dy, dx = self.matrix.shape
+        self.center = [(dx - 1) * spacing[0] / 2, (dy - 1) * spacing[1] / 2, (dz - 1) * spacing[2] / 2]
+        # The slices prefetched in the previous phases are not extracted, and those
+        # being extracted are dropped when done.
+        for future in self.phase_prefetched.values():
+            future.cancel()
+        self.phase_prefetched = {}
+        self.phase_generation += 1
+        if self.phase_executor is None:
+            self.phase_executor = ThreadPoolExecutor(max_workers=1)
+        self.discard_all_buffers()
+
+    def GetNumberOfPhases(self) -> int:
+        if self.phases is None:
+            return 1
+        return len(self.phases)
+
+    def SetPhase(self, phase: int, update_3d: bool = True) -> None:
+        """
+        Shows another phase of a 4D volume. The phases share the geometry, so only the
+        buffered slices change; they are taken from the prefetch when ready.
+        """
+        if self.phases is None:
+            return
+        phase = phase % len(self.phases)
+        if phase == self.phase:
+            return
+        self.phase = phase
+        self.matrix = self.phases[phase]
+        for orientation, buffer in self.buffer_slices.items():
+            slice_number = buffer.index
+            buffer.discard_buffer()
+            n_image = self.GetPrefetchedImage(orientation, phase, slice_number)
+            if n_image is not None:
+                self.SetBufferImage(orientation, slice_number, n_image)
+
+        Publisher.sendMessage(utils.get_topic("Change phase", self.study_id), phase=phase, update_3d=update_3d)
+
+    def PrefetchPhases(self, orientation: str, slice_number: int) -> None:
+        """
+        Extracts the slice in the PHASE_PREFETCH phases after and before the one shown.
+        """
+        n = len(self.phases)
+        wanted = set()
+        for step in range(1, const.PHASE_PREFETCH + 1):
+            wanted.add((orientation, (self.phase + step) % n, slice_number))
+            wanted.add((orientation, (self.phase - step) % n, slice_number))
+        wanted.discard((orientation, self.phase, slice_number))
+
+        # The slices of the orientation that left the window are dropped.
+        for key in list(self.phase_prefetched):
+            if key[0] == orientation and key not in wanted:
+                self.phase_prefetched.pop(key).cancel()
+        for key in wanted:
+            if key not in self.phase_prefetched:
+                self.phase_prefetched[key] = self.phase_executor.submit(
+                    self.extract_phase_slice, self.phase_generation, orientation, slice_number, self.phases[key[1]]
+                )
+
+    def extract_phase_slice(self, generation: int, orientation: str, slice_number: int, matrix: ndarray) -> ndarray:
+        # Task of the prefetch, None when the phases were replaced in the meantime.
+        if generation != self.phase_generation:
+            return None
+        n_image = self.extract_image_slice(orientation, slice_number, 1, matrix)
+        if generation != self.phase_generation:
+            return None
+        return n_image
+
+    def GetPrefetchedImage(self, orientation: str, phase: int, slice_number: int) -> ndarray:
+        future = self.phase_prefetched.get((orientation, phase, slice_number))
+        if future is None or not future.done() or future.cancelled() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def IsPhaseReady(self, phase: int) -> bool:
+        # The slices shown in every orientation are prefetched in the phase.
+        return all(
+            buffer.index == -1 or self.GetPrefetchedImage(orientation, phase, buffer.index) is not None
+            for orientation, buffer in self.buffer_slices.items()
+        )
+
+    @instrumentation.timed("do_ww_wl")
+    def do_ww_wl(self, image: vtkImageData) -> vtkImageData:
+        project = self.project
+        colorer = vtkImageMapToWindowLevelColors()
         colorer.SetInputData(image)
         colorer.SetWindow(project.window_width)
         colorer.SetLevel(project.window_level)
@@ -60,23 +385,88 @@ class Slice(metaclass=utils.Singleton):
         colorer.Update()
         return colorer.GetOutput()
 
+    @instrumentation.timed("fusion")
+    def do_fusion(self, image: vtkImageData, orientation: str, slice_number: int) -> vtkImageData:
+        if self.fusion is None or self.opacity <= 0:
+            return image
+        n_rgb = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+        n_fused = self.fusion.Blend(n_rgb, orientation, slice_number, self.matrix.shape, self.spacing, self.opacity)
+        fused = vtkImageData()
+        fused.CopyStructure(image)
+        fused.GetPointData().SetScalars(numpy_support.numpy_to_vtk(n_fused, deep=1))
+        return fused
+
+    @instrumentation.timed("slice extraction")
     def get_image_slice(self, orientation: str, slice_number: int, number_slices=1) -> ndarray:
-        dz, dy, dx = self.matrix.shape
         if self.buffer_slices[orientation].index == slice_number and self.buffer_slices[orientation].image is not None:
             n_image = self.buffer_slices[orientation].image
         else:
-            if orientation == "AXIAL":
-                tmp_array = np.array(self.matrix[slice_number : slice_number + number_slices])
-                n_image = tmp_array.reshape(dy, dx)
-            elif orientation == "CORONAL":
-                tmp_array = np.array(self.matrix[:, slice_number : slice_number + number_slices, :])
-                n_image = tmp_array.reshape(dz, dx)
-            elif orientation == "SAGITAL":
-                tmp_array = np.array(self.matrix[:, :, slice_number : slice_number + number_slices])
-                n_image = tmp_array.reshape(dz, dy)
+            n_image = self.extract_image_slice(orientation, slice_number, number_slices)
             self.buffer_slices[orientation].image = n_image
+            # The summed-area tables belong to the previous image.
+            self.buffer_slices[orientation].discard_sat()
+        return n_image
+
+    def extract_image_slice(self, orientation: str, slice_number: int, number_slices=1, matrix=None) -> ndarray:
+        """
+        Extracts a slice from the volume (or from matrix, e.g. another phase) without
+        touching the buffers, so it can be called from other threads.
+        """
+        if matrix is None:
+            matrix = self.matrix
+        dz, dy, dx = matrix.shape
+        if orientation == "AXIAL":
+            tmp_array = np.array(matrix[slice_number : slice_number + number_slices])
+            n_image = tmp_array.reshape(dy, dx)
+        elif orientation == "CORONAL":
+            tmp_array = np.array(matrix[:, slice_number : slice_number + number_slices, :])
+            n_image = tmp_array.reshape(dz, dx)
+        elif orientation == "SAGITAL":
+            tmp_array = np.array(matrix[:, :, slice_number : slice_number + number_slices])
+            n_image = tmp_array.reshape(dz, dy)
         return n_image
 
+    def SetBufferImage(self, orientation: str, slice_number: int, n_image: ndarray) -> None:
+        """
+        Puts a slice extracted ahead of time in the buffer of the orientation, so the
+        next GetSlices of slice_number does not extract it again.
+        """
+        buffer = self.buffer_slices[orientation]
+        if buffer.index == slice_number and buffer.image is not None:
+            return
+        buffer.discard_buffer()
+        buffer.index = slice_number
+        buffer.image = n_image
+
+    def GetSummedAreaTable(self, orientation: str) -> SummedAreaTable:
+        """
+        Returns the summed-area tables of the actual slice of the orientation. They are
+        built on the first request and kept in the buffer until the slice changes.
+        """
+        buffer = self.buffer_slices[orientation]
+        if buffer.sat is None:
+            n_image = self.get_image_slice(orientation, buffer.index)
+            buffer.sat = SummedAreaTable(n_image)
+        return buffer.sat
+
+    def SetSummedAreaTable(self, orientation: str, n_image: ndarray, sat: SummedAreaTable) -> None:
+        """
+        Puts the summed-area tables of n_image built in the background in the buffer,
+        unless the slice changed meanwhile.
+        """
+        buffer = self.buffer_slices[orientation]
+        if buffer.image is n_image and buffer.sat is None:
+            buffer.sat = sat
+
+    def GetVolumeMatrix(self) -> Tuple[ndarray, Tuple]:
+        """
+        Returns the volume used by the 3D viewers and its spacing. A volume that is not
+        in memory (e.g. a BrickedVolume) is replaced by a downsampled copy.
+        """
+        if isinstance(self.matrix, ndarray):
+            return self.matrix, self.spacing
+        return self.matrix.get_preview()
+
     def GetNumberOfSlices(self, orientation: str) -> int:
         shape = self.matrix.shape
         if orientation == "AXIAL":
@@ -95,7 +485,7 @@ class Slice(metaclass=utils.Singleton):
         elif orientation == "SAGITAL":
             return shape[2] - 1
 
-    def GetSlices(self, orientation: str, slice_number: int, number_slices: int) -> vtk.vtkImageData:
+    def GetSlices(self, orientation: str, slice_number: int, number_slices: int) -> vtkImageData:
         if self.buffer_slices[orientation].index == slice_number:
             if self.buffer_slices[orientation].vtk_image:
                 image = self.buffer_slices[orientation].vtk_image
@@ -103,22 +493,23 @@ class Slice(metaclass=utils.Singleton):
                 n_image = self.get_image_slice(orientation, slice_number, number_slices)
                 image = converters.to_vtk(n_image, self.spacing, slice_number, orientation)
                 ww_wl_image = self.do_ww_wl(image)
-                image = ww_wl_image
+                image = self.do_fusion(ww_wl_image, orientation, slice_number)
             self.buffer_slices[orientation].vtk_image = image
         else:
             n_image = self.get_image_slice(orientation, slice_number, number_slices)
             image = converters.to_vtk(n_image, self.spacing, slice_number, orientation)
             ww_wl_image = self.do_ww_wl(image)
-            image = ww_wl_image
+            image = self.do_fusion(ww_wl_image, orientation, slice_number)
             self.buffer_slices[orientation].vtk_image = image
             self.buffer_slices[orientation].index = slice_number
         return image
     
-    def UpdateSlice3D(self, widget: vtk.vtkImagePlaneWidget, orientation: str) -> None:
+    @instrumentation.timed("slice 3d update")
+    def UpdateSlice3D(self, widget: "vtkImagePlaneWidget", orientation: str) -> None:
         img = self.buffer_slices[orientation].vtk_image
 
         # Image Data type Casting Filter.
-        cast = vtk.vtkImageCast()
+        cast = vtkImageCast()
         cast.SetInputData(img)
         cast.SetOutputScalarTypeToDouble()
         # When the ClampOverflow flag is on, the data is thresholded so that the output value does 
@@ -129,7 +520,7 @@ class Slice(metaclass=utils.Singleton):
         widget.SetInputConnection(cast.GetOutputPort())
 
         # # This flips an axis of an image.
-        # flip = vtk.vtkImageFlip()
+        # flip = vtkImageFlip()
         # flip.SetInputConnection(cast.GetOutputPort())
         # # Specify which axis will be flipped. This must be an integer between 0 (for x) and 2 (for z).
         # # Initial value is 0.
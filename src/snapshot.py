@@ -0,0 +1,216 @@
+import json
+import os
+import time
+from typing import Dict
+
+import numpy as np
+from numpy import ndarray
+from vtkmodules.vtkRenderingCore import vtkCamera
+
+from brick_store import BrickedVolume
+from project import Project
+from slice_ import Slice
+
+SNAPSHOT_VERSION = 2
+STATE_FILENAME = "snapshot.json"
+# Decoded volumes written in the snapshot directory, memory mapped by the restore.
+VOLUME_FILENAME = "volume.npy"
+RESAMPLED_FILENAME = "resampled.npy"
+PHASES_FILENAME = "phases.npy"
+PREVIEW_FILENAME = "preview.npy"
+ORIENTATIONS = ("AXIAL", "CORONAL", "SAGITAL")
+
+def get_camera_state(camera: vtkCamera) -> Dict:
+    return {
+        "position": camera.GetPosition(),
+        "focal_point": camera.GetFocalPoint(),
+        "view_up": camera.GetViewUp(),
+        "view_angle": camera.GetViewAngle(),
+        "parallel_scale": camera.GetParallelScale(),
+        "parallel_projection": camera.GetParallelProjection(),
+        "clipping_range": camera.GetClippingRange(),
+    }
+
+def set_camera_state(camera: vtkCamera, state: Dict) -> None:
+    camera.SetPosition(state["position"])
+    camera.SetFocalPoint(state["focal_point"])
+    camera.SetViewUp(state["view_up"])
+    camera.SetViewAngle(state["view_angle"])
+    camera.SetParallelScale(state["parallel_scale"])
+    camera.SetParallelProjection(state["parallel_projection"])
+    camera.SetClippingRange(state["clipping_range"])
+
+def _is_mapped_from(matrix, path: str) -> bool:
+    # The volume restored from the file must not be written over while it is mapped.
+    filename = getattr(matrix, "filename", None)
+    return bool(filename) and os.path.exists(path) and os.path.samefile(filename, path)
+
+def _save_array(directory: str, filename: str, matrix) -> str:
+    path = os.path.join(directory, filename)
+    if not _is_mapped_from(matrix, path):
+        np.save(path, np.asarray(matrix))
+    return filename
+
+def get_volume_state(slice: Slice, directory: str) -> Dict:
+    """
+    Writes the decoded volume of slice and its derived data to directory, unless they
+    are already there or on disk elsewhere, and returns the references to them.
+    """
+    if slice.phases is not None:
+        # The phases cache of the catalogue is referenced, not copied.
+        filename = getattr(slice.phases, "filename", None) or _save_array(directory, PHASES_FILENAME, slice.phases)
+        return {
+            "kind": "phases",
+            "file": filename,
+            "spacing": tuple(slice.spacing),
+            "center": tuple(slice.center),
+            "origin": tuple(slice.origin),
+            "phase": slice.phase,
+        }
+
+    if isinstance(slice.matrix, BrickedVolume):
+        state = {
+            "kind": "bricks",
+            "path": os.path.abspath(slice.matrix.path),
+            "spacing": tuple(slice.spacing),
+            "center": tuple(slice.center),
+            "origin": tuple(slice.origin),
+        }
+        # The preview of the 3D view reads every brick; it is kept with the snapshot.
+        preview, spacing = slice.GetVolumeMatrix()
+        state["preview"] = {"file": _save_array(directory, PREVIEW_FILENAME, preview), "spacing": tuple(spacing)}
+        return state
+
+    native = slice.matrix if slice.matrix_native is None else slice.matrix_native
+    spacing_native = slice.spacing if slice.spacing_native is None else slice.spacing_native
+    state = {
+        "kind": "volume",
+        "file": _save_array(directory, VOLUME_FILENAME, native),
+        "spacing": tuple(spacing_native),
+        "center": tuple(slice.center),
+        "origin": tuple(slice.origin),
+    }
+    if slice.matrix is not native:
+        # The resampled volume being shown is kept, so the restore does not resample.
+        state["resampled"] = {
+            "file": _save_array(directory, RESAMPLED_FILENAME, slice.matrix),
+            "spacing": tuple(slice.spacing),
+        }
+    return state
+
+def save_snapshot(directory: str, slice_viewer, volume_viewer=None) -> None:
+    """
+    Writes the state of the viewers of a study to directory: the project, the slice
+    positions, the cross, the cameras, the 3D transfer function and the decoded volume.
+    """
+    os.makedirs(directory, exist_ok=True)
+    project = Project()
+    state = {
+        "version": SNAPSHOT_VERSION,
+        "time": time.time(),
+        "project": {
+            "modality": project.modality,
+            "window_level": project.window_level,
+            "window_width": project.window_width,
+        },
+        "volume": get_volume_state(slice_viewer.slice, directory),
+        "slices": {orientation: int(slice_viewer.GetScrollPosition(orientation)) for orientation in ORIENTATIONS},
+        "focal_point": slice_viewer.cross_axial.GetFocalPoint(),
+        "cameras": {
+            orientation: get_camera_state(slice_viewer.GetRenderer(orientation).GetActiveCamera())
+            for orientation in ORIENTATIONS
+        },
+    }
+    if volume_viewer is not None and volume_viewer.volume_mapper is not None:
+        state["cameras"]["VOLUME"] = get_camera_state(volume_viewer.renderer.GetActiveCamera())
+        # The preset with its live edits, in voxel values whatever the scalars of the
+        # rendered image.
+        state["preset"] = volume_viewer.preset_name
+        state["transfer_function"] = volume_viewer.preset_source
+
+    write_state(directory, state)
+
+def write_state(directory: str, state: Dict) -> None:
+    # Written last and atomically, so an interrupted save leaves the previous snapshot.
+    path = os.path.join(directory, STATE_FILENAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def load_snapshot(directory: str) -> Dict:
+    with open(os.path.join(directory, STATE_FILENAME)) as f:
+        state = json.load(f)
+    if state.get("version") != SNAPSHOT_VERSION:
+        raise ValueError("snapshot version %s is not supported" % state.get("version"))
+    return state
+
+def _load_array(directory: str, filename: str) -> ndarray:
+    return np.load(os.path.join(directory, filename), mmap_mode="r")
+
+def restore_study(state: Dict, directory: str) -> Slice:
+    """
+    Loads the project and the volume of a snapshot into the active study. The volumes
+    are memory mapped, so only the slices shown are read from disk.
+    """
+    project = Project()
+    for name, value in state["project"].items():
+        setattr(project, name, value)
+
+    slice = Slice()
+    volume = state["volume"]
+    spacing = tuple(volume["spacing"])
+    if volume["kind"] == "phases":
+        slice.SetPhases(_load_array(directory, volume["file"]), spacing)
+        slice.SetPhase(volume["phase"])
+    elif volume["kind"] == "bricks":
+        slice.matrix = BrickedVolume(volume["path"])
+        slice.spacing = spacing
+        preview = volume.get("preview")
+        if preview is not None:
+            slice.matrix.set_preview(_load_array(directory, preview["file"]), preview["spacing"])
+    else:
+        slice.matrix = slice.matrix_native = _load_array(directory, volume["file"])
+        slice.spacing = slice.spacing_native = spacing
+        slice.resampled_matrices = {}
+        resampled = volume.get("resampled")
+        if resampled is not None:
+            resampled_spacing = tuple(resampled["spacing"])
+            slice.matrix = _load_array(directory, resampled["file"])
+            slice.spacing = resampled_spacing
+            slice.resampled_matrices[resampled_spacing] = slice.matrix
+    slice.center = list(volume["center"])
+    # Snapshots taken before the origin was kept place the fusion layers from 0.
+    slice.origin = tuple(volume.get("origin", (0.0, 0.0, 0.0)))
+    slice.discard_all_buffers()
+    return slice
+
+def restore_views(state: Dict, slice_viewer) -> None:
+    """
+    Moves the slice views of a loaded study to the positions, cross and cameras of a
+    snapshot. A pre-processed study has no view state and keeps the default views.
+    """
+    if "slices" not in state:
+        return
+    for orientation in ORIENTATIONS:
+        slice_viewer.set_slice_number(state["slices"][orientation], orientation)
+    slice_viewer.scroll_position_axial = slice_viewer.slice_data_axial.number
+    slice_viewer.scroll_position_coronal = slice_viewer.slice_data_coronal.number
+    slice_viewer.scroll_position_sagital = slice_viewer.slice_data_sagital.number
+    slice_viewer.SetCrossFocalPoint(state["focal_point"])
+    for orientation in ORIENTATIONS:
+        set_camera_state(slice_viewer.GetRenderer(orientation).GetActiveCamera(), state["cameras"][orientation])
+    slice_viewer.UpdateRender()
+
+def restore_volume_view(state: Dict, volume_viewer) -> None:
+    """
+    Applies the camera and the transfer function of a snapshot to a built 3D view.
+    """
+    transfer_function = state.get("transfer_function")
+    if transfer_function is not None:
+        volume_viewer.preset_name = state.get("preset")
+        volume_viewer.SetPreset(transfer_function)
+    camera = state.get("cameras", {}).get("VOLUME")
+    if camera is not None:
+        set_camera_state(volume_viewer.renderer.GetActiveCamera(), camera)
+        volume_viewer.renderer.ResetCameraClippingRange()
+    volume_viewer.UpdateRender()
@@ -0,0 +1,44 @@
+import json
+import sys
+import time
+from typing import Dict
+
+# Cold start stages, timed from the first mark (the start of main.py).
+_marks = []
+_report_path = None
+_final_stage = None
+
+def mark(stage: str) -> None:
+    """
+    Records the end of a startup stage. The report is written when the final stage
+    given to enable is reached.
+    """
+    _marks.append((stage, time.perf_counter()))
+    if stage == _final_stage:
+        write_report()
+
+def enable(final_stage: str, path: str = None) -> None:
+    global _final_stage, _report_path
+    _final_stage = final_stage
+    _report_path = path
+
+def get_report() -> Dict:
+    stages = {}
+    for (previous, t0), (stage, t1) in zip(_marks, _marks[1:]):
+        stages[stage] = (t1 - t0) * 1000
+    total = (_marks[-1][1] - _marks[0][1]) * 1000 if _marks else 0.0
+    return {"stages_ms": stages, "total_ms": total}
+
+def format_report() -> str:
+    report = get_report()
+    lines = ["Startup"]
+    for stage, elapsed in report["stages_ms"].items():
+        lines.append("  %-16s %8.1f ms" % (stage, elapsed))
+    lines.append("  %-16s %8.1f ms" % ("total", report["total_ms"]))
+    return "\n".join(lines)
+
+def write_report() -> None:
+    print(format_report(), file=sys.stderr)
+    if _report_path:
+        with open(_report_path, "w") as f:
+            json.dump(get_report(), f, indent=2)
@@ -0,0 +1,66 @@
+import utils
+from memory import MemoryManager
+from project import Project
+from slice_ import Slice
+
+class Study:
+    """
+    A volume opened in the process, with its own Slice and Project. The classes using
+    utils.StudySingleton return the objects of the active study.
+    """
+    def __init__(self, study_id: int, name: str) -> None:
+        self.id = study_id
+        self.name = name
+        # The viewers of the study are kept alive with it: pubsub only holds weak
+        # references to their handlers.
+        self.slice_viewer = None
+        self.volume_viewer = None
+        MemoryManager().Touch(study_id)
+
+    def Activate(self) -> None:
+        utils.set_active_study(self.id)
+        self.Touch()
+
+    def Touch(self) -> None:
+        # Marks the study as the most recently viewed.
+        MemoryManager().Touch(self.id)
+
+    def Topic(self, topic: str) -> str:
+        return utils.get_topic(topic, self.id)
+
+    @property
+    def slice(self) -> Slice:
+        return Slice.instances.get(self.id)
+
+    @property
+    def project(self) -> Project:
+        return Project.instances.get(self.id)
+
+class StudyManager(metaclass=utils.Singleton):
+    def __init__(self) -> None:
+        self.studies = {utils.DEFAULT_STUDY: Study(utils.DEFAULT_STUDY, "Study %d" % utils.DEFAULT_STUDY)}
+
+    def CreateStudy(self, name: str = None) -> Study:
+        """
+        Creates a study and makes it active. The Slice, Project and viewers created
+        afterwards belong to it.
+        """
+        study_id = max(self.studies) + 1
+        study = Study(study_id, name or "Study %d" % study_id)
+        self.studies[study_id] = study
+        study.Activate()
+        return study
+
+    def GetStudy(self, study_id: int = None) -> Study:
+        if study_id is None:
+            study_id = utils.get_active_study()
+        return self.studies[study_id]
+
+    def CloseStudy(self, study_id: int) -> None:
+        study = self.studies.pop(study_id)
+        study.slice_viewer = study.volume_viewer = None
+        MemoryManager().UnregisterStudy(study.id)
+        Slice.instances.pop(study.id, None)
+        Project.instances.pop(study.id, None)
+        if utils.get_active_study() == study.id:
+            utils.set_active_study(utils.DEFAULT_STUDY)
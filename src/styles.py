@@ -1,10 +1,13 @@
-import vtk
+from vtkmodules.vtkInteractionStyle import vtkInteractorStyleImage
+from vtkmodules.vtkRenderingCore import vtkRenderWindowInteractor, vtkWorldPointPicker
 from typing import Tuple
 from pubsub import pub as Publisher
 
 import constants as const
+import instrumentation
+from events import Event
 
-class BaseImageInteractorStyle(vtk.vtkInteractorStyleImage):
+class BaseImageInteractorStyle(vtkInteractorStyleImage):
     def __init__(self, viewer) -> None:
         self.viewer = viewer
 
@@ -39,86 +42,6 @@ class BaseImageInteractorStyle(vtk.vtkInteractorStyleImage):
     def OnReleaseRightButton(self, obj, event) -> None:
         self.right_pressed = False
 
-class DefaultInteractorStyle(BaseImageInteractorStyle):
-    """
-    Interactor style responsible for Default functionalities:
-        - Zoom moving mouse with right button pressed.
-        - Change the slices with the scroll.
-    """
-    def __init__(self, viewer) -> None:
-        BaseImageInteractorStyle.__init__(self, viewer)
-
-        self.viewer = viewer
-
-        self.AddObserver("MouseMoveEvent", self.OnZoomRightMove)
-        self.AddObserver("MouseWheelForwardEvent", self.OnScrollForward)
-        self.AddObserver("MouseWheelBackwardEvent", self.OnScrollBackward)
-
-        # Zoom using right button
-        self.AddObserver("RightButtonPressEvent", self.OnZoomRightClick)
-        self.AddObserver("RightButtonReleaseEvent", self.OnZoomRightRelease)
-
-    def OnZoomRightMove(self, obj, event) -> None:
-        if self.right_pressed:
-            obj.Dolly()
-            obj.OnRightButtonDown()
-        elif self.middle_pressed:
-            obj.Pan()
-            obj.OnMiddleButtonDown()
-
-    def OnScrollForward(self, obj, event) -> None:
-        self.viewer.OnScrollForward()
-
-    def OnScrollBackward(self, obj, event) -> None:
-        self.viewer.OnScrollBackward()
-
-    def OnZoomRightClick(self, obj, event) -> None:
-        obj.StartDolly()
-
-    def OnZoomRightRelease(self, obj, event) -> None:
-        obj.OnRightButtonUp()
-        self.right_pressed = False
-
-class CrossInteractorStyle(DefaultInteractorStyle):
-    """
-    The style displays the cross in each slice and allows the user to move the cross in the slices by clicking 
-    and dragging the mouse.
-    """
-    def __init__(self, viewer) -> None:
-        DefaultInteractorStyle.__init__(self, viewer)
-
-        self.viewer = viewer
-        self.orientation = viewer.orientation
-        self.slice_actor = viewer.slice_data.actor
-        self.slice_data = viewer.slice_data
-
-        self.picker = vtk.vtkWorldPointPicker()
-
-        self.AddObserver("LeftButtonPressEvent", self.OnCrossMouseClick)
-        self.AddObserver("LeftButtonReleaseEvent", self.OnReleaseLeftButton)
-
-        self.AddObserver("MouseMoveEvent", self.OnCrossMove)
-
-    def OnCrossMouseClick(self, obj, event) -> None:
-        iren = obj.GetInteractor()
-        self.ChangeCrossPosition(iren)
-
-    def OnCrossMove(self, obj, event) -> None:
-        # The user moved the mouse with left button pressed.
-        if self.left_pressed:
-            iren = obj.GetInteractor()
-            self.ChangeCrossPosition(iren)
-
-    def ChangeCrossPosition(self, iren: vtk.vtkRenderWindowInteractor) -> None:
-        mouse_x, mouse_y = iren.GetEventPosition()
-        x, y, z = self.viewer.get_coordinate_cursor(mouse_x, mouse_y, self.picker)
-        
-        self.viewer.UpdateSlicesPosition([x, y, z])
-
-        # Update the position of the cross in other slices.
-        self.viewer.SetCrossFocalPoint([x, y, z])
-        self.viewer.UpdateRender()
-
 class DefaultInteractorStyle_2(BaseImageInteractorStyle):
     """
     Interactor style responsible for Default functionalities:
@@ -139,6 +62,8 @@ class DefaultInteractorStyle_2(BaseImageInteractorStyle):
         self.AddObserver("RightButtonPressEvent", self.OnZoomRightClick)
         self.AddObserver("RightButtonReleaseEvent", self.OnZoomRightRelease)
 
+        self.AddObserver("CharEvent", self.OnChar)
+
     def OnZoomRightMove(self, obj, event) -> None:
         if self.right_pressed:
             obj.Dolly()
@@ -147,9 +72,36 @@ class DefaultInteractorStyle_2(BaseImageInteractorStyle):
             obj.Pan()
             obj.OnMiddleButtonDown()
 
+    def OnChar(self, obj, event) -> None:
+        key = obj.GetInteractor().GetKeySym()
+        if key in const.SLICE_STATE_SHORTCUTS:
+            Publisher.sendMessage(self.viewer.Topic("Set slice interaction style"), style=const.SLICE_STATE_SHORTCUTS[key])
+        elif key == const.INSTRUMENTATION_OVERLAY_KEY:
+            Publisher.sendMessage(self.viewer.Topic("Toggle instrumentation overlay"))
+        elif key == const.CINE_KEY:
+            Publisher.sendMessage(self.viewer.Topic("Toggle cine"), orientation=self.orientation)
+        elif key in const.CINE_FASTER_KEYS:
+            Publisher.sendMessage(self.viewer.Topic("Change cine fps"), orientation=self.orientation, step=const.CINE_FPS_STEP)
+        elif key in const.CINE_SLOWER_KEYS:
+            Publisher.sendMessage(self.viewer.Topic("Change cine fps"), orientation=self.orientation, step=-const.CINE_FPS_STEP)
+        elif key == const.PHASE_CINE_KEY:
+            Publisher.sendMessage(self.viewer.Topic("Toggle phase cine"))
+        elif key == const.PHASE_NEXT_KEY:
+            Publisher.sendMessage(self.viewer.Topic("Step phase"), step=1)
+        elif key == const.PHASE_PREVIOUS_KEY:
+            Publisher.sendMessage(self.viewer.Topic("Step phase"), step=-1)
+        elif key == const.FUSION_OPACITY_MORE_KEY:
+            Publisher.sendMessage(self.viewer.Topic("Step fusion opacity"), step=const.FUSION_OPACITY_STEP)
+        elif key == const.FUSION_OPACITY_LESS_KEY:
+            Publisher.sendMessage(self.viewer.Topic("Step fusion opacity"), step=-const.FUSION_OPACITY_STEP)
+        else:
+            obj.OnChar()
+
+    @instrumentation.timed("scroll event")
     def OnScrollForward(self, obj, event) -> None:
         self.viewer.OnScrollForward(self.orientation)
 
+    @instrumentation.timed("scroll event")
     def OnScrollBackward(self, obj, event) -> None:
         self.viewer.OnScrollBackward(self.orientation)
 
@@ -170,7 +122,7 @@ class CrossInteractorStyle_2(DefaultInteractorStyle_2):
 
         self.viewer = viewer
         self.orientation = orientation
-        self.picker = vtk.vtkWorldPointPicker()
+        self.picker = vtkWorldPointPicker()
 
         self.AddObserver("LeftButtonPressEvent", self.OnCrossMouseClick)
         self.AddObserver("LeftButtonReleaseEvent", self.OnReleaseLeftButton)
@@ -187,14 +139,16 @@ class CrossInteractorStyle_2(DefaultInteractorStyle_2):
             iren = obj.GetInteractor()
             self.ChangeCrossPosition(iren)
 
-    def ChangeCrossPosition(self, iren: vtk.vtkRenderWindowInteractor) -> None:
+    @instrumentation.timed("cross move event")
+    def ChangeCrossPosition(self, iren: vtkRenderWindowInteractor) -> None:
         mouse_x, mouse_y = iren.GetEventPosition()
         x, y, z = self.viewer.get_coordinate_cursor(mouse_x, mouse_y, self.orientation, self.picker)
         
         self.viewer.UpdateSlicesPosition(self.orientation, [x, y, z])
         
-        Publisher.sendMessage("Set cross focal point", position=[x, y, z])
-        Publisher.sendMessage("Update mpr")
+        # The render is posted, so the mouse moves of a frame render once.
+        self.viewer.bus.Send(Event.SET_CROSS_FOCAL_POINT, position=[x, y, z])
+        self.viewer.bus.Post(Event.UPDATE_MPR)
 
     '''
     def OnScrollBar(self) -> None:
@@ -211,3 +165,38 @@ class CrossInteractorStyle_2(DefaultInteractorStyle_2):
         self.viewer.SetCrossFocalPoint([x, y, z])
         self.viewer.UpdateRender()
     '''
+
+class ROIInteractorStyle_2(DefaultInteractorStyle_2):
+    """
+    The style allows the user to draw a rectangle, an ellipse or a line by clicking and
+    dragging the mouse. The statistics of the region are updated while dragging.
+    """
+    def __init__(self, viewer, orientation, roi_type) -> None:
+        DefaultInteractorStyle_2.__init__(self, viewer, orientation)
+
+        self.viewer = viewer
+        self.orientation = orientation
+        self.roi_type = roi_type
+        self.picker = vtkWorldPointPicker()
+        self.start_position = None
+
+        self.AddObserver("LeftButtonPressEvent", self.OnROIMouseClick)
+        self.AddObserver("LeftButtonReleaseEvent", self.OnReleaseLeftButton)
+
+        self.AddObserver("MouseMoveEvent", self.OnROIMove)
+
+    def get_position(self, iren: vtkRenderWindowInteractor) -> Tuple:
+        mouse_x, mouse_y = iren.GetEventPosition()
+        return self.viewer.get_coordinate_cursor(mouse_x, mouse_y, self.orientation, self.picker)
+
+    def OnROIMouseClick(self, obj, event) -> None:
+        iren = obj.GetInteractor()
+        self.start_position = self.get_position(iren)
+
+    @instrumentation.timed("roi move event")
+    def OnROIMove(self, obj, event) -> None:
+        # The user moved the mouse with left button pressed.
+        if self.left_pressed and self.start_position is not None:
+            iren = obj.GetInteractor()
+            end_position = self.get_position(iren)
+            self.viewer.UpdateROI(self.orientation, self.roi_type, self.start_position, end_position)
@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import json
+import os
+from argparse import ArgumentParser
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from numpy import ndarray
+
+import concurrency
+import export
+import shared_volume
+from loader import load_study
+from project import Project
+
+# Size in bytes of the encoded tiles kept in memory.
+TILE_CACHE_SIZE = 64 * 1024 * 1024
+SLAB_MODES = ("max", "mean", "min")
+HTTP_REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str = "") -> None:
+        Exception.__init__(self, message)
+        self.status = status
+
+def get_slab(matrix: ndarray, orientation: str, slice_number: int, slab: int, mode: str) -> ndarray:
+    """
+    Returns the slice, or the projection (max, mean or min) of the slab of slices
+    centred on it.
+    """
+    if slab <= 1:
+        return export.get_image_slice(matrix, orientation, slice_number)
+    axis = {"AXIAL": 0, "CORONAL": 1, "SAGITAL": 2}[orientation]
+    start = max(slice_number - slab // 2, 0)
+    stop = min(start + slab, matrix.shape[axis])
+    item = [slice(None)] * 3
+    item[axis] = slice(start, stop)
+    n_slab = matrix[tuple(item)]
+    if mode == "max":
+        return n_slab.max(axis)
+    elif mode == "min":
+        return n_slab.min(axis)
+    return n_slab.mean(axis, dtype=np.float32)
+
+def render_tile(key: Tuple) -> bytes:
+    """
+    Task of the worker pool: extracts, windows and encodes a tile as PNG.
+    """
+    orientation, slice_number, window, level, slab, mode = key
+    n_image = get_slab(export._worker["matrix"], orientation, slice_number, slab, mode)
+    return export.encode_png(export.numpy_to_image(export.apply_window_level(n_image, window, level)))
+
+class TileCache:
+    """
+    LRU cache of encoded tiles, bounded by the size in bytes of the tiles.
+    """
+    def __init__(self, max_size: int = TILE_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self.tiles = OrderedDict()
+
+    def get(self, key: Tuple) -> bytes:
+        data = self.tiles.get(key)
+        if data is not None:
+            self.tiles.move_to_end(key)
+        return data
+
+    def put(self, key: Tuple, data: bytes) -> None:
+        if key in self.tiles:
+            return
+        self.tiles[key] = data
+        self.size += len(data)
+        while self.size > self.max_size and len(self.tiles) > 1:
+            old_key, old_data = self.tiles.popitem(last=False)
+            self.size -= len(old_data)
+
+class TileServer:
+    """
+    HTTP server of the slices of a volume as PNG tiles:
+
+        GET /info
+        GET /slice/<orientation>/<slice number>.png?ww=&wl=&slab=&mode=
+
+    Tiles are computed by a pool of processes sharing the volume, cached encoded with
+    an ETag, and concurrent requests of the same tile share one computation.
+    """
+    def __init__(self, matrix, spacing: Tuple, window: float, level: float, workers: int = None, cache_size: int = TILE_CACHE_SIZE) -> None:
+        self.shared = shared_volume.find_shared(matrix)
+        self.owned = self.shared is None
+        if self.owned:
+            self.shared = shared_volume.share_array(matrix)
+        self.matrix = self.shared.array
+        self.spacing = tuple(spacing)
+        self.window = window
+        self.level = level
+        self.executor = ProcessPoolExecutor(
+            workers,
+            initializer=export.init_worker,
+            initargs=(self.shared.Describe(spacing=self.spacing), {}),
+        )
+        self.cache = TileCache(cache_size)
+        # Futures of the tiles being computed, keyed like the cache.
+        self.pending = {}
+        # The ETags change with the volume, i.e. when the server is restarted.
+        self.volume_tag = os.urandom(8).hex()
+        self.stats = {"requests": 0, "not_modified": 0, "hits": 0, "coalesced": 0, "computed": 0}
+        self.server = None
+        # Writers of the open connections, keyed by the task serving them.
+        self.connections = {}
+
+    def GetKey(self, orientation: str, slice_number: str, query: Dict) -> Tuple:
+        orientation = orientation.upper()
+        if orientation == "SAGITTAL":
+            orientation = "SAGITAL"
+        axis = {"AXIAL": 0, "CORONAL": 1, "SAGITAL": 2}.get(orientation)
+        if axis is None:
+            raise HTTPError(404, "unknown orientation %s" % orientation)
+        try:
+            slice_number = int(slice_number)
+            window = float(query.get("ww", [self.window])[0])
+            level = float(query.get("wl", [self.level])[0])
+            slab = int(query.get("slab", [1])[0])
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        mode = query.get("mode", ["max"])[0]
+        if not 0 <= slice_number < self.matrix.shape[axis]:
+            raise HTTPError(404, "slice %d out of range" % slice_number)
+        if slab < 1 or mode not in SLAB_MODES:
+            raise HTTPError(400, "invalid slab")
+        return (orientation, slice_number, window, level, slab, mode if slab > 1 else "max")
+
+    def GetETag(self, key: Tuple) -> str:
+        return '"%s"' % hashlib.sha1(("%s:%r" % (self.volume_tag, key)).encode()).hexdigest()[:20]
+
+    async def GetTile(self, key: Tuple) -> bytes:
+        data = self.cache.get(key)
+        if data is not None:
+            self.stats["hits"] += 1
+            return data
+        future = self.pending.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = self.pending[key] = loop.run_in_executor(self.executor, render_tile, key)
+        self.stats["computed"] += 1
+        try:
+            data = await asyncio.shield(future)
+        finally:
+            self.pending.pop(key, None)
+        self.cache.put(key, data)
+        return data
+
+    async def HandleRequest(self, method: str, target: str, headers: Dict) -> Tuple[int, Dict, bytes]:
+        if method != "GET":
+            raise HTTPError(405)
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+        self.stats["requests"] += 1
+
+        if parts == ["info"]:
+            info = {
+                "shape": self.matrix.shape,
+                "spacing": self.spacing,
+                "dtype": self.matrix.dtype.str,
+                "window_width": self.window,
+                "window_level": self.level,
+            }
+            return 200, {"Content-Type": "application/json"}, json.dumps(info).encode()
+        elif parts == ["stats"]:
+            return 200, {"Content-Type": "application/json"}, json.dumps(self.stats).encode()
+        elif len(parts) == 3 and parts[0] == "slice" and parts[2].endswith(".png"):
+            key = self.GetKey(parts[1], parts[2][: -len(".png")], parse_qs(url.query))
+            etag = self.GetETag(key)
+            response_headers = {"ETag": etag, "Cache-Control": "max-age=3600"}
+            # The tile is a function of the key, so the ETag is known without it.
+            if headers.get("if-none-match") == etag:
+                self.stats["not_modified"] += 1
+                return 304, response_headers, b""
+            response_headers["Content-Type"] = "image/png"
+            return 200, response_headers, await self.GetTile(key)
+        raise HTTPError(404)
+
+    async def OnConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    status, response_headers, body = await self.HandleRequest(method, target, headers)
+                except HTTPError as e:
+                    status, response_headers, body = e.status, {"Content-Type": "text/plain"}, str(e).encode()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                response_headers["Content-Length"] = str(len(body))
+                response_headers["Connection"] = "keep-alive" if keep_alive else "close"
+                head = "HTTP/1.1 %d %s\r\n" % (status, HTTP_REASONS.get(status, ""))
+                head += "".join("%s: %s\r\n" % item for item in response_headers.items())
+                writer.write(head.encode("latin-1") + b"\r\n" + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.pop(task, None)
+            writer.close()
+
+    async def Start(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        self.server = await asyncio.start_server(self.OnConnection, host, port)
+
+    async def Serve(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        await self.Start(host, port)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def Stop(self) -> None:
+        """
+        Stops accepting connections and closes the open ones.
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        # Closing the transports ends the pending reads of the connections.
+        for writer in list(self.connections.values()):
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+
+    def Close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+        self.executor.shutdown()
+        del self.matrix
+        if self.owned:
+            self.shared.Release()
+
+def main():
+    parser = ArgumentParser("Tile server")
+    parser.add_argument("path", type=str, help="DICOM directory of the study")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=concurrency.get_threads())
+    parser.add_argument("--cache-size", type=int, default=TILE_CACHE_SIZE // 2**20, help="Tile cache size in MB")
+    parser.add_argument("--spacing", type=str, default=None, help='Resample the volume: "iso" or "x,y,z" spacing in mm')
+    parser.add_argument("--bricks", type=str, default=None, help="Directory of the bricked copy of the volume")
+    parser.add_argument("--compress", action="store_true", help="Keep the volume compressed in memory")
+    args = parser.parse_args()
+
+    slice = load_study(args.path, args, args.bricks)
+    project = Project()
+    server = TileServer(
+        slice.matrix, slice.spacing, project.window_width, project.window_level, args.workers, args.cache_size * 2**20
+    )
+    print("Serving on http://%s:%d" % (args.host, args.port))
+    try:
+        asyncio.run(server.Serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.Close()
+
+if __name__ == "__main__":
+    main()
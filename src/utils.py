@@ -10,4 +10,70 @@ class Singleton(type):
         if cls.instance is None:
             cls.instance = super().__call__(*args, **kw)
         return cls.instance
-    
\ No newline at end of file
+
+# Key of the study whose objects are returned by the classes using StudySingleton.
+DEFAULT_STUDY = 0
+_active_study = DEFAULT_STUDY
+
+def get_active_study() -> int:
+    return _active_study
+
+def set_active_study(study_id: int) -> None:
+    global _active_study
+    _active_study = study_id
+
+def get_topic(topic: str, study_id: int = None) -> str:
+    """
+    Returns the pubsub topic of the given study. The default study keeps the plain
+    topic names, so the messages of different studies do not reach each other.
+    """
+    if study_id is None:
+        study_id = _active_study
+    if study_id == DEFAULT_STUDY:
+        return topic
+    return "%s [%d]" % (topic, study_id)
+
+class StudySingleton(type):
+    """
+    Like Singleton, but keeps one instance per study. Calling the class returns the
+    instance of the active study, creating it if needed.
+    """
+    def __init__(cls, name, bases, dic):
+        super().__init__(name, bases, dic)
+        cls.instances = {}
+
+    def __call__(cls, *args, **kw):
+        study_id = _active_study
+        if study_id not in cls.instances:
+            cls.instances[study_id] = super().__call__(*args, **kw)
+        return cls.instances[study_id]
+
+def get_index_ranges(item, shape: tuple) -> tuple:
+    """
+    Converts a numpy style index of a 3D array (integers and contiguous slices) to a
+    list of (start, stop) ranges for each axis and the axes indexed by integers.
+    """
+    if not isinstance(item, tuple):
+        item = (item,)
+    if Ellipsis in item:
+        i = item.index(Ellipsis)
+        item = item[:i] + (slice(None),) * (len(shape) - len(item) + 1) + item[i + 1 :]
+    item = item + (slice(None),) * (len(shape) - len(item))
+
+    ranges = []
+    squeeze = []
+    for axis, (index, size) in enumerate(zip(item, shape)):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(size)
+            if step != 1:
+                raise IndexError("only contiguous slices are supported")
+            ranges.append((start, max(start, stop)))
+        else:
+            index = int(index)
+            if index < 0:
+                index += size
+            if not 0 <= index < size:
+                raise IndexError("index %d is out of bounds for axis %d" % (index, axis))
+            ranges.append((index, index + 1))
+            squeeze.append(axis)
+    return ranges, tuple(squeeze)
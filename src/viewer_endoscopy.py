@@ -1,17 +1,30 @@
-import vtk
+from vtkmodules.vtkCommonCore import vtkCommand
+from vtkmodules.vtkCommonDataModel import vtkPiecewiseFunction
+from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
+from vtkmodules.vtkRenderingCore import (
+    vtkColorTransferFunction,
+    vtkPointPicker,
+    vtkRenderer,
+    vtkVolume,
+    vtkVolumeProperty,
+)
 from pubsub import pub as Publisher
-from typing import List
+from typing import List, Tuple
 
+import presets
+import utils
 from slice_ import Slice
-from converters import to_vtk
+from converters import get_quantization, get_transfer_function_range, quantize_volume, rescale_transfer_function, to_vtk
+from events import Event, EventBus
+from vtk_utils import create_volume_mapper, vtkRenderWindow, vtkRenderWindowInteractor
 
-class EndoscopyInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
+class EndoscopyInteractorStyle(vtkInteractorStyleTrackballCamera):
     def __init__(self) -> None:
         super().__init__()
-        self.AddObserver(vtk.vtkCommand.MouseWheelForwardEvent, self.OnScrollForward)
-        self.AddObserver(vtk.vtkCommand.MouseWheelBackwardEvent, self.OnScrollBackward)
-        self.AddObserver(vtk.vtkCommand.RightButtonPressEvent, self.OnZoomRightPress)
-        self.AddObserver(vtk.vtkCommand.RightButtonReleaseEvent, self.OnZoomRightRelease)
+        self.AddObserver(vtkCommand.MouseWheelForwardEvent, self.OnScrollForward)
+        self.AddObserver(vtkCommand.MouseWheelBackwardEvent, self.OnScrollBackward)
+        self.AddObserver(vtkCommand.RightButtonPressEvent, self.OnZoomRightPress)
+        self.AddObserver(vtkCommand.RightButtonReleaseEvent, self.OnZoomRightRelease)
 
     def OnScrollForward(self, obj, event) -> None:
         pass
@@ -26,24 +39,35 @@ class EndoscopyInteractorStyle(vtk.vtkInteractorStyleTrackballCamera):
         pass
 
 class EndoscopyViewer:
-    def __init__(self) -> None:
+    def __init__(self, render_dtype: str = None) -> None:
+        # The viewer shows the study that is active when it is created.
+        self.study_id = utils.get_active_study()
+        self.slice = Slice()
+        self.bus = EventBus()
         self.slice_plane = None
         self.pointer_actor = None
-
-        render_window = vtk.vtkRenderWindow()
+        # Built with the 3D scene, on the first load of the volume.
+        self.volume_mapper = None
+        # Scalar type the volume is quantised to in the range of the transfer function,
+        # as in VolumeViewer; None renders the voxels.
+        self.render_dtype = render_dtype
+        self.scalar_mapping = None
+        self.CreateTransferFunction()
+
+        render_window = vtkRenderWindow()
         render_window.SetWindowName("Endoscopy")
         render_window.SetSize(350, 350)
         render_window.SetPosition(1050, 0)
         # Turn off warning
         render_window.GlobalWarningDisplayOff()
 
-        renderer = vtk.vtkRenderer()
+        renderer = vtkRenderer()
         render_window.AddRenderer(renderer)
         self.renderer = renderer
 
-        interactor = vtk.vtkRenderWindowInteractor()
+        interactor = vtkRenderWindowInteractor()
         interactor.SetRenderWindow(render_window)
-        picker = vtk.vtkPointPicker()
+        picker = vtkPointPicker()
         interactor.SetPicker(picker)
         style = EndoscopyInteractorStyle()
         interactor.SetInteractorStyle(style)
@@ -52,69 +76,61 @@ class EndoscopyViewer:
         self.__bind_events()
 
     def __bind_events(self) -> None:
-        Publisher.subscribe(self.LoadVolume, "Load volume")
-        Publisher.subscribe(self.UpdateRender, "Update volume")
-        Publisher.subscribe(self.UpdateCameraPosition, "Update camera position")
+        Publisher.subscribe(self.LoadVolume, self.Topic("Load volume"))
+        self.bus.Subscribe(Event.UPDATE_VOLUME, self.UpdateRender)
+        Publisher.subscribe(self.UpdateCameraPosition, self.Topic("Update camera position"))
+        Publisher.subscribe(self.ReloadVolume, self.Topic("Reload volume data"))
+
+    def Topic(self, topic: str) -> str:
+        return utils.get_topic(topic, self.study_id)
 
     def UpdateRender(self) -> None:
         self.interactor.Render()
 
+    def CreateTransferFunction(self) -> None:
+        self.scalar_color = vtkColorTransferFunction()
+        self.scalar_opacity = vtkPiecewiseFunction()
+        self.gradient_opacity = vtkPiecewiseFunction()
+        self.preset = presets.analyse_preset(presets.PRESETS["endoluminal"])
+        presets.fill_transfer_function(self.preset, self.scalar_color, self.scalar_opacity, self.gradient_opacity)
+
     def LoadImage(self) -> None:
-        slice_data = Slice()
-        n_array = slice_data.matrix
-        spacing = slice_data.spacing
-        image = to_vtk(n_array, spacing)
-        self.image = image
+        n_array, spacing = self.slice.GetVolumeMatrix()
+        if self.render_dtype is None:
+            self.scalar_mapping = None
+            self.image = to_vtk(n_array, spacing)
+            return
+        lower, upper = get_transfer_function_range(self.scalar_color, self.scalar_opacity)
+        self.scalar_mapping = offset, scale = get_quantization(lower, upper, self.render_dtype)
+        self.image = to_vtk(quantize_volume(n_array, offset, scale, self.render_dtype), spacing)
     
     def LoadVolume(self) -> None:
         self.LoadImage()
         image = self.image
 
-        volume_mapper = vtk.vtkOpenGLGPUVolumeRayCastMapper()
+        # The volume rendering modules are imported here, off the startup path.
+        volume_mapper = create_volume_mapper("GPU")
         volume_mapper.SetInputData(image)
         volume_mapper.AutoAdjustSampleDistancesOff()
         volume_mapper.LockSampleDistanceToInputSpacingOn()
+        self.volume_mapper = volume_mapper
 
-        volume_properties = vtk.vtkVolumeProperty()
+        volume_properties = vtkVolumeProperty()
         volume_properties.SetInterpolationTypeToLinear()
-        volume_properties.ShadeOn()
-        volume_properties.SetAmbient(0.15)
-        volume_properties.SetDiffuse(0.9)
-        volume_properties.SetSpecular(0.3)
-        volume_properties.SetSpecularPower(15)
-
-        scalar_color = vtk.vtkColorTransferFunction()
-        # Test preset
-        scalar_color.AddRGBPoint(-1000, 0, 0, 0)
-        scalar_color.AddRGBPoint(-600, 194 / 255, 105 / 255, 82 / 255)
-        scalar_color.AddRGBPoint(-400, 194 / 255, 105 / 255, 82 / 255)
-        scalar_color.AddRGBPoint(-100, 194 / 255, 166 / 255, 115 / 255)
-        scalar_color.AddRGBPoint(-60, 194 / 255, 166 / 255, 115 / 255)
-        scalar_color.AddRGBPoint(40, 102 / 255, 0, 0)
-        scalar_color.AddRGBPoint(80, 153 / 255, 0, 0)
-        scalar_color.AddRGBPoint(400, 255 / 255, 217 / 255, 163 / 255)
-        scalar_color.AddRGBPoint(1000, 255 / 255, 217 / 255, 163 / 255)
-        volume_properties.SetColor(scalar_color)
+        presets.apply_lighting(self.preset, volume_properties)
 
-        scalar_opacity = vtk.vtkPiecewiseFunction()
-        # Test preset
-        # scalar_opacity.AddPoint(-500, 0)
-        # scalar_opacity.AddPoint(50, 1)
-
-        scalar_opacity.AddPoint(-1000, 0)
-        scalar_opacity.AddPoint(-400, 0)
-        scalar_opacity.AddPoint(400, 1)
-        scalar_opacity.AddPoint(1000, 1)
+        if self.scalar_mapping is None:
+            functions = (self.scalar_color, self.scalar_opacity, self.gradient_opacity)
+        else:
+            functions = rescale_transfer_function(self.scalar_color, self.scalar_opacity, self.gradient_opacity, *self.scalar_mapping)
+        scalar_color, scalar_opacity, gradient_opacity = functions
+        volume_properties.SetColor(scalar_color)
         volume_properties.SetScalarOpacity(scalar_opacity)
-
-        gradient_opacity = vtk.vtkPiecewiseFunction()
-        gradient_opacity.AddPoint(0, 1)
-        gradient_opacity.AddPoint(255, 1)
         volume_properties.SetGradientOpacity(gradient_opacity)
 
         self.volume_properties = volume_properties
 
-        volume = vtk.vtkVolume()
+        volume = vtkVolume()
         volume.SetMapper(volume_mapper)
         volume.SetProperty(volume_properties)
         self.volume = volume
@@ -131,6 +147,13 @@ class EndoscopyViewer:
 
         self.interactor.GetRenderWindow().Render()
 
+    def ReloadVolume(self, old_spacing: Tuple) -> None:
+        # Nothing to reload before the volume is loaded.
+        if self.volume_mapper is None:
+            return
+        self.LoadImage()
+        self.volume_mapper.SetInputData(self.image)
+
     def UpdateCameraPosition(self, position: List) -> None:
         renderer = self.renderer
         camera = renderer.GetActiveCamera()
@@ -1,330 +1,161 @@
-import vtk
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkImageData, vtkPolyData
+from vtkmodules.vtkInteractionStyle import vtkInteractorStyleImage
+from vtkmodules.vtkRenderingCore import (
+    vtkActor,
+    vtkImageActor,
+    vtkPolyDataMapper,
+    vtkRenderer,
+    vtkWorldPointPicker,
+)
+import numpy as np
 from typing import Tuple, List
 from pubsub import pub as Publisher
+from vtkmodules.util import numpy_support
 
 from slice_data import SliceData
 import constants as const
+import measures
+import instrumentation
+import utils
+from memory import ENFORCE_INTERVAL_MS, MemoryManager
 from slice_ import Slice
-from styles import CrossInteractorStyle, CrossInteractorStyle_2
-from vtk_utils import TextZero
-from project import Project
-
-# Single view
-class ViewerDemo:
-    def __init__(self, orientation="AXIAL") -> None:
-        self.number_slices = 1
-        self.orientation = orientation
-        self.scroll_position = 0
-        self.wl_text = None
-        self.orientation_texts = []
-        self.pointer_actor = None
-
-        self.interactor = vtk.vtkRenderWindowInteractor()
-        renderWindow = vtk.vtkRenderWindow()
-        renderWindow.SetSize(500, 500)
-        self.interactor.SetRenderWindow(renderWindow)
-
-        self.pick = vtk.vtkWorldPointPicker()
-        self.interactor.SetPicker(self.pick)
-        
-    def create_slice_window(self) -> SliceData:
-        renderer = vtk.vtkRenderer()
-        self.interactor.GetRenderWindow().AddRenderer(renderer)
-
-        actor = vtk.vtkImageActor()
-        # # Turn on/off linear interpolation of the image when rendering.
-        actor.InterpolateOn()
-
-        slice_data = SliceData()
-        slice_data.SetOrientation(self.orientation)
-        slice_data.renderer = renderer
-        slice_data.actor = actor
-
-        renderer.AddActor(actor)
-        renderer.AddActor(slice_data.text.actor)
-
-        return slice_data
-    
-    def __build_cross_lines(self) -> None:
-        # Generate a 3D cursor representation.
-        cross = vtk.vtkCursor3D()
-        # Turn every part of the 3D cursor on or off.
-        cross.AllOff()
-        # Turn on/off the wireframe axes.
-        cross.AxesOn()
-        self.cross = cross
-
-        cross_mapper = vtk.vtkPolyDataMapper()
-        cross_mapper.SetInputConnection(cross.GetOutputPort())
-        cross_actor = vtk.vtkActor()
-        cross_actor.SetMapper(cross_mapper)
-        cross_actor.GetProperty().SetColor(1, 0, 0)
-        cross_actor.VisibilityOn()
-        cross_actor.PickableOff()
-        self.cross_actor = cross_actor
-
-        self.slice_data.renderer.AddActor(cross_actor)
-
-    def get_coordinate_cursor(self, mx: int, my: int, picker=None) -> Tuple:
-        '''
-        Given the mx, my screen position returns the x, y, z position in world
-        coordinates.
-        Parameters
-            mx (int): x position.
-            my (int): y position
-            picker: the picker used to get calculate the voxel coordinate.
-        Returns:
-            world coordinate (x, y, z)
-        '''
-        if picker is None:
-            picker = self.pick
-
-        slice_data = self.slice_data
-        renderer = slice_data.renderer
-
-        picker.Pick(mx, my, 0, renderer)
-        x, y, z = picker.GetPickPosition()
-        bounds = slice_data.actor.GetBounds()
-        if bounds[0] == bounds[1]:
-            x = bounds[0]
-        elif bounds[2] == bounds[3]:
-            y = bounds[2]
-        elif bounds[4] == bounds[5]:
-            z = bounds[4]
-        return x, y, z
-    
-    def __update_camera(self) -> None:
-        orientation = self.orientation
-        camera = self.camera
-        camera.SetFocalPoint(0, 0, 0)
-        if orientation == "AXIAL":
-            camera.SetViewUp(0, 1, 0)
-            camera.SetPosition(0, 0, 1)
-        elif orientation == "CORONAL":
-            camera.SetViewUp(0, 0, -1)
-            camera.SetPosition(0, 1, 0)
-        elif orientation == "SAGITAL":
-            camera.SetViewUp(0, 0, -1)
-            camera.SetPosition(-1, 0, 0)
-        camera.ParallelProjectionOn()
-
-    def __update_display_extent(self, image: vtk.vtkImageData) -> None:
-        self.slice_data.actor.SetDisplayExtent(image.GetExtent())
-        self.slice_data.renderer.ResetCameraClippingRange()
-
-    def SetWLText(self, window_level: int, window_width: int) -> None:
-        if self.wl_text:
-            self.wl_text.SetValue("WL: %d WW: %d" % (window_level, window_width))
-
-    def EnableText(self) -> None:
-        if self.wl_text is None:
-            project = Project()
-
-            # Window level text
-            wl_text = TextZero()
-            wl_text.SetSize(const.TEXT_SIZE_LARGE)
-            wl_text.SetPosition(const.TEXT_POS_LEFT_UP)
-            self.wl_text = wl_text
-            
-            self.SetWLText(project.window_level, project.window_width)
-            self.slice_data.renderer.AddActor(wl_text.actor)
-
-            # Orientation text
-            if self.orientation == "AXIAL":
-                values = ["R", "L", "A", "P"]
-            elif self.orientation == "SAGITAL":
-                values = ["P", "A", "T", "B"]
-            else:
-                values = ["R", "L", "T", "B"]
-
-            left_text = TextZero()
-            left_text.SetSize(const.TEXT_SIZE_LARGE)
-            left_text.SetPosition(const.TEXT_POS_VCENTRE_LEFT)
-            left_text.SetValue(values[0])
-
-            right_text = TextZero()
-            right_text.SetSize(const.TEXT_SIZE_LARGE)
-            right_text.SetPosition(const.TEXT_POS_VCENTRE_RIGHT_ZERO)
-            right_text.SetValue(values[1])
-
-            up_text = TextZero()
-            up_text.SetSize(const.TEXT_SIZE_LARGE)
-            up_text.SetPosition(const.TEXT_POS_HCENTRE_UP)
-            up_text.SetValue(values[2])
-
-            down_text = TextZero()
-            down_text.SetSize(const.TEXT_SIZE_LARGE)
-            down_text.SetPosition(const.TEXT_POS_HCENTRE_DOWN_ZERO)
-            down_text.SetValue(values[3])
-
-            orientation_texts = [left_text, right_text, up_text, down_text]
-            self.orientation_texts = orientation_texts
-
-            for text in orientation_texts:
-                self.slice_data.renderer.AddActor(text.actor)
-
-    def calculate_matrix_position(self, coord: Tuple) -> Tuple:
-        x, y, z = coord
-        xi, xf, yi, yf, zi, zf = self.slice_data.actor.GetBounds()
-        if self.orientation == "AXIAL":
-            mx = round((x - xi) / self.slice_.spacing[0], 0)
-            my = round((y - yi) / self.slice_.spacing[1], 0)
-        elif self.orientation == "CORONAL":
-            mx = round((x - xi) / self.slice_.spacing[0], 0)
-            my = round((z - zi) / self.slice_.spacing[2], 0)
-        elif self.orientation == "SAGITAL":
-            mx = round((y - yi) / self.slice_.spacing[1], 0)
-            my = round((z - zi) / self.slice_.spacing[2], 0)
-        return int(mx), int(my)
-    
-    def get_slice_pixel_coord_by_world_pos(self, wx, wy, wz) -> Tuple:
-        coord = (wx, wy, wz)
-        px, py = self.calculate_matrix_position(coord)
-        return px, py
-    
-    def calcultate_scroll_position(self, x: int, y: int) -> Tuple:
-        # Based in the given coord (x, y), returns a list with the scroll positions for each
-        # orientation, being the first position the sagital, second the coronal and the last, axial.
-        if self.orientation == "AXIAL":
-            axial = self.slice_data.number
-            coronal = y
-            sagital = x
-        elif self.orientation == "CORONAL":
-            axial = y
-            coronal = self.slice_data.number
-            sagital = x
-        elif self.orientation == "SAGITAL":
-            axial = y
-            coronal = x
-            sagital = self.slice_data.number
-        return sagital, coronal, axial
-
-    def UpdateSlicesPosition(self, position: Tuple) -> None:
-        px, py = self.get_slice_pixel_coord_by_world_pos(*position)
-        coord = self.calcultate_scroll_position(px, py)
-        print(f"sagital={coord[0]}, coronal={coord[1]}, axial={coord[2]}")
-
-    def SetCrossFocalPoint(self, position: List) -> None:
-        self.cross.SetFocalPoint(position)
-
-    def UpdateRender(self) -> None:
-        self.interactor.Render()
-
-    def SetInteractorStyle(self) -> None:
-        # style = vtk.vtkInteractorStyleTrackballCamera()
-        style = CrossInteractorStyle(self)
-        self.interactor.SetInteractorStyle(style)
-        self.style = style
-
-    def set_slice_number(self, index: int) -> None:
-        index = max(index, 0)
-        max_slice_number = self.slice_.GetNumberOfSlices(self.orientation)
-        index = min(index, max_slice_number - 1)
-
-        image = self.slice_.GetSlices(self.orientation, index, self.number_slices)
-        self.slice_data.actor.SetInputData(image)
-
-        self.slice_data.SetNumber(index)
-
-        self.__update_display_extent(image)
-        self.cross.SetModelBounds(self.slice_data.actor.GetBounds())
-
-    def SetInput(self) -> None:
-        self.slice_data = self.create_slice_window()
-        self.camera = self.slice_data.renderer.GetActiveCamera()
-
-        self.__build_cross_lines()
-        self.EnableText()
-
-        self.slice_ = Slice()
-        position = self.slice_.GetNumberOfSlices(self.orientation) // 2
-        self.set_slice_number(position)
-        self.scroll_position = position
-
-        self.__update_camera()
-        self.slice_data.renderer.ResetCamera()
-
-        self.interactor.GetRenderWindow().Render()
-        self.SetInteractorStyle()
-
-    def OnScrollForward(self) -> None:
-        min = 0
-        position = self.scroll_position
-        if position >= min:
-            position = position - 1
-            self.set_slice_number(position)
-            self.scroll_position = position
-            self.UpdateRender()
-
-    def OnScrollBackward(self) -> None:
-        max = self.slice_.GetMaxSliceNumber(self.orientation)
-        position = self.scroll_position
-        if position <= max:
-            position = position + 1
-            self.set_slice_number(position)
-            self.scroll_position = position
-            self.UpdateRender()
+from styles import CrossInteractorStyle_2, ROIInteractorStyle_2
+from vtk_utils import TextZero, vtkRenderWindow, vtkRenderWindowInteractor
+from cine import CinePlayer, PhaseCinePlayer
+from layout import ViewportLayout
+from overlay import CrossOverlay, TextBatch
+from measures import SummedAreaTable
+from scheduler import PRIORITY_IDLE, TaskScheduler
+from events import Event, EventBus
 
 # Multi view
 class SliceViewer:
-    def __init__(self) -> None:
+    def __init__(self, layout: ViewportLayout = None) -> None:
+        # The viewer shows the study that is active when it is created.
+        self.study_id = utils.get_active_study()
+        self.slice = Slice()
+        self.bus = EventBus()
         self.number_slices = 1
         self.scroll_position_axial = 0
         self.scroll_position_coronal = 0
         self.scroll_position_sagital = 0
+        self.interaction_style = const.SLICE_STATE_CROSS
+        # ROI drawn in each orientation: (roi_type, start position, end position)
+        self.roi = {}
+        self.roi_texts = {}
+        self.roi_outlines = {}
+        self.instrumentation_text = None
+        # Instrumentation state before the overlay turned it on, restored when it is hidden.
+        self.instrumentation_was_enabled = False
+        # Texts of each view drawn as one image
+        self.text_batches = {}
+        # Cine players of the orientations being played
+        self.cine = {}
+        self.phase_cine = None
+        self.phase_text = None
         
+        self.layout = layout
+        if layout is None:
+            self.__build_windows()
+        else:
+            # The views are viewports of the window of the layout and share its interactor.
+            self.renderer_axial = vtkRenderer()
+            self.renderer_coronal = vtkRenderer()
+            self.renderer_sagital = vtkRenderer()
+            layout.AddViewport("AXIAL", self.renderer_axial)
+            layout.AddViewport("CORONAL", self.renderer_coronal)
+            layout.AddViewport("SAGITAL", self.renderer_sagital)
+            self.interactor_axial = self.interactor_coronal = self.interactor_sagital = layout.interactor
+            self.pick_axial = self.pick_coronal = self.pick_sagital = layout.interactor.GetPicker()
+
+        # Background jobs whose results are delivered between the frames.
+        self.scheduler = TaskScheduler(self.interactor_axial)
+        # Input in any view delays the idle jobs; in a layout they share one interactor.
+        self.scheduler.AddInputInteractor(self.interactor_coronal)
+        self.scheduler.AddInputInteractor(self.interactor_sagital)
+        self.memory_timer_id = None
+
+        self.__bind_events()
+
+    def __build_windows(self) -> None:
         # Axial view
-        renderWindow_axial = vtk.vtkRenderWindow()
+        renderWindow_axial = vtkRenderWindow()
         renderWindow_axial.SetWindowName("AXIAL")
         renderWindow_axial.SetSize(350, 350)
         renderWindow_axial.SetPosition(0, 0)
 
-        self.renderer_axial = vtk.vtkRenderer()
+        self.renderer_axial = vtkRenderer()
         renderWindow_axial.AddRenderer(self.renderer_axial)
 
-        self.interactor_axial = vtk.vtkRenderWindowInteractor()
+        self.interactor_axial = vtkRenderWindowInteractor()
         self.interactor_axial.SetRenderWindow(renderWindow_axial)
-        self.pick_axial = vtk.vtkWorldPointPicker()
+        self.pick_axial = vtkWorldPointPicker()
         self.interactor_axial.SetPicker(self.pick_axial)
 
         # Coronal view
-        renderWindow_coronal = vtk.vtkRenderWindow()
+        renderWindow_coronal = vtkRenderWindow()
         renderWindow_coronal.SetWindowName("CORONAL")
         renderWindow_coronal.SetSize(350, 350)
         renderWindow_coronal.SetPosition(350, 0)
 
-        self.renderer_coronal = vtk.vtkRenderer()
+        self.renderer_coronal = vtkRenderer()
         renderWindow_coronal.AddRenderer(self.renderer_coronal)
 
-        self.interactor_coronal = vtk.vtkRenderWindowInteractor()
+        self.interactor_coronal = vtkRenderWindowInteractor()
         self.interactor_coronal.SetRenderWindow(renderWindow_coronal)
-        self.pick_coronal = vtk.vtkWorldPointPicker()
+        self.pick_coronal = vtkWorldPointPicker()
         self.interactor_coronal.SetPicker(self.pick_coronal)
 
         # Sagital view
-        renderWindow_sagital = vtk.vtkRenderWindow()
+        renderWindow_sagital = vtkRenderWindow()
         renderWindow_sagital.SetWindowName("SAGITAL")
         renderWindow_sagital.SetSize(350, 350)
         renderWindow_sagital.SetPosition(700, 0)
 
-        self.renderer_sagital = vtk.vtkRenderer()
+        self.renderer_sagital = vtkRenderer()
         renderWindow_sagital.AddRenderer(self.renderer_sagital)
 
-        self.interactor_sagital = vtk.vtkRenderWindowInteractor()
+        self.interactor_sagital = vtkRenderWindowInteractor()
         self.interactor_sagital.SetRenderWindow(renderWindow_sagital)
-        self.pick_sagital = vtk.vtkWorldPointPicker()
+        self.pick_sagital = vtkWorldPointPicker()
         self.interactor_sagital.SetPicker(self.pick_sagital)
 
-        self.__bind_events()
-
     def __bind_events(self) -> None:
-        Publisher.subscribe(self.SetInput, "Load mpr")
-        Publisher.subscribe(self.startApp, "Start app")
-        Publisher.subscribe(self.SetCrossFocalPoint, "Set cross focal point")
-        Publisher.subscribe(self.UpdateRender, "Update mpr")
+        Publisher.subscribe(self.SetInput, self.Topic("Load mpr"))
+        Publisher.subscribe(self.startApp, self.Topic("Start app"))
+        self.bus.Subscribe(Event.SET_CROSS_FOCAL_POINT, self.SetCrossFocalPoint)
+        self.bus.Subscribe(Event.UPDATE_MPR, self.UpdateRender)
+        Publisher.subscribe(self.SetInteractorStyle, self.Topic("Set slice interaction style"))
+        Publisher.subscribe(self.ReloadInput, self.Topic("Reload volume data"))
+        Publisher.subscribe(self.ToggleInstrumentationOverlay, self.Topic("Toggle instrumentation overlay"))
+        Publisher.subscribe(self.ToggleCine, self.Topic("Toggle cine"))
+        Publisher.subscribe(self.ChangeCineFps, self.Topic("Change cine fps"))
+        Publisher.subscribe(self.OnChangePhase, self.Topic("Change phase"))
+        Publisher.subscribe(self.TogglePhaseCine, self.Topic("Toggle phase cine"))
+        Publisher.subscribe(self.StepPhase, self.Topic("Step phase"))
+        Publisher.subscribe(self.StepFusionOpacity, self.Topic("Step fusion opacity"))
+        Publisher.subscribe(self.OnChangeFusion, self.Topic("Change fusion"))
+
+    def Topic(self, topic: str) -> str:
+        return utils.get_topic(topic, self.study_id)
+
+    def GetInteractor(self, orientation: str) -> vtkRenderWindowInteractor:
+        if orientation == "AXIAL":
+            return self.interactor_axial
+        elif orientation == "CORONAL":
+            return self.interactor_coronal
+        return self.interactor_sagital
+
+    def GetRenderer(self, orientation: str) -> vtkRenderer:
+        if orientation == "AXIAL":
+            return self.renderer_axial
+        elif orientation == "CORONAL":
+            return self.renderer_coronal
+        return self.renderer_sagital
         
     def create_slice_window(self, orientation: str) -> SliceData:
-        actor = vtk.vtkImageActor()
+        actor = vtkImageActor()
         # Turn on/off linear interpolation of the image when rendering.
         actor.InterpolateOn()
 
@@ -340,95 +171,23 @@ class SliceViewer:
             renderer = self.renderer_sagital
         
         renderer.AddActor(actor)
-        renderer.AddActor(slice_data.text.actor)
+        self.text_batches[orientation] = TextBatch(renderer)
+        self.text_batches[orientation].Add(slice_data.text)
         return slice_data
     
     def __build_cross_lines(self) -> None:
-        # Generate a 3D cursor representation.
-        cross_axial = vtk.vtkCursor3D()
-        # Turn every part of the 3D cursor on or off.
-        cross_axial.AllOff()
-        # Turn on/off the wireframe axes.
-        cross_axial.AxesOn()
-        self.cross_axial = cross_axial
-
-        # Create a vtkUnsignedCharArray container and store the colors in it.
-        color_array_axial = vtk.vtkUnsignedCharArray()
-        color_array_axial.SetNumberOfComponents(3)
-        color_array_axial.SetNumberOfTuples(3)
-        color_array_axial.SetTuple(0, [0, 0, 255])
-        color_array_axial.SetTuple(1, [0, 255, 0])
-        color_array_axial.SetTuple(2, [255, 0, 0])
-        self.color_array_axial = color_array_axial
-
-        cross_mapper_axial = vtk.vtkPolyDataMapper()
-        cross_mapper_axial.SetInputConnection(cross_axial.GetOutputPort())
-        cross_actor_axial = vtk.vtkActor()
-        cross_actor_axial.SetMapper(cross_mapper_axial)
-        # cross_actor_axial.GetProperty().SetColor(1, 0, 0)
-        # cross_actor_axial.GetProperty().SetLineWidth(2)
-        cross_actor_axial.VisibilityOn()
-        cross_actor_axial.PickableOff()
-
-        self.renderer_axial.AddActor(cross_actor_axial)
-
-        # Generate a 3D cursor representation.
-        cross_coronal = vtk.vtkCursor3D()
-        # Turn every part of the 3D cursor on or off.
-        cross_coronal.AllOff()
-        # Turn on/off the wireframe axes.
-        cross_coronal.AxesOn()
-        self.cross_coronal = cross_coronal
-
-        # Create a vtkUnsignedCharArray container and store the colors in it.
-        color_array_coronal = vtk.vtkUnsignedCharArray()
-        color_array_coronal.SetNumberOfComponents(3)
-        color_array_coronal.SetNumberOfTuples(3)
-        color_array_coronal.SetTuple(0, [255, 0, 0])
-        color_array_coronal.SetTuple(1, [0, 0, 255])
-        color_array_coronal.SetTuple(2, [0, 255, 0])
-        self.color_array_coronal = color_array_coronal
-
-        cross_mapper_coronal = vtk.vtkPolyDataMapper()
-        cross_mapper_coronal.SetInputConnection(cross_coronal.GetOutputPort())
-        cross_actor_coronal = vtk.vtkActor()
-        cross_actor_coronal.SetMapper(cross_mapper_coronal)
-        # cross_actor_coronal.GetProperty().SetColor(1, 0, 0)
-        # cross_actor_coronal.GetProperty().SetLineWidth(2)
-        cross_actor_coronal.VisibilityOn()
-        cross_actor_coronal.PickableOff()
-
-        self.renderer_coronal.AddActor(cross_actor_coronal)
-
-        # Generate a 3D cursor representation.
-        cross_sagital = vtk.vtkCursor3D()
-        # Turn every part of the 3D cursor on or off.
-        cross_sagital.AllOff()
-        # Turn on/off the wireframe axes.
-        cross_sagital.AxesOn()
-        self.cross_sagital = cross_sagital
-
-        # Create a vtkUnsignedCharArray container and store the colors in it.
-        color_array_sagital = vtk.vtkUnsignedCharArray()
-        color_array_sagital.SetNumberOfComponents(3)
-        color_array_sagital.SetNumberOfTuples(3)
-        color_array_sagital.SetTuple(0, [0, 255, 0])
-        color_array_sagital.SetTuple(1, [255, 0, 0])
-        color_array_sagital.SetTuple(2, [0, 0, 255])
-        self.color_array_sagital = color_array_sagital
-
-        cross_mapper_sagital = vtk.vtkPolyDataMapper()
-        cross_mapper_sagital.SetInputConnection(cross_sagital.GetOutputPort())
-        cross_actor_sagital = vtk.vtkActor()
-        cross_actor_sagital.SetMapper(cross_mapper_sagital)
-        # cross_actor_sagital.GetProperty().SetColor(1, 0, 0)
-        # cross_actor_sagital.GetProperty().SetLineWidth(2)
-        cross_actor_sagital.VisibilityOn()
-        cross_actor_sagital.PickableOff()
-
-        self.renderer_sagital.AddActor(cross_actor_sagital)
-
-    def get_coordinate_cursor(self, mx: int, my: int, orientation: str, picker: vtk.vtkWorldPointPicker) -> Tuple:
+        # Colours of the lines along the x, y and z axes in each view.
+        self.cross_axial = CrossOverlay([(0, 0, 255), (0, 255, 0), (255, 0, 0)])
+        self.renderer_axial.AddActor(self.cross_axial.actor)
+
+        self.cross_coronal = CrossOverlay([(255, 0, 0), (0, 0, 255), (0, 255, 0)])
+        self.renderer_coronal.AddActor(self.cross_coronal.actor)
+
+        self.cross_sagital = CrossOverlay([(0, 255, 0), (255, 0, 0), (0, 0, 255)])
+        self.renderer_sagital.AddActor(self.cross_sagital.actor)
+
+    @instrumentation.timed("picking")
+    def get_coordinate_cursor(self, mx: int, my: int, orientation: str, picker: vtkWorldPointPicker) -> Tuple:
         if orientation == "AXIAL":
             slice_data = self.slice_data_axial
             renderer = self.renderer_axial
@@ -470,7 +229,7 @@ class SliceViewer:
             camera_sagital.SetPosition(-1, 0, 0)
             camera_sagital.ParallelProjectionOn()
 
-    def __update_display_extent(self, image: vtk.vtkImageData, orientation: str) -> None:
+    def __update_display_extent(self, image: vtkImageData, orientation: str) -> None:
         if orientation == "AXIAL":
             self.slice_data_axial.actor.SetDisplayExtent(image.GetExtent())
             self.renderer_axial.ResetCameraClippingRange()
@@ -482,7 +241,7 @@ class SliceViewer:
             self.renderer_sagital.ResetCameraClippingRange()
 
     def EnableText(self, orientation: str) -> None:
-        project = Project()
+        project = self.slice.project
 
         # Window level text
         wl_text = TextZero()
@@ -492,16 +251,14 @@ class SliceViewer:
 
         # Orientation text
         if orientation == "AXIAL":
-            renderer = self.renderer_axial
             values = ["R", "L", "A", "P"]
         elif orientation == "SAGITAL":
-            renderer = self.renderer_sagital
             values = ["P", "A", "T", "B"]
         else:
-            renderer = self.renderer_coronal
             values = ["R", "L", "T", "B"]
 
-        renderer.AddActor(wl_text.actor)
+        text_batch = self.text_batches[orientation]
+        text_batch.Add(wl_text)
 
         left_text = TextZero()
         left_text.SetSize(const.TEXT_SIZE_SMALL)
@@ -525,7 +282,140 @@ class SliceViewer:
 
         orientation_texts = [left_text, right_text, up_text, down_text]
         for text in orientation_texts:
-            renderer.AddActor(text.actor)
+            text_batch.Add(text)
+
+    def __build_roi_actors(self, orientation: str) -> None:
+        if orientation == "AXIAL":
+            renderer = self.renderer_axial
+        elif orientation == "CORONAL":
+            renderer = self.renderer_coronal
+        else:
+            renderer = self.renderer_sagital
+
+        # Statistics of the ROI
+        roi_text = TextZero()
+        roi_text.SetSize(const.TEXT_SIZE_SMALL)
+        roi_text.SetPosition(const.TEXT_POS_LEFT_DOWN_ROI)
+        roi_text.SetColour(const.ROI_COLOUR)
+        roi_text.actor.VisibilityOff()
+        self.text_batches[orientation].Add(roi_text)
+        self.roi_texts[orientation] = roi_text
+
+        # Outline of the ROI
+        outline = vtkPolyData()
+        outline_mapper = vtkPolyDataMapper()
+        outline_mapper.SetInputData(outline)
+        outline_actor = vtkActor()
+        outline_actor.SetMapper(outline_mapper)
+        outline_actor.GetProperty().SetColor(const.ROI_COLOUR)
+        outline_actor.PickableOff()
+        outline_actor.VisibilityOff()
+        renderer.AddActor(outline_actor)
+        self.roi_outlines[orientation] = (outline, outline_actor)
+
+    def __get_roi_outline_points(self, orientation: str, roi_type: int, start: List, end: List) -> np.ndarray:
+        # In-plane axes and the axis normal to the slice.
+        if orientation == "AXIAL":
+            u, v, w = 0, 1, 2
+            bounds = self.slice_data_axial.actor.GetBounds()
+        elif orientation == "CORONAL":
+            u, v, w = 0, 2, 1
+            bounds = self.slice_data_coronal.actor.GetBounds()
+        else:
+            u, v, w = 1, 2, 0
+            bounds = self.slice_data_sagital.actor.GetBounds()
+
+        if roi_type == const.SLICE_STATE_LINE_PROFILE:
+            pu = np.array([start[u], end[u]])
+            pv = np.array([start[v], end[v]])
+        elif roi_type == const.SLICE_STATE_ROI_ELLIPSE:
+            t = np.linspace(0, 2 * np.pi, const.ROI_ELLIPSE_RESOLUTION + 1)
+            pu = (start[u] + end[u]) / 2 + np.cos(t) * abs(end[u] - start[u]) / 2
+            pv = (start[v] + end[v]) / 2 + np.sin(t) * abs(end[v] - start[v]) / 2
+        else:
+            pu = np.array([start[u], end[u], end[u], start[u], start[u]])
+            pv = np.array([start[v], start[v], end[v], end[v], start[v]])
+
+        points = np.empty((pu.size, 3), dtype=np.float64)
+        points[:, u] = pu
+        points[:, v] = pv
+        points[:, w] = bounds[2 * w]
+        return points
+
+    def __update_roi_outline(self, orientation: str, roi_type: int, start: List, end: List) -> None:
+        outline, outline_actor = self.roi_outlines[orientation]
+        n_points = self.__get_roi_outline_points(orientation, roi_type, start, end)
+
+        points = vtkPoints()
+        points.SetData(numpy_support.numpy_to_vtk(n_points, deep=True))
+        lines = vtkCellArray()
+        lines.InsertNextCell(len(n_points))
+        for i in range(len(n_points)):
+            lines.InsertCellPoint(i)
+
+        outline.SetPoints(points)
+        outline.SetLines(lines)
+        outline.Modified()
+        outline_actor.VisibilityOn()
+
+    def __update_roi_stats(self, orientation: str) -> None:
+        roi_type, start, end = self.roi[orientation]
+        if orientation == "AXIAL":
+            index = self.slice_data_axial.number
+        elif orientation == "CORONAL":
+            index = self.slice_data_coronal.number
+        else:
+            index = self.slice_data_sagital.number
+
+        p0 = self.get_slice_pixel_coord_by_world_pos(orientation, *start)
+        p1 = self.get_slice_pixel_coord_by_world_pos(orientation, *end)
+        image = self.slice.get_image_slice(orientation, index, self.number_slices)
+        sx, sy = measures.get_pixel_spacing(self.slice.spacing, orientation)
+
+        if roi_type == const.SLICE_STATE_LINE_PROFILE:
+            distances, values = measures.line_profile(image, p0, p1, (sx, sy))
+            text = measures.format_profile(distances, values)
+        else:
+            if roi_type == const.SLICE_STATE_ROI_ELLIPSE:
+                stats = measures.ellipse_stats(image, p0, p1)
+            else:
+                sat = self.slice.GetSummedAreaTable(orientation)
+                stats = measures.rectangle_stats(image, sat, p0, p1)
+            area = stats["n"] * sx * sy if stats else 0.0
+            text = measures.format_stats(roi_type, stats, area)
+
+        roi_text = self.roi_texts[orientation]
+        roi_text.SetValue(text)
+        roi_text.actor.VisibilityOn()
+        self.__update_roi_outline(orientation, roi_type, start, end)
+
+    def __warm_summed_area_table(self, orientation: str) -> None:
+        # The rectangle statistics of the slice shown are ready before the first ROI.
+        if self.interaction_style != const.SLICE_STATE_ROI_RECTANGLE:
+            return
+        buffer = self.slice.buffer_slices[orientation]
+        if buffer.image is None or buffer.sat is not None:
+            return
+        n_image = buffer.image
+        self.scheduler.Submit(
+            SummedAreaTable,
+            n_image,
+            priority=PRIORITY_IDLE,
+            key=("sat", orientation),
+            callback=lambda sat: self.slice.SetSummedAreaTable(orientation, n_image, sat),
+        )
+
+    def UpdateROI(self, orientation: str, roi_type: int, start: List, end: List) -> None:
+        self.roi[orientation] = (roi_type, start, end)
+        self.__update_roi_stats(orientation)
+
+        self.RenderView(orientation)
+
+    def RemoveROI(self, orientation: str) -> None:
+        if orientation in self.roi:
+            del self.roi[orientation]
+            self.roi_texts[orientation].actor.VisibilityOff()
+            self.roi_outlines[orientation][1].VisibilityOff()
 
     def calculate_matrix_position(self, orientation: str, coord: Tuple) -> Tuple:
         x, y, z = coord
@@ -587,46 +477,95 @@ class SliceViewer:
             self.scroll_position_coronal = coronal
             orientations = ["AXIAL", "CORONAL"]
 
-        self.UpdateRender()
+        self.bus.Post(Event.UPDATE_MPR)
         # 3D
-        Publisher.sendMessage("Update slice 3d", orientations=orientations)
-        Publisher.sendMessage("Update volume")
+        self.bus.Post(Event.UPDATE_SLICE_3D, orientations=orientations)
+        self.bus.Post(Event.UPDATE_VOLUME)
         # Endoscopy
         # Publisher.sendMessage("Update camera position", position=position)
-        # Publisher.sendMessage("Update volume")
+        # Publisher.sendMessage(self.Topic("Update volume"))
 
+    @instrumentation.timed("cross update")
     def SetCrossFocalPoint(self, position: List) -> None:
         self.cross_axial.SetFocalPoint(position)
-        self.cross_axial.Update()
-        self.cross_axial.GetOutput().GetCellData().SetScalars(self.color_array_axial)
-
         self.cross_coronal.SetFocalPoint(position)
-        self.cross_coronal.Update()
-        self.cross_coronal.GetOutput().GetCellData().SetScalars(self.color_array_coronal)
-        
         self.cross_sagital.SetFocalPoint(position)
-        self.cross_sagital.Update()
-        self.cross_sagital.GetOutput().GetCellData().SetScalars(self.color_array_sagital)
 
     def UpdateRender(self) -> None:
-        self.interactor_axial.Render()
-        self.interactor_coronal.Render()
-        self.interactor_sagital.Render()
+        if self.instrumentation_text is not None:
+            self.instrumentation_text.SetValue(instrumentation.format_report())
+        with instrumentation.stage("render 2d"):
+            if self.layout is not None:
+                self.layout.Render()
+            else:
+                self.interactor_axial.Render()
+                self.interactor_coronal.Render()
+                self.interactor_sagital.Render()
+        instrumentation.frame()
+
+    def RenderView(self, orientation: str) -> None:
+        # In a layout the other viewports are not drawn unless they changed too.
+        if self.layout is not None:
+            self.layout.Render()
+        else:
+            self.GetInteractor(orientation).Render()
+
+    def ToggleInstrumentationOverlay(self) -> None:
+        # The overlay is shown in the axial view and turns the instrumentation on while
+        # it is shown.
+        if self.instrumentation_text is None:
+            self.instrumentation_was_enabled = instrumentation.is_enabled()
+            instrumentation.enable(True)
+            text = TextZero()
+            text.SetSize(const.TEXT_SIZE_SMALL)
+            text.SetPosition(const.TEXT_POS_INSTRUMENTATION)
+            text.property.SetFontFamilyToCourier()
+            text.actor.GetTextProperty().ShallowCopy(text.property)
+            self.text_batches["AXIAL"].Add(text)
+            self.instrumentation_text = text
+        else:
+            self.text_batches["AXIAL"].Remove(self.instrumentation_text)
+            self.instrumentation_text = None
+            instrumentation.enable(self.instrumentation_was_enabled)
+        self.UpdateRender()
+
+    def __create_interactor_style(self, style: int, orientation: str) -> vtkInteractorStyleImage:
+        if style == const.SLICE_STATE_CROSS:
+            return CrossInteractorStyle_2(self, orientation)
+        return ROIInteractorStyle_2(self, orientation, style)
 
-    def SetInteractorStyle(self) -> None:
-        style_axial = CrossInteractorStyle_2(self, "AXIAL")
-        self.interactor_axial.SetInteractorStyle(style_axial)
+    def __set_interactor_style(self, orientation: str, style: vtkInteractorStyleImage) -> None:
+        if self.layout is not None:
+            self.layout.SetViewportStyle(orientation, style)
+        else:
+            self.GetInteractor(orientation).SetInteractorStyle(style)
+
+    def SetInteractorStyle(self, style=const.SLICE_STATE_CROSS) -> None:
+        if style != self.interaction_style:
+            for orientation in ("AXIAL", "CORONAL", "SAGITAL"):
+                self.RemoveROI(orientation)
+        self.interaction_style = style
+        for orientation in ("AXIAL", "CORONAL", "SAGITAL"):
+            self.__warm_summed_area_table(orientation)
+
+        style_axial = self.__create_interactor_style(style, "AXIAL")
+        self.__set_interactor_style("AXIAL", style_axial)
         self.style_axial = style_axial
 
-        style_coronal = CrossInteractorStyle_2(self, "CORONAL")
-        self.interactor_coronal.SetInteractorStyle(style_coronal)
+        style_coronal = self.__create_interactor_style(style, "CORONAL")
+        self.__set_interactor_style("CORONAL", style_coronal)
         self.style_coronal = style_coronal
 
-        style_sagital = CrossInteractorStyle_2(self, "SAGITAL")
-        self.interactor_sagital.SetInteractorStyle(style_sagital)
+        style_sagital = self.__create_interactor_style(style, "SAGITAL")
+        self.__set_interactor_style("SAGITAL", style_sagital)
         self.style_sagital = style_sagital
 
+        self.UpdateRender()
+
+    @instrumentation.timed("set_slice_number")
     def set_slice_number(self, index: int, orientation: str) -> None:
+        MemoryManager().Touch(self.study_id)
+
         index = max(index, 0)
         index = min(index, self.slice.GetNumberOfSlices(orientation) - 1)
         image = self.slice.GetSlices(orientation, index, self.number_slices)
@@ -638,8 +577,6 @@ class SliceViewer:
             self.__update_display_extent(image, orientation)
 
             self.cross_axial.SetModelBounds(self.slice_data_axial.actor.GetBounds())
-            self.cross_axial.Update()
-            self.cross_axial.GetOutput().GetCellData().SetScalars(self.color_array_axial)
         elif orientation == "CORONAL":
             self.slice_data_coronal.actor.SetInputData(image)
             self.slice_data_coronal.SetNumber(index)
@@ -647,8 +584,6 @@ class SliceViewer:
             self.__update_display_extent(image, orientation)
 
             self.cross_coronal.SetModelBounds(self.slice_data_coronal.actor.GetBounds())
-            self.cross_coronal.Update()
-            self.cross_coronal.GetOutput().GetCellData().SetScalars(self.color_array_coronal)
         else:
             self.slice_data_sagital.actor.SetInputData(image)
             self.slice_data_sagital.SetNumber(index)
@@ -656,8 +591,14 @@ class SliceViewer:
             self.__update_display_extent(image, orientation)
 
             self.cross_sagital.SetModelBounds(self.slice_data_sagital.actor.GetBounds())
-            self.cross_sagital.Update()
-            self.cross_sagital.GetOutput().GetCellData().SetScalars(self.color_array_sagital)
+
+        # The ROI stays in place and its statistics follow the new slice.
+        if orientation in self.roi:
+            self.__update_roi_stats(orientation)
+        self.__warm_summed_area_table(orientation)
+
+        if self.slice.GetNumberOfPhases() > 1:
+            self.slice.PrefetchPhases(orientation, index)
 
     def SetInput(self) -> None:
         self.slice_data_axial = self.create_slice_window("AXIAL")
@@ -670,7 +611,10 @@ class SliceViewer:
         self.EnableText("CORONAL")
         self.EnableText("SAGITAL")
 
-        self.slice = Slice()
+        self.__build_roi_actors("AXIAL")
+        self.__build_roi_actors("CORONAL")
+        self.__build_roi_actors("SAGITAL")
+        self.__update_phase_text()
 
         position_axial = self.slice.GetNumberOfSlices("AXIAL") // 2
         self.set_slice_number(position_axial, "AXIAL")
@@ -693,11 +637,141 @@ class SliceViewer:
         self.__update_camera("SAGITAL")
         self.renderer_sagital.ResetCamera()
 
-        self.interactor_axial.GetRenderWindow().Render()
-        self.interactor_coronal.GetRenderWindow().Render()
-        self.interactor_sagital.GetRenderWindow().Render()
+        if self.layout is not None:
+            self.layout.full_redraw = True
+            self.layout.Render()
+        else:
+            self.interactor_axial.GetRenderWindow().Render()
+            self.interactor_coronal.GetRenderWindow().Render()
+            self.interactor_sagital.GetRenderWindow().Render()
 
         self.SetInteractorStyle()
+        self.scheduler.Start()
+        self.bus.SetInteractor(self.interactor_axial)
+        # The caches grown by the slice steps and the prefetch are evicted on a timer.
+        if self.memory_timer_id is None:
+            self.interactor_axial.AddObserver("TimerEvent", self.OnMemoryTimer)
+            self.memory_timer_id = self.interactor_axial.CreateRepeatingTimer(ENFORCE_INTERVAL_MS)
+
+    def OnMemoryTimer(self, obj: vtkRenderWindowInteractor, event: str) -> None:
+        if obj.GetTimerEventId() == self.memory_timer_id:
+            MemoryManager().Enforce()
+
+    def ReloadInput(self, old_spacing: Tuple) -> None:
+        # The slices prefetched by the cine players belong to the old volume.
+        for orientation in list(self.cine):
+            self.ToggleCine(orientation)
+
+        # Keeps the same world position of each slice in the new volume grid.
+        spacing = self.slice.spacing
+        position_axial = round(self.scroll_position_axial * old_spacing[2] / spacing[2])
+        position_coronal = round(self.scroll_position_coronal * old_spacing[1] / spacing[1])
+        position_sagital = round(self.scroll_position_sagital * old_spacing[0] / spacing[0])
+
+        self.set_slice_number(position_axial, "AXIAL")
+        self.scroll_position_axial = self.slice_data_axial.number
+        self.set_slice_number(position_coronal, "CORONAL")
+        self.scroll_position_coronal = self.slice_data_coronal.number
+        self.set_slice_number(position_sagital, "SAGITAL")
+        self.scroll_position_sagital = self.slice_data_sagital.number
+
+        x, y, z = self.cross_axial.GetFocalPoint()
+        self.SetCrossFocalPoint([x, y, z])
+        self.UpdateRender()
+        # 3D
+        self.bus.Send(Event.UPDATE_SLICE_3D, orientations=["AXIAL", "CORONAL", "SAGITAL"])
+        self.bus.Send(Event.UPDATE_VOLUME)
+
+    def GetScrollPosition(self, orientation: str) -> int:
+        if orientation == "AXIAL":
+            return self.scroll_position_axial
+        elif orientation == "CORONAL":
+            return self.scroll_position_coronal
+        return self.scroll_position_sagital
+
+    def SetScrollPosition(self, orientation: str, position: int) -> None:
+        """
+        Shows the slice of the orientation and moves the cross to it, without
+        rendering.
+        """
+        self.set_slice_number(position, orientation)
+        if orientation == "AXIAL":
+            self.scroll_position_axial = position
+            x, y, z = self.cross_axial.GetFocalPoint()
+        elif orientation == "CORONAL":
+            self.scroll_position_coronal = position
+            x, y, z = self.cross_coronal.GetFocalPoint()
+        else:
+            self.scroll_position_sagital = position
+            x, y, z = self.cross_sagital.GetFocalPoint()
+        self.SetCrossFocalPoint([x, y, z])
+
+    def ToggleCine(self, orientation: str) -> None:
+        player = self.cine.pop(orientation, None)
+        if player is not None:
+            player.Stop()
+        else:
+            player = CinePlayer(self, orientation)
+            self.cine[orientation] = player
+            player.Start()
+
+    def ChangeCineFps(self, orientation: str, step: int) -> None:
+        player = self.cine.get(orientation)
+        if player is not None:
+            player.SetFps(player.fps + step)
+
+    def TogglePhaseCine(self) -> None:
+        if self.slice.GetNumberOfPhases() < 2:
+            return
+        if self.phase_cine is not None:
+            self.phase_cine.Stop()
+            self.phase_cine = None
+        else:
+            self.phase_cine = PhaseCinePlayer(self)
+            self.phase_cine.Start()
+
+    def StepPhase(self, step: int) -> None:
+        if self.slice.GetNumberOfPhases() > 1:
+            Publisher.sendMessage(self.Topic("Set phase"), phase=self.slice.phase + step)
+
+    def OnChangePhase(self, phase: int, update_3d: bool = True) -> None:
+        # The phases share the geometry: the same slices are shown in the new phase.
+        self.set_slice_number(self.scroll_position_axial, "AXIAL")
+        self.set_slice_number(self.scroll_position_coronal, "CORONAL")
+        self.set_slice_number(self.scroll_position_sagital, "SAGITAL")
+        self.__update_phase_text()
+        self.UpdateRender()
+        if update_3d:
+            # Posted: the volume viewer swaps its input in its own handler of the phase
+            # change, which may run after this one.
+            self.bus.Post(Event.UPDATE_SLICE_3D, orientations=["AXIAL", "CORONAL", "SAGITAL"])
+            self.bus.Post(Event.UPDATE_VOLUME)
+
+    def StepFusionOpacity(self, step: float) -> None:
+        if self.slice.fusion is not None:
+            Publisher.sendMessage(self.Topic("Set fusion opacity"), opacity=self.slice.opacity + step)
+
+    def OnChangeFusion(self) -> None:
+        # The slices shown are blended again from the cached fusion layers.
+        self.set_slice_number(self.scroll_position_axial, "AXIAL")
+        self.set_slice_number(self.scroll_position_coronal, "CORONAL")
+        self.set_slice_number(self.scroll_position_sagital, "SAGITAL")
+        self.UpdateRender()
+        self.bus.Send(Event.UPDATE_SLICE_3D, orientations=["AXIAL", "CORONAL", "SAGITAL"])
+
+    def __update_phase_text(self) -> None:
+        number_of_phases = self.slice.GetNumberOfPhases()
+        if number_of_phases < 2:
+            return
+        if self.phase_text is None:
+            text = TextZero()
+            text.SetSize(const.TEXT_SIZE_SMALL)
+            text.SetPosition(const.TEXT_POS_PHASE)
+            text.property.SetJustificationToRight()
+            text.actor.GetTextProperty().ShallowCopy(text.property)
+            self.text_batches["AXIAL"].Add(text)
+            self.phase_text = text
+        self.phase_text.SetValue("Phase %d/%d" % (self.slice.phase + 1, number_of_phases))
 
     def OnScrollForward(self, orientation: str) -> None:
         min = 0
@@ -724,10 +798,11 @@ class SliceViewer:
                 x, y, z = self.cross_sagital.GetFocalPoint()
                 self.SetCrossFocalPoint([x, y, z])
 
-            self.UpdateRender()
+            # A burst of scroll steps renders once.
+            self.bus.Post(Event.UPDATE_MPR)
             # 3D
-            Publisher.sendMessage("Update slice 3d", orientations=[orientation])
-            Publisher.sendMessage("Update volume")
+            self.bus.Post(Event.UPDATE_SLICE_3D, orientations=[orientation])
+            self.bus.Post(Event.UPDATE_VOLUME)
 
     def OnScrollBackward(self, orientation: str) -> None:
         max = self.slice.GetMaxSliceNumber(orientation)
@@ -754,10 +829,11 @@ class SliceViewer:
                 x, y, z = self.cross_sagital.GetFocalPoint()
                 self.SetCrossFocalPoint([x, y, z])
 
-            self.UpdateRender()
+            # A burst of scroll steps renders once.
+            self.bus.Post(Event.UPDATE_MPR)
             # 3D
-            Publisher.sendMessage("Update slice 3d", orientations=[orientation])
-            Publisher.sendMessage("Update volume")
+            self.bus.Post(Event.UPDATE_SLICE_3D, orientations=[orientation])
+            self.bus.Post(Event.UPDATE_VOLUME)
 
     def startApp(self):
         self.interactor_axial.Start()
@@ -1,113 +1,257 @@
-import vtk
+from vtkmodules.vtkCommonDataModel import vtkImageData, vtkPiecewiseFunction
+from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
+from vtkmodules.vtkRenderingCore import (
+    vtkColorTransferFunction,
+    vtkPointPicker,
+    vtkRenderer,
+    vtkVolume,
+    vtkVolumeProperty,
+)
 from pubsub import pub as Publisher
-from typing import List
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple
 
+import constants as const
+import presets
+import utils
+import instrumentation
 from slice_ import Slice
-from converters import to_vtk
+from converters import (
+    get_quantization,
+    get_transfer_function_range,
+    is_in_quantized_range,
+    quantize_volume,
+    rescale_transfer_function,
+    to_vtk,
+)
+from layout import ViewportLayout
+from events import Event, EventBus
+from scheduler import PRIORITY_HIGH, TaskScheduler
+from vtk_utils import create_volume_mapper, vtkRenderWindow, vtkRenderWindowInteractor
+
+if TYPE_CHECKING:
+    from vtkmodules.vtkInteractionWidgets import vtk3DWidget
+    from vtkmodules.vtkRenderingVolume import vtkFixedPointVolumeRayCastMapper
 
 class VolumeViewer:
-    def __init__(self, mode: str) -> None:
+    def __init__(self, mode: str, layout: ViewportLayout = None, render_dtype: str = None) -> None:
+        # The viewer shows the study that is active when it is created.
+        self.study_id = utils.get_active_study()
+        self.slice = Slice()
+        self.bus = EventBus()
         self.mode = mode
         self.slice_plane = None
         self.pointer_actor = None
+        # Built with the 3D scene.
+        self.volume_mapper = None
+        # vtkImageData of the phases of a 4D volume, built on the first visit.
+        self.phase_images = {}
+        # Scalar type ("uint8" or "uint16") the volume is quantised to for the ray
+        # casters, in the range of the transfer function; None renders the voxels.
+        self.render_dtype = render_dtype
+        # (offset, scale) of the quantisation of the rendered image.
+        self.scalar_mapping = None
+        self.CreateTransferFunction()
 
-        render_window = vtk.vtkRenderWindow()
-        render_window.SetWindowName("Volume")
-        render_window.SetSize(350, 350)
-        render_window.SetPosition(1050, 0)
-        # Turn off warning
-        render_window.GlobalWarningDisplayOff()
-
-        self.renderer = vtk.vtkRenderer()
-        render_window.AddRenderer(self.renderer)
+        self.layout = layout
+        self.renderer = vtkRenderer()
+        if layout is not None and layout.HasView("VOLUME"):
+            layout.AddViewport("VOLUME", self.renderer)
+            self.interactor = layout.interactor
+        else:
+            self.layout = None
+            render_window = vtkRenderWindow()
+            render_window.SetWindowName("Volume")
+            render_window.SetSize(350, 350)
+            render_window.SetPosition(1050, 0)
+            # Turn off warning
+            render_window.GlobalWarningDisplayOff()
+            render_window.AddRenderer(self.renderer)
 
-        self.interactor = vtk.vtkRenderWindowInteractor()
-        self.interactor.SetRenderWindow(render_window)
-        picker = vtk.vtkPointPicker()
-        self.interactor.SetPicker(picker)
+            self.interactor = vtkRenderWindowInteractor()
+            self.interactor.SetRenderWindow(render_window)
+            picker = vtkPointPicker()
+            self.interactor.SetPicker(picker)
         self.SetInteractor()
 
         self.__bind_events()
 
     def __bind_events(self) -> None:
-        Publisher.subscribe(self.LoadVolume, "Load volume")
-        Publisher.subscribe(self.UpdateSlice3D, "Update slice 3d")
-        Publisher.subscribe(self.UpdateRender, "Update volume")
+        Publisher.subscribe(self.LoadVolume, self.Topic("Load volume"))
+        self.bus.Subscribe(Event.UPDATE_SLICE_3D, self.UpdateSlice3D)
+        self.bus.Subscribe(Event.UPDATE_VOLUME, self.UpdateRender)
+        Publisher.subscribe(self.ReloadVolume, self.Topic("Reload volume data"))
+        Publisher.subscribe(self.SetPhase, self.Topic("Change phase"))
+        Publisher.subscribe(self.LoadPreset, self.Topic("Load transfer function preset"))
+        Publisher.subscribe(self.StepPreset, self.Topic("Step transfer function preset"))
+        Publisher.subscribe(self.EditPreset, self.Topic("Edit transfer function"))
+        self.interactor.AddObserver("TimerEvent", self.OnTimer)
+
+    def Topic(self, topic: str) -> str:
+        return utils.get_topic(topic, self.study_id)
 
+    @instrumentation.timed("render 3d")
     def UpdateRender(self) -> None:
-        self.interactor.Render()
+        if self.layout is not None:
+            self.layout.Render()
+        else:
+            self.interactor.Render()
 
-    def SetWidgetInteractor(self, widget: vtk.vtk3DWidget) -> None:
+    def SetWidgetInteractor(self, widget: "vtk3DWidget") -> None:
+        # The interactor may be shared with the slice viewports.
+        widget.SetDefaultRenderer(self.renderer)
         widget.SetInteractor(self.interactor)
 
     def LoadSlicePlane(self) -> None:
-        self.slice_plane = SlicePlane()
+        self.slice_plane = SlicePlane(self.slice)
 
     def SetInteractor(self, style=None) -> None:
         if style is None:
-            style = vtk.vtkInteractorStyleTrackballCamera()
-        self.interactor.SetInteractorStyle(style)
+            style = vtkInteractorStyleTrackballCamera()
+            style.AddObserver("CharEvent", self.OnChar)
+        if self.layout is not None:
+            self.layout.SetViewportStyle("VOLUME", style)
+        else:
+            self.interactor.SetInteractorStyle(style)
+
+    def OnChar(self, obj: vtkInteractorStyleTrackballCamera, event: str) -> None:
+        key = obj.GetInteractor().GetKeySym()
+        if key == const.PRESET_NEXT_KEY:
+            Publisher.sendMessage(self.Topic("Step transfer function preset"), step=1)
+        elif key == const.PRESET_PREVIOUS_KEY:
+            Publisher.sendMessage(self.Topic("Step transfer function preset"), step=-1)
+        else:
+            obj.OnChar()
+
+    def CreateTransferFunction(self) -> None:
+        # Transfer functions in the values of the voxels (HU), filled by the presets.
+        self.scalar_color = vtkColorTransferFunction()
+        self.scalar_opacity = vtkPiecewiseFunction()
+        self.gradient_opacity = vtkPiecewiseFunction()
+        self.preset_name = presets.DEFAULT_PRESET
+        # Edits of the preset waiting for the timer that applies them.
+        self.preset_edits = {}
+        self.edit_timer_id = None
+        self.SetPreset(presets.PRESETS[self.preset_name])
+
+    def SetPreset(self, preset: Dict, refit: bool = True) -> None:
+        """
+        Shows a preset (see presets.PRESETS) with the mapper and the volume property
+        of the scene. refit quantises the volume again for a new range of the transfer
+        function; otherwise only a range that no longer fits does.
+        """
+        self.preset_source = preset
+        self.preset = presets.analyse_preset(preset)
+        presets.fill_transfer_function(self.preset, self.scalar_color, self.scalar_opacity, self.gradient_opacity)
+        if self.volume_mapper is not None:
+            self.ApplyTransferFunction(refit)
+
+    def LoadPreset(self, name: str) -> None:
+        self.preset_name = name
+        self.preset_edits = {}
+        self.SetPreset(presets.PRESETS[name])
+        if self.volume_mapper is not None:
+            self.UpdateRender()
+
+    def StepPreset(self, step: int) -> None:
+        names = list(presets.PRESETS)
+        index = names.index(self.preset_name) if self.preset_name in names else -step
+        self.LoadPreset(names[(index + step) % len(names)])
+
+    def EditPreset(self, **changes) -> None:
+        """
+        Live editing: changes the keys of the preset shown (e.g. "opacity"). The edits
+        of an interaction are merged and applied at most once per
+        TRANSFER_FUNCTION_EDIT_MS, to the same volume property and mapper.
+        """
+        self.preset_edits.update(changes)
+        if self.edit_timer_id is not None:
+            return
+        if not self.interactor.GetInitialized():
+            self.ApplyPresetEdits()
+            return
+        self.edit_timer_id = self.interactor.CreateOneShotTimer(const.TRANSFER_FUNCTION_EDIT_MS)
+
+    def OnTimer(self, obj: vtkRenderWindowInteractor, event: str) -> None:
+        if self.edit_timer_id is None or obj.GetTimerEventId() != self.edit_timer_id:
+            return
+        self.edit_timer_id = None
+        self.ApplyPresetEdits()
+
+    @instrumentation.timed("transfer function edit")
+    def ApplyPresetEdits(self) -> None:
+        preset = dict(self.preset_source)
+        preset.update(self.preset_edits)
+        self.preset_edits = {}
+        presets.validate_preset(preset)
+        self.SetPreset(preset, refit=False)
+        if self.volume_mapper is not None:
+            self.UpdateRender()
+
+    def GetScalarMapping(self) -> Tuple[float, float]:
+        if self.render_dtype is None:
+            return None
+        lower, upper = get_transfer_function_range(self.scalar_color, self.scalar_opacity)
+        return get_quantization(lower, upper, self.render_dtype)
+
+    def ToRenderImage(self, n_array, spacing: Tuple, mapping: Tuple[float, float]) -> vtkImageData:
+        if mapping is None:
+            return to_vtk(n_array, spacing)
+        offset, scale = mapping
+        return to_vtk(quantize_volume(n_array, offset, scale, self.render_dtype), spacing)
 
     def LoadImage(self) -> None:
-        slice_data = Slice()
-        n_array = slice_data.matrix
-        spacing = slice_data.spacing
-        image = to_vtk(n_array, spacing)
+        n_array, spacing = self.slice.GetVolumeMatrix()
+        mapping = self.GetScalarMapping()
+        self.SetImage(self.ToRenderImage(n_array, spacing, mapping), mapping)
+
+    def SetImage(self, image: vtkImageData, mapping: Tuple[float, float] = None) -> None:
         self.image = image
+        self.scalar_mapping = mapping
+        self.phase_images = {}
+        if self.slice.phases is not None:
+            self.phase_images[self.slice.phase] = image
     
     def LoadVolume(self) -> None:
         self.LoadImage()
-        image = self.image
+        self.BuildScene()
+
+    def LoadVolumeInBackground(self, scheduler: TaskScheduler, callback: Callable = None) -> None:
+        """
+        Converts the volume on a worker thread of scheduler and builds the 3D scene
+        when the result is delivered, so the MPR shows first.
+        """
+        n_array, spacing = self.slice.GetVolumeMatrix()
+        mapping = self.GetScalarMapping()
 
+        def on_image(image: vtkImageData) -> None:
+            self.SetImage(image, mapping)
+            self.BuildScene()
+            if callback is not None:
+                callback()
+
+        scheduler.Submit(self.ToRenderImage, n_array, spacing, mapping, priority=PRIORITY_HIGH, callback=on_image)
+
+    def BuildScene(self) -> None:
+        image = self.image
+        volume_mapper = create_volume_mapper(self.mode)
         if self.mode == "GPU":
-            volume_mapper = vtk.vtkOpenGLGPUVolumeRayCastMapper()
             volume_mapper.SetInputData(image)
             volume_mapper.AutoAdjustSampleDistancesOff()
             volume_mapper.LockSampleDistanceToInputSpacingOn()
         else:
-            volume_mapper = vtk.vtkFixedPointVolumeRayCastMapper()
             volume_mapper.SetInputData(image)
             volume_mapper.SetAutoAdjustSampleDistances(True)
             volume_mapper.SetLockSampleDistanceToInputSpacing(False)
             volume_mapper.SetImageSampleDistance(1.0)
-            spacing = image.GetSpacing()
-            sampleDistance = (spacing[0] + spacing[1] + spacing[2])/6
-            volume_mapper.SetSampleDistance(sampleDistance)
-            volume_mapper.SetInteractiveSampleDistance(sampleDistance)
+            self.SetSampleDistance(volume_mapper, image)
+        self.volume_mapper = volume_mapper
 
-        volume_properties = vtk.vtkVolumeProperty()
+        volume_properties = vtkVolumeProperty()
         volume_properties.SetInterpolationTypeToLinear()
-        volume_properties.ShadeOn()
-        volume_properties.SetAmbient(0.15)
-        volume_properties.SetDiffuse(0.9)
-        volume_properties.SetSpecular(0.3)
-        volume_properties.SetSpecularPower(15)
-
-        scalar_color = vtk.vtkColorTransferFunction()
-        scalar_color.AddRGBPoint(-3024, 0, 0, 0)
-        scalar_color.AddRGBPoint(143.556, 0.615686, 0.356863, 0.184314)
-        scalar_color.AddRGBPoint(166.222, 0.882353, 0.603922, 0.290196)
-        scalar_color.AddRGBPoint(214.389, 1, 1, 1)
-        scalar_color.AddRGBPoint(419.736, 1, 0.937033, 0.954531)
-        scalar_color.AddRGBPoint(3071, 0.827451, 0.658824, 1)
-        volume_properties.SetColor(scalar_color)
-
-        scalar_opacity = vtk.vtkPiecewiseFunction()
-        scalar_opacity.AddPoint(-3024, 0)
-        scalar_opacity.AddPoint(143.556, 0)
-        scalar_opacity.AddPoint(166.222, 0.686275)
-        scalar_opacity.AddPoint(214.389, 0.696078)
-        scalar_opacity.AddPoint(419.736, 0.833333)
-        scalar_opacity.AddPoint(3071, 0.803922)
-        volume_properties.SetScalarOpacity(scalar_opacity)
-
-        gradient_opacity = vtk.vtkPiecewiseFunction()
-        gradient_opacity.AddPoint(0, 1)
-        gradient_opacity.AddPoint(255, 1)
-        volume_properties.SetGradientOpacity(gradient_opacity)
         self.volume_properties = volume_properties
+        self.ApplyTransferFunction()
 
-        volume = vtk.vtkVolume()
+        volume = vtkVolume()
         volume.SetMapper(volume_mapper)
         volume.SetProperty(volume_properties)
         self.volume = volume
@@ -123,19 +267,81 @@ class VolumeViewer:
         self.SetWidgetInteractor(self.slice_plane.plane_x)
         self.slice_plane.Disable()
 
-        self.interactor.GetRenderWindow().Render()
+        if self.layout is not None:
+            self.layout.full_redraw = True
+            self.layout.Render()
+        else:
+            self.interactor.GetRenderWindow().Render()
+
+    def ApplyTransferFunction(self, refit: bool = True) -> None:
+        """
+        Sets the transfer functions and the lighting of the preset on the volume
+        property, the functions rescaled to the scalars of a quantised image. A change
+        of their range quantises the volume again, unless refit is False and the new
+        range fits in the quantised one.
+        """
+        mapping = self.GetScalarMapping()
+        if mapping != self.scalar_mapping and self.volume_mapper is not None:
+            lower, upper = get_transfer_function_range(self.scalar_color, self.scalar_opacity)
+            if refit or not is_in_quantized_range(lower, upper, *self.scalar_mapping, self.render_dtype):
+                self.LoadImage()
+                self.volume_mapper.SetInputData(self.image)
+        if self.scalar_mapping is None:
+            functions = (self.scalar_color, self.scalar_opacity, self.gradient_opacity)
+        else:
+            functions = rescale_transfer_function(self.scalar_color, self.scalar_opacity, self.gradient_opacity, *self.scalar_mapping)
+        scalar_color, scalar_opacity, gradient_opacity = functions
+        self.volume_properties.SetColor(scalar_color)
+        self.volume_properties.SetScalarOpacity(scalar_opacity)
+        self.volume_properties.SetGradientOpacity(gradient_opacity)
+        presets.apply_lighting(self.preset, self.volume_properties)
+
+    def SetSampleDistance(self, volume_mapper: "vtkFixedPointVolumeRayCastMapper", image: vtkImageData) -> None:
+        spacing = image.GetSpacing()
+        sampleDistance = (spacing[0] + spacing[1] + spacing[2])/6
+        volume_mapper.SetSampleDistance(sampleDistance)
+        volume_mapper.SetInteractiveSampleDistance(sampleDistance)
+
+    def ReloadVolume(self, old_spacing: Tuple) -> None:
+        # The volume data was replaced (e.g. resampled), the mapper and the transfer
+        # functions are kept.
+        if self.volume_mapper is None:
+            return
+        self.LoadImage()
+        self.volume_mapper.SetInputData(self.image)
+        if self.mode != "GPU":
+            self.SetSampleDistance(self.volume_mapper, self.image)
+
+    def SetPhase(self, phase: int, update_3d: bool = True) -> None:
+        # Only the input of the mapper changes. The render is posted once the new input
+        # is set, as the other handlers of "Change phase" may run before this one.
+        if self.volume_mapper is None:
+            return
+        image = self.phase_images.get(phase)
+        if image is None:
+            image = self.phase_images[phase] = self.ToRenderImage(self.slice.phases[phase], self.slice.spacing, self.scalar_mapping)
+        self.image = image
+        self.volume_mapper.SetInputData(image)
+        if update_3d:
+            self.bus.Post(Event.UPDATE_VOLUME)
 
     def UpdateSlice3D(self, orientations: List) -> None:
+        if self.slice_plane is None:
+            return
         for orientation in orientations:
             self.slice_plane.ChangeSlice(orientation)
 
 class SlicePlane:
-    def __init__(self) -> None:
+    def __init__(self, slice: Slice) -> None:
+        self.slice = slice
         self.Create()
 
     def Create(self) -> None:
+        # Imported with the 3D scene, off the startup path.
+        from vtkmodules.vtkInteractionWidgets import vtkImagePlaneWidget
+
         # 3D widget for reslicing image data.
-        plane_x = self.plane_x = vtk.vtkImagePlaneWidget()
+        plane_x = self.plane_x = vtkImagePlaneWidget()
         plane_x.InteractionOff()
         # Convenience method sets the plane orientation normal to the x, y, or z axes.
         plane_x.SetPlaneOrientationToXAxes()
@@ -150,7 +356,7 @@ class SlicePlane:
         plane_x.GetPlaneProperty().SetColor(0, 1, 0)
         plane_x.GetSelectedPlaneProperty().SetColor(0, 1, 0)
 
-        plane_y = self.plane_y = vtk.vtkImagePlaneWidget()
+        plane_y = self.plane_y = vtkImagePlaneWidget()
         # Enable/disable text display of window-level, image coordinates and scalar values in a render window.
         plane_y.DisplayTextOff()
         plane_y.SetPlaneOrientationToYAxes()
@@ -162,7 +368,7 @@ class SlicePlane:
         plane_y.GetPlaneProperty().SetColor(0, 0, 1)
         plane_y.GetSelectedPlaneProperty().SetColor(0, 0, 1)
 
-        plane_z = self.plane_z = vtk.vtkImagePlaneWidget()
+        plane_z = self.plane_z = vtkImagePlaneWidget()
         plane_z.InteractionOff()
         plane_z.SetPlaneOrientationToZAxes()
         plane_z.TextureVisibilityOn()
@@ -205,13 +411,13 @@ class SlicePlane:
         del self.plane_x
 
     def UpdateAllSlice(self) -> None:
-        slice = Slice()
+        slice = self.slice
         slice.UpdateSlice3D(self.plane_z, "AXIAL")
         slice.UpdateSlice3D(self.plane_y, "CORONAL")
         slice.UpdateSlice3D(self.plane_x, "SAGITAL")
 
     def ChangeSlice(self, orientation: str) -> None:
-        slice = Slice()
+        slice = self.slice
         if orientation == "AXIAL" and self.plane_z.GetEnabled():
             slice.UpdateSlice3D(self.plane_z, orientation)
         elif orientation == "CORONAL" and self.plane_y.GetEnabled():
@@ -1,10 +1,25 @@
-import vtk
+# Only the VTK modules used are imported instead of the whole vtk package. Importing
+# these ones registers the OpenGL implementations of the rendering classes, the
+# platform interactor, the default interactor style and the fonts. They are imported
+# here only: the modules that create render windows import the window classes from
+# this module, so the implementations are registered first.
+import vtkmodules.vtkInteractionStyle  # noqa: F401
+import vtkmodules.vtkRenderingFreeType  # noqa: F401
+import vtkmodules.vtkRenderingOpenGL2  # noqa: F401
+import vtkmodules.vtkRenderingUI  # noqa: F401
+from vtkmodules.vtkRenderingCore import (  # noqa: F401
+    vtkAbstractVolumeMapper,
+    vtkRenderWindow,
+    vtkRenderWindowInteractor,
+    vtkTextActor,
+    vtkTextProperty,
+)
 
 import constants as const
 
 class TextZero:
     def __init__(self) -> None:
-        property = vtk.vtkTextProperty()
+        property = vtkTextProperty()
         property.SetFontSize(const.TEXT_SIZE_LARGE)
         property.SetFontFamilyToArial()
         property.BoldOn()
@@ -14,7 +29,7 @@ class TextZero:
         property.SetColor(const.TEXT_COLOUR)
         self.property = property
 
-        actor = vtk.vtkTextActor()
+        actor = vtkTextActor()
         actor.GetTextProperty().ShallowCopy(property)
         actor.GetPositionCoordinate().SetCoordinateSystemToNormalizedDisplay()
         actor.PickableOff()
@@ -29,6 +44,7 @@ class TextZero:
 
     def SetColour(self, colour: tuple) -> None:
         self.property.SetColor(colour)
+        self.actor.GetTextProperty().ShallowCopy(self.property)
 
     def SetSize(self, size: int) -> None:
         self.property.SetFontSize(size)
@@ -43,3 +59,16 @@ class TextZero:
     def SetPosition(self, position: tuple) -> None:
         self.actor.GetPositionCoordinate().SetValue(position[0], position[1])
         self.position = position
+
+def create_volume_mapper(mode: str) -> vtkAbstractVolumeMapper:
+    """
+    Ray cast mapper of the render mode, GPU or CPU. The volume rendering modules are
+    imported on the first call, off the startup path; the OpenGL2 one also registers
+    the display helper of the CPU mapper.
+    """
+    from vtkmodules.vtkRenderingVolume import vtkFixedPointVolumeRayCastMapper
+    from vtkmodules.vtkRenderingVolumeOpenGL2 import vtkOpenGLGPUVolumeRayCastMapper
+
+    if mode == "GPU":
+        return vtkOpenGLGPUVolumeRayCastMapper()
+    return vtkFixedPointVolumeRayCastMapper()
@@ -0,0 +1,279 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from argparse import ArgumentParser
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from vtkmodules.vtkCommonCore import vtkUnsignedCharArray, vtkVersion
+from vtkmodules.vtkFiltersGeneral import vtkCursor3D
+from vtkmodules.vtkRenderingCore import vtkRenderer
+
+import concurrency
+import converters
+from overlay import CrossOverlay, TextBatch
+from phantom import make_volume
+from slice_ import Slice
+from vtk_utils import TextZero
+
+ORIENTATIONS = ("AXIAL", "CORONAL", "SAGITAL")
+RENDER_BENCHMARKS = ("scroll", "volume_cpu", "volume_gpu", "volume_cpu_uint8", "volume_cpu_uint16", "replay")
+
+def measure(func, repeat: int) -> dict:
+    samples = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples = np.array(samples)
+    return {
+        "repeat": repeat,
+        "mean_ms": float(samples.mean()),
+        "min_ms": float(samples.min()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+    }
+
+def bench_get_image_slice(slice: Slice, repeat: int) -> dict:
+    results = {}
+    for orientation in ORIENTATIONS:
+        n = slice.GetNumberOfSlices(orientation)
+
+        def run(i):
+            # The buffer is discarded so every call extracts the slice.
+            slice.buffer_slices[orientation].discard_buffer()
+            slice.get_image_slice(orientation, i % n)
+
+        results[orientation] = measure(run, repeat)
+    return results
+
+def bench_get_slices(slice: Slice, repeat: int) -> dict:
+    results = {}
+    for orientation in ORIENTATIONS:
+        n = slice.GetNumberOfSlices(orientation)
+
+        def run(i):
+            slice.GetSlices(orientation, i % n, 1)
+
+        results[orientation] = measure(run, repeat)
+    return results
+
+def bench_to_vtk(slice: Slice, repeat: int) -> dict:
+    results = {}
+    for orientation in ORIENTATIONS:
+        n_image = slice.get_image_slice(orientation, slice.GetNumberOfSlices(orientation) // 2)
+        results[orientation] = measure(lambda i: converters.to_vtk(n_image, slice.spacing, i, orientation), repeat)
+    return results
+
+def bench_ww_wl(slice: Slice, repeat: int) -> dict:
+    n_image = slice.get_image_slice("AXIAL", slice.GetNumberOfSlices("AXIAL") // 2)
+    image = converters.to_vtk(n_image, slice.spacing, 0, "AXIAL")
+    result = measure(lambda i: slice.do_ww_wl(image), repeat)
+    result["mpixels_per_s"] = n_image.size / 1e6 / (result["mean_ms"] / 1000)
+    return result
+
+def bench_quantize(slice: Slice, repeat: int, dtype: str) -> dict:
+    # Quantisation of the render volume to the range of the default transfer function.
+    offset, scale = converters.get_quantization(-3024, 3071, dtype)
+    return measure(lambda i: converters.quantize_volume(slice.matrix, offset, scale, dtype), max(repeat // 20, 1))
+
+def bench_overlay(repeat: int) -> dict:
+    # Cross move: the vtkCursor3D pipeline the viewer used before, and the overlay.
+    bounds = (0.0, 255.0, 0.0, 255.0, 10.0, 10.0)
+    colours = vtkUnsignedCharArray()
+    colours.SetNumberOfComponents(3)
+    colours.SetNumberOfTuples(3)
+    cursor = vtkCursor3D()
+    cursor.AllOff()
+    cursor.AxesOn()
+    cursor.SetModelBounds(bounds)
+
+    def run_cursor(i):
+        cursor.SetFocalPoint(i % 256, (i * 7) % 256, 10.0)
+        cursor.Update()
+        cursor.GetOutput().GetCellData().SetScalars(colours)
+
+    cross = CrossOverlay([(0, 0, 255), (0, 255, 0), (255, 0, 0)])
+    cross.SetModelBounds(bounds)
+
+    # Slice number change with the texts of a view in one batch.
+    batch = TextBatch(vtkRenderer())
+    batch.size = (512, 512)
+    texts = []
+    for position in ((0.03, 0.97), (0.03, 0.5), (0.97, 0.5), (0.5, 0.97), (0.5, 0.05), (0.05, 0.07)):
+        text = TextZero()
+        text.SetPosition(position)
+        text.SetValue("%.2f" % position[0])
+        batch.Add(text)
+        texts.append(text)
+
+    def run_text(i):
+        texts[-1].SetValue("%d" % i)
+        batch.Compose()
+
+    return {
+        "cursor3d_move": measure(run_cursor, repeat),
+        "cross_overlay_move": measure(lambda i: cross.SetFocalPoint((i % 256, (i * 7) % 256, 10.0)), repeat),
+        "text_batch_change": measure(run_text, repeat),
+    }
+
+def _set_offscreen(*interactors) -> None:
+    for interactor in interactors:
+        interactor.GetRenderWindow().SetOffScreenRendering(1)
+
+def bench_scroll(slice: Slice, repeat: int) -> dict:
+    from viewer_slice import SliceViewer
+
+    viewer = SliceViewer()
+    _set_offscreen(viewer.interactor_axial, viewer.interactor_coronal, viewer.interactor_sagital)
+    viewer.SetInput()
+
+    results = {}
+    for orientation in ORIENTATIONS:
+        n = slice.GetNumberOfSlices(orientation)
+
+        def run(i):
+            viewer.set_slice_number(i % n, orientation)
+            viewer.UpdateRender()
+
+        results[orientation] = measure(run, repeat)
+    return results
+
+def bench_volume(slice: Slice, repeat: int, mode: str, render_dtype: str = None) -> dict:
+    from viewer_volume import VolumeViewer
+
+    viewer = VolumeViewer(mode, render_dtype=render_dtype)
+    _set_offscreen(viewer.interactor)
+    t0 = time.perf_counter()
+    viewer.LoadVolume()
+    load_ms = (time.perf_counter() - t0) * 1000
+
+    camera = viewer.renderer.GetActiveCamera()
+
+    def run(i):
+        camera.Azimuth(360 / repeat)
+        viewer.interactor.GetRenderWindow().Render()
+
+    result = measure(run, repeat)
+    result["load_ms"] = load_ms
+    return result
+
+def bench_replay(slice: Slice, path: str) -> dict:
+    """
+    Replays a session recorded with main.py --record as fast as possible.
+    """
+    from viewer_slice import SliceViewer
+    from viewer_volume import VolumeViewer
+    from session import SessionReplayer, get_interactors, load_session
+
+    slice_viewer = SliceViewer()
+    volume_viewer = VolumeViewer("CPU")
+    interactors = get_interactors(slice_viewer, volume_viewer)
+    _set_offscreen(*interactors.values())
+    slice_viewer.SetInput()
+    volume_viewer.LoadVolume()
+    return SessionReplayer(interactors).Replay(load_session(path))
+
+def run_benchmarks(args) -> dict:
+    shape = tuple(int(i) for i in args.shape.split(","))
+    t0 = time.perf_counter()
+    matrix = make_volume(shape, args.dtype)
+    generate_ms = (time.perf_counter() - t0) * 1000
+
+    slice = Slice()
+    slice.matrix = matrix
+    slice.spacing = tuple(float(i) for i in args.spacing.split(","))
+
+    report = {
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "threads": concurrency.configure(),
+            "numpy": np.__version__,
+            "vtk": vtkVersion.GetVTKVersion(),
+        },
+        "volume": {"shape": shape, "dtype": args.dtype, "spacing": slice.spacing, "generate_ms": generate_ms},
+        "results": {},
+    }
+
+    benchmarks = {
+        "get_image_slice": lambda: bench_get_image_slice(slice, args.repeat),
+        "GetSlices": lambda: bench_get_slices(slice, args.repeat),
+        "to_vtk": lambda: bench_to_vtk(slice, args.repeat),
+        "ww_wl": lambda: bench_ww_wl(slice, args.repeat),
+        "overlay": lambda: bench_overlay(args.repeat),
+        "quantize_uint8": lambda: bench_quantize(slice, args.repeat, "uint8"),
+        "quantize_uint16": lambda: bench_quantize(slice, args.repeat, "uint16"),
+    }
+    if not args.no_render:
+        benchmarks["scroll"] = lambda: bench_scroll(slice, args.repeat)
+        benchmarks["volume_cpu"] = lambda: bench_volume(slice, args.frames, "CPU")
+        benchmarks["volume_gpu"] = lambda: bench_volume(slice, args.frames, "GPU")
+        benchmarks["volume_cpu_uint8"] = lambda: bench_volume(slice, args.frames, "CPU", "uint8")
+        benchmarks["volume_cpu_uint16"] = lambda: bench_volume(slice, args.frames, "CPU", "uint16")
+        if args.session:
+            benchmarks["replay"] = lambda: bench_replay(slice, args.session)
+
+    for name, bench in benchmarks.items():
+        if args.only and name not in args.only.split(","):
+            continue
+        print("Running %s..." % name, file=sys.stderr)
+        if name in RENDER_BENCHMARKS and not args.only:
+            # VTK aborts the process when it cannot create an OpenGL context, so the
+            # rendering benchmarks run in a child process.
+            report["results"][name] = run_in_subprocess(name)
+            continue
+        try:
+            report["results"][name] = bench()
+        except Exception:
+            report["results"][name] = {"error": traceback.format_exc(limit=1)}
+        slice.discard_all_buffers()
+    return report
+
+def run_in_subprocess(name: str) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "result.json")
+        argv = sys.argv[1:]
+        if "--output" in argv:
+            i = argv.index("--output")
+            del argv[i : i + 2]
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *argv, "--only", name, "--output", output],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        if process.returncode != 0 or not os.path.exists(output):
+            return {"error": "exit code %d: %s" % (process.returncode, process.stderr.strip()[-500:])}
+        with open(output) as f:
+            return json.load(f)["results"][name]
+
+def main():
+    parser = ArgumentParser("Benchmark")
+    parser.add_argument("--shape", type=str, default="256,512,512", help="Volume shape dz,dy,dx")
+    parser.add_argument("--dtype", type=str, default="int16")
+    parser.add_argument("--spacing", type=str, default="0.5,0.5,1.0", help="Spacing x,y,z in mm")
+    parser.add_argument("--repeat", type=int, default=100, help="Iterations of the slice benchmarks")
+    parser.add_argument("--frames", type=int, default=36, help="Frames of the volume rendering benchmarks")
+    parser.add_argument("--only", type=str, default=None, help="Comma separated benchmarks to run")
+    parser.add_argument("--no-render", action="store_true", help="Skip the benchmarks that render")
+    parser.add_argument("--session", type=str, default=None, help="Recorded session to replay")
+    parser.add_argument("--output", type=str, default="benchmark.json")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["results"], indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from events import EventBus
+from study import StudyManager
+
+collect_ignore = ["benchmark.py", "load_test.py", "test.py"]
+
+@pytest.fixture
+def study():
+    # A study of its own, so the Slice and EventBus of each test start empty.
+    manager = StudyManager()
+    study = manager.CreateStudy("Test")
+    yield study
+    manager.CloseStudy(study.id)
+    EventBus.instances.pop(study.id, None)
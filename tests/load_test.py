@@ -0,0 +1,105 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from phantom import make_volume
+from tile_server import TileServer
+
+async def request(reader, writer, host: str, target: str, etag: str = None):
+    head = "GET %s HTTP/1.1\r\nHost: %s\r\n" % (target, host)
+    if etag:
+        head += "If-None-Match: %s\r\n" % etag
+    writer.write((head + "\r\n").encode("latin-1"))
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return status, headers, body
+
+async def client(host: str, port: int, shape, requests: int, slab: int, revalidate: bool, latencies: list, seed: int) -> None:
+    """
+    A client scrolling back and forth in a random orientation, as a viewer would.
+    """
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    etags = {}
+    orientation, axis = rng.choice((("AXIAL", 0), ("CORONAL", 1), ("SAGITAL", 2)))
+    slice_number = rng.randrange(shape[axis])
+    for i in range(requests):
+        slice_number = min(max(slice_number + rng.choice((-1, 1)), 0), shape[axis] - 1)
+        target = "/slice/%s/%d.png?slab=%d" % (orientation, slice_number, slab)
+        t0 = time.perf_counter()
+        status, headers, body = await request(reader, writer, host, target, etags.get(target) if revalidate else None)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if status == 200:
+            etags[target] = headers.get("etag")
+    writer.close()
+    await writer.wait_closed()
+
+async def run(args) -> dict:
+    shape = tuple(int(i) for i in args.shape.split(","))
+    server = None
+    if args.port is None:
+        # In process server on a synthetic volume.
+        server = TileServer(make_volume(shape), (0.5, 0.5, 1.0), 1500, -650, args.workers)
+        await server.Start("127.0.0.1", 0)
+        host, port = server.server.sockets[0].getsockname()[:2]
+    else:
+        host, port = args.host, args.port
+        reader, writer = await asyncio.open_connection(host, port)
+        shape = json.loads((await request(reader, writer, host, "/info"))[2])["shape"]
+        writer.close()
+
+    latencies = []
+    t0 = time.perf_counter()
+    await asyncio.gather(
+        *(client(host, port, shape, args.requests, args.slab, args.revalidate, latencies, i) for i in range(args.clients))
+    )
+    elapsed = time.perf_counter() - t0
+
+    latencies = np.array(latencies)
+    report = {
+        "clients": args.clients,
+        "requests": len(latencies),
+        "elapsed_s": elapsed,
+        "requests_per_s": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+    if server is not None:
+        report["server"] = dict(server.stats)
+        await server.Stop()
+        server.Close()
+    return report
+
+def main():
+    parser = ArgumentParser("Tile server load test")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="Port of a running server (default: start one)")
+    parser.add_argument("--shape", type=str, default="128,256,256", help="Volume shape dz,dy,dx")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=50, help="Requests per client")
+    parser.add_argument("--slab", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--revalidate", action="store_true", help="Send If-None-Match for the tiles already seen")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
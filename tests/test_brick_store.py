@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from brick_store import BrickedVolume, create_brick_store
+
+@pytest.fixture
+def matrix():
+    return np.arange(10 * 20 * 30, dtype=np.int16).reshape(10, 20, 30)
+
+@pytest.fixture
+def volume(tmp_path, matrix):
+    path = str(tmp_path / "bricks")
+    create_brick_store(path, matrix, matrix.shape, matrix.dtype, (0.5, 0.5, 2.0), (4, 8, 8), origin=(-10.0, 5.0, 30.0))
+    volume = BrickedVolume(path, max_workers=2)
+    yield volume
+    volume.close()
+
+def wait_for_prefetch(volume):
+    # The prefetch runs on a single worker, so this runs after it.
+    volume.prefetch_executor.submit(lambda: None).result()
+
+def test_slices_match_the_volume(volume, matrix):
+    assert volume.shape == matrix.shape
+    assert volume.spacing == (0.5, 0.5, 2.0)
+    assert volume.origin == (-10.0, 5.0, 30.0)
+    np.testing.assert_array_equal(volume[5], matrix[5])
+    np.testing.assert_array_equal(volume[:, 13:14, :], matrix[:, 13:14, :])
+    np.testing.assert_array_equal(volume[:, :, 29], matrix[:, :, 29])
+    np.testing.assert_array_equal(volume[2:7, 3:17, 5:25], matrix[2:7, 3:17, 5:25])
+
+def test_cache_evicts_the_least_recently_used_brick(volume):
+    volume.cache_size = 2 * volume.brick_size
+    volume.get_brick((0, 0, 0))
+    volume.get_brick((0, 0, 1))
+    # The first brick becomes the most recently used.
+    volume.get_brick((0, 0, 0))
+    volume.get_brick((0, 0, 2))
+    assert list(volume.cache) == [(0, 0, 0), (0, 0, 2)]
+    assert volume.cache_nbytes == 2 * volume.brick_size
+    assert (volume.hits, volume.misses) == (1, 3)
+
+def test_scrolling_prefetches_the_next_layer(volume):
+    volume[0]
+    volume[1]
+    wait_for_prefetch(volume)
+    nbz, nby, nbx = volume.number_of_bricks
+    assert all((1, ky, kx) in volume.cache for ky in range(nby) for kx in range(nbx))
+    assert not any(key[0] == 2 for key in volume.cache)
+
+def test_scrolling_backwards_prefetches_the_previous_layer(volume):
+    volume[:, :, 20]
+    volume[:, :, 19]
+    wait_for_prefetch(volume)
+    nbz, nby, nbx = volume.number_of_bricks
+    assert all((kz, ky, 1) in volume.cache for kz in range(nbz) for ky in range(nby))
+
+def test_preview_is_downsampled(volume, matrix):
+    preview, spacing = volume.get_preview(max_voxels=5 * 10 * 15)
+    np.testing.assert_array_equal(preview, matrix[::2, ::2, ::2])
+    assert spacing == (1.0, 1.0, 4.0)
+
+def test_preview_is_read_once(volume):
+    preview, spacing = volume.get_preview(max_voxels=5 * 10 * 15)
+    volume.bricks = None
+    # Kept from the first call, without reading the bricks again.
+    assert volume.get_preview(max_voxels=5 * 10 * 15)[0] is preview
+
+def test_rewritten_store_drops_the_preview(volume, matrix):
+    preview, spacing = volume.get_preview()
+    volume[4]
+    matrix = matrix[::-1].copy()
+    create_brick_store(volume.path, matrix, matrix.shape, matrix.dtype, volume.spacing, volume.brick_shape)
+    # The modification time of the file may not have changed within its resolution.
+    volume.mtime -= 1
+    np.testing.assert_array_equal(volume.get_preview()[0], matrix)
+    assert volume.cache_nbytes == 0
+    np.testing.assert_array_equal(volume[4], matrix[4])
@@ -0,0 +1,116 @@
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+import cine
+import constants as const
+from cine import CinePlayer
+
+class Interactor:
+    def GetTimerEventId(self):
+        return 1
+
+class Slice:
+    def __init__(self, slices):
+        self.slices = slices
+        self.buffers = []
+
+    def GetNumberOfSlices(self, orientation):
+        return self.slices
+
+    def extract_image_slice(self, orientation, number):
+        return np.full((2, 2), number)
+
+    def SetBufferImage(self, orientation, number, image):
+        self.buffers.append(number)
+
+class Viewer:
+    # The parts of SliceViewer the player uses, recording the frames shown.
+    def __init__(self, slices):
+        self.slice = Slice(slices)
+        self.text_batches = {"AXIAL": None}
+        self.shown = []
+
+    def GetInteractor(self, orientation):
+        return Interactor()
+
+    def SetScrollPosition(self, orientation, number):
+        self.shown.append(number)
+
+    def RenderView(self, orientation):
+        pass
+
+    def UpdateRender(self):
+        pass
+
+class PendingExecutor:
+    # The slices the test did not extract are never ready.
+    def submit(self, *args):
+        return Future()
+
+def extracted(number):
+    future = Future()
+    future.set_result(np.full((2, 2), number))
+    return future
+
+@pytest.fixture
+def player(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(cine.time, "perf_counter", lambda: now[0])
+    viewer = Viewer(slices=5)
+    player = CinePlayer(viewer, "AXIAL", fps=10)
+    player.executor = PendingExecutor()
+    player.text = cine.TextZero()
+    player.timer_id = 1
+    player.position = player.start_position = 0
+    player.start_time = player.last_update_3d = 0.0
+    monkeypatch.setattr(player, "Update3D", lambda: None)
+
+    def tick(t, ready):
+        now[0] = t
+        player.prefetched = {number: extracted(number) for number in ready}
+        player.OnTimer(player.interactor, "TimerEvent")
+    return player, viewer, tick
+
+def test_late_timer_drops_the_frames_in_between(player):
+    player, viewer, tick = player
+    # At 10 fps, slice 3 is due after 0.35 s.
+    tick(0.35, ready=(1, 2, 3))
+    assert viewer.shown == [3]
+    assert viewer.slice.buffers == [3]
+    assert player.dropped == 2
+
+def test_slow_extraction_shows_the_last_slice_ready(player):
+    player, viewer, tick = player
+    tick(0.35, ready=(1,))
+    assert viewer.shown == [1]
+    assert player.dropped == 0
+    # Slice 2 is never shown: when slice 4 is ready the player is past it.
+    tick(0.45, ready=(3, 4))
+    assert viewer.shown == [1, 4]
+    assert player.dropped == 2
+
+def test_no_frame_is_shown_before_a_slice_is_ready(player):
+    player, viewer, tick = player
+    tick(0.05, ready=(1,))
+    tick(0.25, ready=())
+    assert viewer.shown == []
+    assert player.position == 0
+
+def test_playback_loops_over_the_slices(player):
+    player, viewer, tick = player
+    # Position 6 of the 5 slices is slice 1.
+    tick(0.65, ready=(1,))
+    assert viewer.shown == [1]
+    assert player.position == 6
+    tick(0.75, ready=range(5))
+    assert viewer.shown == [1, 2]
+
+def test_fps_is_clamped(player):
+    player, viewer, tick = player
+    player.timer_id = None
+    player.SetFps(1000)
+    assert player.fps == const.CINE_MAX_FPS
+    player.SetFps(0)
+    assert player.fps == const.CINE_MIN_FPS
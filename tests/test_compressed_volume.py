@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from compressed_volume import CompressedVolume, compare_extraction
+from phantom import make_volume
+
+@pytest.fixture
+def matrix():
+    return make_volume((20, 48, 40))
+
+@pytest.fixture
+def volume(matrix):
+    # Bricks that do not divide the volume, so the last ones are padded.
+    volume = CompressedVolume(matrix, (0.7, 0.7, 1.5), brick_shape=(8, 32, 32), max_workers=2)
+    yield volume
+    volume.close()
+
+def test_slices_match_the_matrix(volume, matrix):
+    for z in (0, 7, 8, 19):
+        np.testing.assert_array_equal(volume[z : z + 1], matrix[z : z + 1])
+    for y in (0, 31, 32, 47):
+        np.testing.assert_array_equal(volume[:, y : y + 1, :], matrix[:, y : y + 1, :])
+    for x in (0, 39):
+        np.testing.assert_array_equal(volume[:, :, x : x + 1], matrix[:, :, x : x + 1])
+    np.testing.assert_array_equal(np.asarray(volume), matrix)
+
+def test_slices_after_the_cache_is_cleared(volume, matrix):
+    volume[:, 10:11, :]
+    volume.clear_cache()
+    assert volume.cache_nbytes == 0
+    np.testing.assert_array_equal(volume[:, 10:11, :], matrix[:, 10:11, :])
+
+def test_volume_is_compressed(volume, matrix):
+    assert volume.nbytes == matrix.nbytes
+    assert volume.compressed_nbytes < volume.nbytes
+    assert volume.compression_ratio > 1
+
+def test_compare_extraction_reports_each_orientation(volume, matrix):
+    report = compare_extraction(matrix, volume, repeat=1)
+    assert report["compression_ratio"] == volume.compression_ratio
+    for orientation in ("AXIAL", "CORONAL", "SAGITAL"):
+        assert report[orientation]["compressed_ms"] >= 0
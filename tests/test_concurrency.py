@@ -0,0 +1,63 @@
+import json
+from argparse import ArgumentTypeError
+
+import pytest
+
+import concurrency
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    # Settings of the machine in a file of the test, without $MPR_THREADS.
+    path = tmp_path / "concurrency.json"
+    monkeypatch.setenv(concurrency.SETTINGS_VARIABLE, str(path))
+    monkeypatch.delenv(concurrency.THREADS_VARIABLE, raising=False)
+
+    def write(threads):
+        path.write_text(json.dumps({"threads": threads}))
+    return write
+
+def test_option_comes_before_the_variable_and_the_settings(settings, monkeypatch):
+    settings(2)
+    monkeypatch.setenv(concurrency.THREADS_VARIABLE, "3")
+    assert concurrency.get_configured_threads(5) == 5
+    assert concurrency.get_configured_threads("5") == 5
+    assert concurrency.get_configured_threads() == 3
+    monkeypatch.delenv(concurrency.THREADS_VARIABLE)
+    assert concurrency.get_configured_threads() == 2
+
+def test_nothing_configured(settings):
+    assert concurrency.get_configured_threads() is None
+
+def test_auto_skips_to_the_settings(settings, monkeypatch):
+    monkeypatch.setenv(concurrency.THREADS_VARIABLE, "3")
+    assert concurrency.get_configured_threads("auto") is None
+    settings(2)
+    assert concurrency.get_configured_threads("auto") == 2
+    monkeypatch.setenv(concurrency.THREADS_VARIABLE, "auto")
+    assert concurrency.get_configured_threads() == 2
+    settings("auto")
+    assert concurrency.get_configured_threads() is None
+
+@pytest.mark.parametrize("value", ["abc", "0", "-2", "1.5"])
+def test_invalid_values_are_ignored(settings, monkeypatch, value):
+    assert concurrency.get_configured_threads(value) is None
+    monkeypatch.setenv(concurrency.THREADS_VARIABLE, value)
+    assert concurrency.get_configured_threads() is None
+    settings(value)
+    assert concurrency.get_configured_threads() is None
+    settings(4)
+    assert concurrency.get_configured_threads() == 4
+
+def test_parse_threads():
+    assert concurrency.parse_threads("auto") == "auto"
+    assert concurrency.parse_threads("4") == 4
+    for value in ("abc", "0", "-1", ""):
+        with pytest.raises(ArgumentTypeError):
+            concurrency.parse_threads(value)
+
+def test_peek_threads():
+    assert concurrency.peek_threads(["--threads", "4", "study"]) == 4
+    assert concurrency.peek_threads(["--threads=auto"]) == "auto"
+    assert concurrency.peek_threads(["study"]) is None
+    # The parser of the application reports the invalid value.
+    assert concurrency.peek_threads(["--threads", "abc"]) is None
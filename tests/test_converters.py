@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from vtkmodules.vtkCommonDataModel import vtkPiecewiseFunction
+from vtkmodules.vtkRenderingCore import vtkColorTransferFunction
+
+import converters
+
+@pytest.mark.parametrize("dtype", ["uint8", "uint16"])
+def test_quantize_maps_the_range_to_the_dtype(dtype):
+    matrix = np.random.default_rng(2).integers(-2000, 4000, (11, 8, 9)).astype(np.int16)
+    offset, scale = converters.get_quantization(-1000, 3071, dtype)
+    output = converters.quantize_volume(matrix, offset, scale, dtype, chunk_size=3, max_workers=2)
+    max_value = np.iinfo(dtype).max
+    expected = np.clip(np.floor((matrix.astype(np.float64) - offset) * scale + 0.5), 0, max_value)
+    assert output.dtype == np.dtype(dtype)
+    np.testing.assert_allclose(output, expected, atol=1)
+    # The values out of the range are clamped.
+    assert output[matrix <= -1000].max() == 0
+    assert output[matrix >= 3071].min() == max_value
+
+def test_quantized_range():
+    offset, scale = converters.get_quantization(-1000, 3071, "uint16")
+    assert converters.is_in_quantized_range(-1000, 3071, offset, scale, "uint16")
+    assert not converters.is_in_quantized_range(-1024, 3071, offset, scale, "uint16")
+
+def test_transfer_function_range_spans_both_functions():
+    color = vtkColorTransferFunction()
+    color.AddRGBPoint(-500, 1, 0, 0)
+    color.AddRGBPoint(1500, 1, 1, 1)
+    opacity = vtkPiecewiseFunction()
+    opacity.AddPoint(-1000, 0)
+    opacity.AddPoint(1000, 1)
+    assert converters.get_transfer_function_range(color, opacity) == (-1000, 1500)
+
+def test_rescaled_transfer_function_matches_on_the_quantised_values():
+    color = vtkColorTransferFunction()
+    color.AddRGBPoint(-1000, 0, 0, 0)
+    color.AddRGBPoint(200, 1, 0.5, 0)
+    color.AddRGBPoint(3071, 1, 1, 1)
+    opacity = vtkPiecewiseFunction()
+    opacity.AddPoint(-1000, 0)
+    opacity.AddPoint(300, 0.2)
+    opacity.AddPoint(3071, 0.8)
+    gradient = vtkPiecewiseFunction()
+    gradient.AddPoint(0, 0)
+    gradient.AddPoint(100, 1)
+
+    offset, scale = converters.get_quantization(-1000, 3071, "uint16")
+    q_color, q_opacity, q_gradient = converters.rescale_transfer_function(color, opacity, gradient, offset, scale)
+    for value in (-1000, -200, 200, 250, 1000, 3071):
+        q = (value - offset) * scale
+        assert q_color.GetColor(q) == pytest.approx(color.GetColor(value))
+        assert q_opacity.GetValue(q) == pytest.approx(opacity.GetValue(value))
+    # The gradient magnitudes are only scaled, their origin stays at 0.
+    assert q_gradient.GetValue(50 * scale) == pytest.approx(gradient.GetValue(50))
+    # The functions given are left as they were.
+    assert color.GetRange() == (-1000, 3071)
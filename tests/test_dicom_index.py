@@ -0,0 +1,128 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from dicom_index import SeriesCatalogue, parse_header
+
+ROWS, COLUMNS = 4, 6
+
+def element(tag, vr, value, explicit):
+    if isinstance(value, str):
+        value = value.encode()
+        if len(value) % 2:
+            value += b"\0" if vr == "UI" else b" "
+    group, number = tag >> 16, tag & 0xFFFF
+    if not explicit:
+        return struct.pack("<HHI", group, number, len(value)) + value
+    if vr in ("OB", "OW", "SQ", "UN", "UT"):
+        return struct.pack("<HH", group, number) + vr.encode() + b"\0\0" + struct.pack("<I", len(value)) + value
+    return struct.pack("<HH", group, number) + vr.encode() + struct.pack("<H", len(value)) + value
+
+def write_dicom(path, series_uid, z, instance, explicit=True, sequence=False):
+    # A minimal CT slice, with an optional sequence of undefined length before the
+    # attributes of the catalogue.
+    transfer_syntax = "1.2.840.10008.1.2.1" if explicit else "1.2.840.10008.1.2"
+    meta = element(0x00020010, "UI", transfer_syntax, True)
+    meta = element(0x00020000, "UL", struct.pack("<I", len(meta)), True) + meta
+    dataset = element(0x00080018, "UI", "1.2.3.%d" % instance, explicit)
+    if sequence:
+        item = element(0x00081150, "UI", "1.2", explicit)
+        item = struct.pack("<HHI", 0xFFFE, 0xE000, 0xFFFFFFFF) + item + struct.pack("<HHI", 0xFFFE, 0xE00D, 0)
+        header = struct.pack("<HH", 0x0008, 0x1140) + (b"SQ\0\0" if explicit else b"") + struct.pack("<I", 0xFFFFFFFF)
+        dataset += header + item + struct.pack("<HHI", 0xFFFE, 0xE0DD, 0)
+    for tag, vr, value in (
+        (0x00080060, "CS", "CT"),
+        (0x00100010, "PN", "Doe^John"),
+        (0x00100020, "LO", "P1"),
+        (0x00180050, "DS", "2.5"),
+        (0x0020000D, "UI", "9.9"),
+        (0x0020000E, "UI", series_uid),
+        (0x00200013, "IS", str(instance)),
+        (0x00200032, "DS", "-10\\-20\\%g" % z),
+        (0x00200037, "DS", "1\\0\\0\\0\\1\\0"),
+        (0x00280002, "US", struct.pack("<H", 1)),
+        (0x00280004, "CS", "MONOCHROME2"),
+        (0x00280010, "US", struct.pack("<H", ROWS)),
+        (0x00280011, "US", struct.pack("<H", COLUMNS)),
+        (0x00280030, "DS", "0.7\\0.8"),
+        (0x00280100, "US", struct.pack("<H", 16)),
+        (0x00280101, "US", struct.pack("<H", 16)),
+        (0x00280102, "US", struct.pack("<H", 15)),
+        (0x00280103, "US", struct.pack("<H", 1)),
+    ):
+        dataset += element(tag, vr, value, explicit)
+    pixels = np.full(ROWS * COLUMNS, instance, dtype=np.int16).tobytes()
+    dataset += element(0x7FE00010, "OW", pixels, explicit)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\0" * 128 + b"DICM" + meta + dataset)
+
+@pytest.fixture
+def catalogue(tmp_path):
+    catalogue = SeriesCatalogue(str(tmp_path / "series.db"))
+    yield catalogue
+    catalogue.Close()
+
+@pytest.mark.parametrize("explicit", (True, False))
+def test_parse_header(tmp_path, explicit):
+    path = str(tmp_path / "slice")
+    write_dicom(path, "1.2.3.4", 7.5, 3, explicit=explicit, sequence=True)
+    header = parse_header(path)
+    assert header["series_uid"] == "1.2.3.4"
+    assert header["patient_name"] == "Doe^John"
+    assert header["instance_number"] == 3
+    assert header["position"] == [-10.0, -20.0, 7.5]
+    assert header["pixel_spacing"] == [0.7, 0.8]
+    assert (header["rows"], header["columns"]) == (ROWS, COLUMNS)
+
+def test_files_that_are_not_dicom_have_no_header(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("not a DICOM file")
+    assert parse_header(str(path)) is None
+    assert parse_header(str(tmp_path / "missing")) is None
+
+def test_scan_only_parses_the_changed_files(tmp_path, catalogue):
+    root = tmp_path / "study"
+    for instance, z in enumerate((5.0, 0.0, 2.5), 1):
+        write_dicom(str(root / ("f%d" % instance)), "1.2.3.4", z, instance)
+    (root / "notes.txt").write_text("not a DICOM file")
+
+    report = catalogue.Scan(str(root), max_workers=1)
+    assert (report["files"], report["parsed"], report["dicom"]) == (4, 4, 3)
+    assert catalogue.Scan(str(root), max_workers=1)["parsed"] == 0
+
+    os.remove(root / "f1")
+    report = catalogue.Scan(str(root), max_workers=1)
+    assert (report["parsed"], report["removed"]) == (0, 1)
+    [series] = catalogue.GetSeries()
+    assert series["series_uid"] == "1.2.3.4"
+    assert series["files"] == 2
+
+def test_series_files_are_sorted_along_the_normal(tmp_path, catalogue):
+    root = tmp_path / "study"
+    for instance, z in enumerate((5.0, 0.0, 7.5, 2.5), 1):
+        write_dicom(str(root / ("f%d" % instance)), "1.2.3.4", z, instance, explicit=instance % 2 == 0)
+    catalogue.Scan(str(root), max_workers=1)
+    rows = catalogue.GetSeriesFiles("1.2.3.4")
+    assert [row["position_z"] for row in rows] == [0.0, 2.5, 5.0, 7.5]
+    assert catalogue.GetSeriesSpacing("1.2.3.4", rows) == pytest.approx((0.8, 0.7, 2.5))
+    assert catalogue.GetSeriesOrigin("1.2.3.4", rows) == (-10.0, -20.0, 0.0)
+    with pytest.raises(KeyError):
+        catalogue.GetSeriesFiles("5.6")
+
+def test_directory_series_match_the_directory_names_literally(tmp_path, catalogue):
+    # "_" and "%" are wildcards of a LIKE pattern.
+    write_dicom(str(tmp_path / "a_b" / "f"), "1.1", 0, 1)
+    write_dicom(str(tmp_path / "axb" / "f"), "2.2", 0, 1)
+    write_dicom(str(tmp_path / "c%" / "f"), "3.3", 0, 1)
+    write_dicom(str(tmp_path / "cd" / "f"), "4.4", 0, 1)
+    catalogue.Scan(str(tmp_path), max_workers=1)
+    assert catalogue.GetDirectorySeries(str(tmp_path / "a_b")) == ["1.1"]
+    assert catalogue.GetDirectorySeries(str(tmp_path / "c%")) == ["3.3"]
+    assert sorted(catalogue.GetDirectorySeries(str(tmp_path))) == ["1.1", "2.2", "3.3", "4.4"]
+
+    # Re-scanning a_b does not remove the files of axb.
+    assert catalogue.Scan(str(tmp_path / "a_b"), max_workers=1)["removed"] == 0
+    assert len(catalogue.GetSeries()) == 4
@@ -0,0 +1,73 @@
+import pytest
+
+from events import Event, EventBus
+
+@pytest.fixture
+def bus(study):
+    return EventBus()
+
+def hold_flush(bus):
+    # As if the flush timer was already pending: the posted events wait for Flush.
+    bus.timer_id = -1
+
+def test_post_without_an_interactor_dispatches_right_away(bus):
+    calls = []
+    bus.Subscribe(Event.UPDATE_MPR, lambda: calls.append("mpr"))
+    bus.Post(Event.UPDATE_MPR)
+    assert calls == ["mpr"]
+
+def test_posted_events_are_merged(bus):
+    calls = []
+    bus.Subscribe(Event.UPDATE_SLICE_3D, lambda orientations: calls.append(("slice", orientations)))
+    bus.Subscribe(Event.SET_CROSS_FOCAL_POINT, lambda position: calls.append(("cross", position)))
+    hold_flush(bus)
+    bus.Post(Event.SET_CROSS_FOCAL_POINT, position=(1, 2, 3))
+    bus.Post(Event.UPDATE_SLICE_3D, orientations=["AXIAL"])
+    bus.Post(Event.UPDATE_SLICE_3D, orientations=["CORONAL", "AXIAL"])
+    bus.Post(Event.SET_CROSS_FOCAL_POINT, position=(4, 5, 6))
+    assert calls == []
+
+    bus.Flush()
+    # Once each, in the order they were first posted: the union of the orientations and
+    # the last position.
+    assert calls == [("cross", (4, 5, 6)), ("slice", ["AXIAL", "CORONAL"])]
+    assert bus.stats["posted"] == 4
+    assert bus.stats["merged"] == 2
+    assert bus.stats["dispatched"] == 2
+
+def test_merging_does_not_change_the_posted_lists(bus):
+    bus.Subscribe(Event.UPDATE_SLICE_3D, lambda orientations: None)
+    hold_flush(bus)
+    orientations = ["AXIAL"]
+    bus.Post(Event.UPDATE_SLICE_3D, orientations=orientations)
+    bus.Post(Event.UPDATE_SLICE_3D, orientations=["SAGITAL"])
+    assert orientations == ["AXIAL"]
+
+def test_events_posted_by_the_handlers_wait_for_the_next_flush(bus):
+    calls = []
+
+    def on_update_mpr():
+        calls.append("mpr")
+        bus.Post(Event.UPDATE_VOLUME)
+
+    bus.Subscribe(Event.UPDATE_MPR, on_update_mpr)
+    bus.Subscribe(Event.UPDATE_VOLUME, lambda: calls.append("volume"))
+    hold_flush(bus)
+    bus.Post(Event.UPDATE_MPR)
+    bus.Flush()
+    assert calls == ["mpr"]
+    bus.Flush()
+    assert calls == ["mpr", "volume"]
+
+def test_send_dispatches_right_away(bus):
+    calls = []
+    bus.Subscribe(Event.UPDATE_VOLUME, lambda: calls.append("volume"))
+    hold_flush(bus)
+    bus.Send(Event.UPDATE_VOLUME)
+    assert calls == ["volume"]
+
+def test_wrong_arguments_are_rejected(bus):
+    with pytest.raises(TypeError):
+        bus.Post(Event.UPDATE_SLICE_3D, position=(0, 0, 0))
+    with pytest.raises(TypeError):
+        bus.Send(Event.UPDATE_MPR, orientations=["AXIAL"])
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from fusion import FusionLayer, make_lut
+
+def ramp(shape):
+    # Values linear in the voxel position, which the trilinear interpolation keeps.
+    z, y, x = np.meshgrid(*(np.arange(n) for n in shape), indexing="ij")
+    return (100 * z + 10 * y + x).astype(np.float32)
+
+def test_same_grid_gives_the_primary_slices():
+    matrix = ramp((6, 7, 8))
+    layer = FusionLayer(matrix, (1.0, 1.0, 1.0), window=(0, 1000))
+    shape, spacing = matrix.shape, (1.0, 1.0, 1.0)
+    np.testing.assert_allclose(layer.ResampleSlice("AXIAL", 3, shape, spacing), matrix[3])
+    np.testing.assert_allclose(layer.ResampleSlice("CORONAL", 2, shape, spacing), matrix[:, 2, :])
+    np.testing.assert_allclose(layer.ResampleSlice("SAGITAL", 5, shape, spacing), matrix[:, :, 5])
+
+def test_resampled_onto_a_finer_grid():
+    matrix = ramp((4, 5, 6))
+    layer = FusionLayer(matrix, (2.0, 2.0, 2.0), window=(0, 1000))
+    values = layer.ResampleSlice("AXIAL", 3, (7, 9, 11), (1.0, 1.0, 1.0))
+    y, x = np.meshgrid(np.arange(9) / 2, np.arange(11) / 2, indexing="ij")
+    np.testing.assert_allclose(values, 100 * 1.5 + 10 * y + x, rtol=1e-6)
+
+def test_outside_of_the_secondary_volume():
+    matrix = ramp((4, 4, 4))
+    # The secondary volume starts 2 mm to the right of the primary one.
+    layer = FusionLayer(matrix, (1.0, 1.0, 1.0), origin=(2.0, 0.0, 0.0), window=(0, 1000))
+    values = layer.ResampleSlice("AXIAL", 1, (4, 4, 8), (1.0, 1.0, 1.0))
+    assert np.isnan(values[:, :2]).all()
+    assert np.isnan(values[:, 6:]).all()
+    np.testing.assert_allclose(values[:, 2:6], matrix[1])
+    # A slice that misses the secondary volume is not resampled.
+    assert layer.ResampleSlice("SAGITAL", 7, (4, 4, 8), (1.0, 1.0, 1.0)) is None
+
+def test_blend_caches_the_resampled_slices():
+    matrix = ramp((4, 4, 4))
+    layer = FusionLayer(matrix, (1.0, 1.0, 1.0), window=(0, 400))
+    n_rgb = np.zeros((16, 3), dtype=np.uint8)
+    opaque = layer.Blend(n_rgb, "AXIAL", 2, matrix.shape, (1.0, 1.0, 1.0), 1.0)
+    half = layer.Blend(n_rgb, "AXIAL", 2, matrix.shape, (1.0, 1.0, 1.0), 0.5)
+    assert len(layer.samples) == 1
+    lut = make_lut("hot")
+    np.testing.assert_array_equal(opaque[0], np.rint(lut[int((200 - 0) * 255 / 400)]))
+    np.testing.assert_allclose(half, opaque / 2, atol=1)
+    # A new window colours the slices again without resampling them.
+    layer.SetWindow(0, 1000)
+    assert not layer.layers and len(layer.samples) == 1
+
+def test_below_the_window_the_primary_shows_through():
+    matrix = np.full((2, 2, 2), -100, dtype=np.int16)
+    layer = FusionLayer(matrix, (1.0, 1.0, 1.0), window=(0, 100))
+    n_rgb = np.full((4, 3), 50, dtype=np.uint8)
+    np.testing.assert_array_equal(layer.Blend(n_rgb, "AXIAL", 0, matrix.shape, (1.0, 1.0, 1.0), 1.0), n_rgb)
+
+@pytest.mark.parametrize("name", ["hot", "rainbow", "gray"])
+def test_lut_spans_its_points(name):
+    lut = make_lut(name)
+    assert lut.shape == (256, 3)
+    assert lut.min() >= 0 and lut.max() <= 255
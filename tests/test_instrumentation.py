@@ -0,0 +1,75 @@
+import json
+
+import numpy as np
+import pytest
+
+import instrumentation
+from instrumentation import BUCKETS_PER_DECADE, Histogram
+
+# Relative width of a bucket, the error bound of the percentiles.
+BUCKET_ERROR = 10 ** (1 / BUCKETS_PER_DECADE) - 1
+
+@pytest.fixture
+def enabled():
+    was_enabled = instrumentation.is_enabled()
+    instrumentation.reset()
+    instrumentation.enable(True)
+    yield
+    instrumentation.enable(was_enabled)
+    instrumentation.reset()
+
+def test_percentiles_are_within_a_bucket():
+    samples = np.random.default_rng(0).lognormal(mean=1.0, sigma=1.0, size=10000)
+    histogram = Histogram()
+    for value in samples:
+        histogram.add(value)
+    for p in (50, 90, 95, 99):
+        exact = np.percentile(samples, p)
+        assert histogram.percentile(p) == pytest.approx(exact, rel=BUCKET_ERROR)
+    assert histogram.count == len(samples)
+    assert histogram.mean == pytest.approx(samples.mean())
+
+def test_percentiles_are_clamped_to_the_samples():
+    histogram = Histogram()
+    for value in (2.0, 2.0, 2.0):
+        histogram.add(value)
+    assert histogram.percentile(0) == 2.0
+    assert histogram.percentile(100) == 2.0
+    # Out of the range of the buckets, they go to the first and the last one.
+    histogram.add(0.0)
+    histogram.add(1e9)
+    assert histogram.percentile(0) == instrumentation.MIN_TIME_MS
+    assert histogram.percentile(100) == 1e9
+
+def test_empty_histogram():
+    histogram = Histogram()
+    assert histogram.percentile(50) == 0.0
+    assert histogram.to_dict()["min_ms"] == 0.0
+
+def test_timers_record_only_when_enabled(enabled):
+    @instrumentation.timed("work")
+    def work():
+        return 1
+
+    assert work() == 1
+    with instrumentation.stage("block"):
+        pass
+    instrumentation.enable(False)
+    work()
+    with instrumentation.stage("block"):
+        pass
+    stages = instrumentation.get_report()["stages"]
+    assert stages["work"]["count"] == 1
+    assert stages["block"]["count"] == 1
+
+def test_frames_and_dump(enabled, tmp_path):
+    for i in range(3):
+        instrumentation.frame()
+    instrumentation.record("render", 5.0)
+    path = tmp_path / "profile.json"
+    instrumentation.dump(str(path))
+    report = json.loads(path.read_text())
+    assert report["frames"] == 3
+    assert report["stages"]["frame interval"]["count"] == 2
+    assert report["stages"]["render"]["p50_ms"] == 5.0
+    assert "render" in instrumentation.format_report()
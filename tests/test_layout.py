@@ -0,0 +1,54 @@
+import pytest
+from vtkmodules.vtkInteractionStyle import vtkInteractorStyleUser
+from vtkmodules.vtkRenderingCore import vtkRenderer
+
+from layout import ViewportLayout
+
+@pytest.fixture
+def layout():
+    # The window is never shown, its size is enough to route the events.
+    layout = ViewportLayout("2x2", viewport_size=100)
+    styles = {}
+    for view in ("AXIAL", "CORONAL", "SAGITAL", "VOLUME"):
+        layout.AddViewport(view, vtkRenderer())
+        styles[view] = vtkInteractorStyleUser()
+        layout.SetViewportStyle(view, styles[view])
+    return layout, styles
+
+def send(layout, event, x, y):
+    layout.interactor.SetEventInformation(x, y)
+    layout.interactor.InvokeEvent(event)
+
+def test_viewports_follow_the_grid(layout):
+    layout, styles = layout
+    # Row 0 is at the top, VTK display coordinates start at the bottom.
+    assert layout.GetViewportAt(10, 190) is layout.renderers["AXIAL"]
+    assert layout.GetViewportAt(190, 190) is layout.renderers["CORONAL"]
+    assert layout.GetViewportAt(10, 10) is layout.renderers["SAGITAL"]
+    assert layout.GetViewportAt(190, 10) is layout.renderers["VOLUME"]
+    assert layout.GetViewportAt(250, 10) is None
+
+def test_pointer_selects_the_style_of_its_viewport(layout):
+    layout, styles = layout
+    send(layout, "MouseMoveEvent", 190, 10)
+    assert layout.interactor.GetInteractorStyle() is styles["VOLUME"]
+    send(layout, "MouseMoveEvent", 10, 190)
+    assert layout.interactor.GetInteractorStyle() is styles["AXIAL"]
+
+def test_drag_stays_in_the_viewport_where_it_started(layout):
+    layout, styles = layout
+    send(layout, "MouseMoveEvent", 10, 190)
+    send(layout, "LeftButtonPressEvent", 10, 190)
+    send(layout, "MouseMoveEvent", 190, 10)
+    assert layout.interactor.GetInteractorStyle() is styles["AXIAL"]
+    send(layout, "LeftButtonReleaseEvent", 190, 10)
+    send(layout, "MouseMoveEvent", 190, 10)
+    assert layout.interactor.GetInteractorStyle() is styles["VOLUME"]
+
+def test_only_the_modified_views_are_drawn(layout):
+    layout, styles = layout
+    assert len(layout.GetModifiedViews()) == 4
+    layout.OnEndRender(layout.render_window, "EndEvent")
+    assert layout.GetModifiedViews() == []
+    layout.renderers["CORONAL"].GetActiveCamera().Azimuth(10)
+    assert layout.GetModifiedViews() == ["CORONAL"]
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import measures
+from measures import SummedAreaTable
+
+@pytest.fixture
+def image():
+    return np.random.default_rng(0).integers(-1000, 3000, (37, 53)).astype(np.int16)
+
+def test_summed_area_table_matches_the_rectangle_sums(image):
+    sat = SummedAreaTable(image)
+    for x0, y0, x1, y1 in ((0, 0, 52, 36), (3, 5, 20, 30), (10, 10, 10, 10), (0, 36, 52, 36)):
+        view = image[y0 : y1 + 1, x0 : x1 + 1].astype(np.float64)
+        n, s, s2 = sat.rectangle_sums(x0, y0, x1, y1)
+        assert n == view.size
+        assert s == pytest.approx(view.sum())
+        assert s2 == pytest.approx((view**2).sum())
+
+def test_rectangle_stats_clips_to_the_image(image):
+    sat = SummedAreaTable(image)
+    # Corners in any order, partly outside of the image.
+    stats = measures.rectangle_stats(image, sat, (60, 20), (40, -5))
+    view = image[0:21, 40:53].astype(np.float64)
+    assert stats["n"] == view.size
+    assert stats["mean"] == pytest.approx(view.mean())
+    assert stats["std"] == pytest.approx(view.std())
+    assert stats["min"] == view.min()
+    assert stats["max"] == view.max()
+
+def test_rectangle_outside_the_image_has_no_stats(image):
+    sat = SummedAreaTable(image)
+    assert measures.rectangle_stats(image, sat, (60, 0), (70, 10)) is None
+    assert measures.clip_rectangle(image.shape, (-10, -10), (-1, -1)) is None
+
+def test_ellipse_stats_only_count_the_pixels_inside():
+    image = np.zeros((21, 21), dtype=np.int16)
+    image[10, 10] = 100
+    stats = measures.ellipse_stats(image, (0, 0), (20, 20))
+    # The corners of the bounding box are outside of the circle.
+    assert stats["n"] < 21 * 21
+    assert stats["n"] == pytest.approx(np.pi * 10 * 10, rel=0.05)
+    assert stats["max"] == 100
+    assert stats["mean"] == pytest.approx(100 / stats["n"])
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+import utils
+from brick_store import BrickedVolume, create_brick_store
+from memory import MemoryManager
+from project import Project
+from slice_ import Slice
+from study import StudyManager
+
+def make_manager(budget):
+    # A manager of its own instead of the process wide one.
+    manager = MemoryManager.__new__(MemoryManager)
+    manager.__init__(budget)
+    return manager
+
+def register(manager, study_id, name, size):
+    cache = {"size": size}
+    manager.RegisterCache(study_id, name, lambda: cache["size"], lambda: cache.update(size=0))
+    return cache
+
+@pytest.fixture
+def manager():
+    manager = make_manager(100)
+    caches = {
+        (1, "a"): register(manager, 1, "a", 30),
+        (1, "b"): register(manager, 1, "b", 50),
+        (2, "a"): register(manager, 2, "a", 40),
+        (3, "a"): register(manager, 3, "a", 60),
+    }
+    for study_id in (1, 2, 3):
+        manager.Touch(study_id)
+    return manager, caches
+
+def test_within_the_budget_nothing_is_evicted(manager):
+    manager, caches = manager
+    manager.budget = 1000
+    manager.Enforce()
+    assert manager.evictions == 0
+    assert manager.GetTotalUsage() == 180
+
+def test_least_recently_viewed_study_is_evicted_first(manager):
+    manager, caches = manager
+    manager.Enforce()
+    # The caches of study 1, the oldest, largest first, until within the budget.
+    assert caches[(1, "b")]["size"] == 0
+    assert caches[(1, "a")]["size"] == 0
+    assert caches[(2, "a")]["size"] == 40
+    assert manager.evictions == 2
+    assert manager.GetTotalUsage() == 100
+
+def test_eviction_stops_within_the_budget(manager):
+    manager, caches = manager
+    manager.budget = 130
+    manager.Enforce()
+    assert caches[(1, "b")]["size"] == 0
+    assert caches[(1, "a")]["size"] == 30
+    assert manager.evictions == 1
+
+def test_most_recently_viewed_study_is_never_evicted(manager):
+    manager, caches = manager
+    manager.budget = 10
+    manager.Touch(1)
+    manager.Enforce()
+    assert caches[(2, "a")]["size"] == 0
+    assert caches[(3, "a")]["size"] == 0
+    # Still over the budget, but study 1 is on screen.
+    assert caches[(1, "a")]["size"] == 30
+    assert caches[(1, "b")]["size"] == 50
+
+def test_unregistered_study_is_not_counted(manager):
+    manager, caches = manager
+    manager.UnregisterStudy(3)
+    assert manager.GetTotalUsage() == 120
+    assert 3 not in manager.GetUsage()
+
+def test_study_singletons_are_kept_per_study(study):
+    slice, project = Slice(), Project()
+    assert Slice() is slice
+    assert utils.get_topic("Load mpr") == "Load mpr [%d]" % study.id
+    assert study.slice is slice and study.project is project
+
+    StudyManager().GetStudy(utils.DEFAULT_STUDY).Activate()
+    assert Slice() is not slice
+    assert utils.get_topic("Load mpr") == "Load mpr"
+    study.Activate()
+    assert Slice() is slice
+
+def test_closed_study_releases_its_objects():
+    manager = StudyManager()
+    study = manager.CreateStudy()
+    Slice()
+    manager.CloseStudy(study.id)
+    assert utils.get_active_study() == utils.DEFAULT_STUDY
+    assert study.id not in Slice.instances
+    assert study.id not in MemoryManager().caches
+
+def test_slice_registers_the_preview_of_a_bricked_volume(study, tmp_path):
+    matrix = np.zeros((8, 16, 16), dtype=np.int16)
+    path = str(tmp_path / "bricks")
+    create_brick_store(path, matrix, matrix.shape, matrix.dtype, brick_shape=(4, 8, 8))
+    slice = Slice()
+    slice.matrix = BrickedVolume(path)
+    slice.GetVolumeMatrix()
+    usage = MemoryManager().GetUsage()[study.id]
+    assert usage["volume preview"] == matrix.nbytes
+    assert usage["volume cache"] == 0
+
+    cache = MemoryManager().caches[study.id]["volume preview"]
+    cache.evict()
+    assert cache.get_size() == 0
+    slice.matrix.close()
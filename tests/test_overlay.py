@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from vtkmodules.vtkRenderingCore import vtkRenderer
+
+from overlay import CrossOverlay, TextBatch
+from vtk_utils import TextZero
+
+def test_cross_lines_go_through_the_focal_point():
+    cross = CrossOverlay([(0, 0, 255), (0, 255, 0), (255, 0, 0)])
+    cross.SetModelBounds((0, 100, 0, 50, 0, 10))
+    cross.SetFocalPoint((20, 30, 5))
+    points = cross.n_points
+    # The line along each axis spans the bounds and passes through the focal point.
+    assert points[0].tolist() == [0, 30, 5] and points[1].tolist() == [100, 30, 5]
+    assert points[2].tolist() == [20, 0, 5] and points[3].tolist() == [20, 50, 5]
+    assert points[4].tolist() == [20, 30, 0] and points[5].tolist() == [20, 30, 10]
+    assert cross.polydata.GetPoints().GetPoint(1) == (100.0, 30.0, 5.0)
+
+def test_cross_focal_point_stays_in_the_bounds():
+    cross = CrossOverlay([(0, 0, 255), (0, 255, 0), (255, 0, 0)])
+    cross.SetModelBounds((0, 100, 0, 50, 0, 10))
+    cross.SetFocalPoint((-5, 80, 5))
+    assert cross.GetFocalPoint() == (0.0, 50.0, 5.0)
+
+def make_text(position, value):
+    text = TextZero()
+    text.SetPosition(position)
+    text.SetValue(value)
+    return text
+
+@pytest.fixture
+def batch():
+    # Composed without a window, at the size of a viewport.
+    batch = TextBatch(vtkRenderer())
+    batch.size = (200, 100)
+    texts = [make_text((0.05, 0.95), "WL: 40 WW: 400"), make_text((0.05, 0.3), "12/240")]
+    for text in texts:
+        batch.Add(text)
+    batch.Compose()
+    return batch, texts
+
+def full_composition(batch):
+    batch.canvas = None
+    batch.Compose()
+    return batch.canvas.copy()
+
+def drawn(canvas, box):
+    x0, y0, x1, y1 = box
+    return canvas[max(y0, 0) : y1, max(x0, 0) : x1, 3].any()
+
+def test_texts_are_drawn_at_their_position(batch):
+    batch, (top, bottom) = batch
+    assert drawn(batch.canvas, batch.GetBox(*batch.placements[top]))
+    assert drawn(batch.canvas, batch.GetBox(*batch.placements[bottom]))
+    # Row 0 of the canvas is the bottom of the view.
+    assert batch.placements[top][2] > batch.placements[bottom][2]
+    assert not batch.IsModified()
+
+def test_change_blends_only_the_box_of_the_text(batch):
+    batch, (top, bottom) = batch
+    # A mark over the other text stays if its box is not drawn again.
+    x0, y0, x1, y1 = batch.GetBox(*batch.placements[top])
+    batch.canvas[y0:y1, x0:x1] = 7
+
+    bottom.SetValue("13/240")
+    assert batch.IsModified()
+    batch.Compose()
+    assert (batch.canvas[y0:y1, x0:x1] == 7).all()
+    # The rest is as if the canvas was composed again.
+    incremental = batch.canvas.copy()
+    np.testing.assert_array_equal(incremental[:y0], full_composition(batch)[:y0])
+
+def test_overlapping_texts_are_blended_again_in_order(batch):
+    batch, (top, bottom) = batch
+    bottom.SetPosition(top.position)
+    batch.Compose()
+    np.testing.assert_array_equal(batch.canvas, full_composition(batch))
+    top.SetValue("WL: 50 WW: 350")
+    batch.Compose()
+    np.testing.assert_array_equal(batch.canvas, full_composition(batch))
+
+def test_hidden_and_removed_texts_are_erased(batch):
+    batch, (top, bottom) = batch
+    box = batch.GetBox(*batch.placements[bottom])
+    bottom.actor.VisibilityOff()
+    batch.Compose()
+    assert not drawn(batch.canvas, box)
+
+    bottom.actor.VisibilityOn()
+    batch.Compose()
+    assert drawn(batch.canvas, box)
+    batch.Remove(bottom)
+    batch.Compose()
+    assert not drawn(batch.canvas, box)
+    assert drawn(batch.canvas, batch.GetBox(*batch.placements[top]))
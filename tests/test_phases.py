@@ -0,0 +1,39 @@
+import threading
+
+import numpy as np
+import pytest
+
+from slice_ import Slice
+
+@pytest.fixture
+def slice(study):
+    slice = Slice()
+    phases = np.arange(3 * 4 * 5 * 6, dtype=np.int16).reshape(3, 4, 5, 6)
+    slice.SetPhases(phases, (1.0, 1.0, 2.0))
+    yield slice
+    slice.phase_executor.shutdown(wait=True, cancel_futures=True)
+
+def test_neighbouring_phases_are_prefetched(slice):
+    slice.PrefetchPhases("AXIAL", 2)
+    slice.phase_executor.submit(lambda: None).result()
+    for phase in (1, 2):
+        assert np.array_equal(slice.GetPrefetchedImage("AXIAL", phase, 2), slice.phases[phase, 2])
+    assert slice.GetPrefetchedImage("AXIAL", 0, 2) is None
+
+def test_new_phases_drop_the_previous_prefetch(slice):
+    # The worker is held, so the prefetch is queued when the phases are replaced.
+    release = threading.Event()
+    slice.phase_executor.submit(release.wait)
+    slice.PrefetchPhases("AXIAL", 2)
+    old = list(slice.phase_prefetched.values())
+
+    slice.SetPhases(np.zeros((2, 4, 5, 6), dtype=np.int16), (1.0, 1.0, 2.0))
+    release.set()
+    assert all(future.cancelled() for future in old)
+    assert slice.phase_prefetched == {}
+
+def test_extraction_of_replaced_phases_is_dropped(slice):
+    generation = slice.phase_generation
+    assert slice.extract_phase_slice(generation, "AXIAL", 1, slice.phases[1]) is not None
+    slice.SetPhases(np.zeros((2, 4, 5, 6), dtype=np.int16), (1.0, 1.0, 2.0))
+    assert slice.extract_phase_slice(generation, "AXIAL", 1, slice.phases[1]) is None
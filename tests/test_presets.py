@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from vtkmodules.vtkCommonDataModel import vtkPiecewiseFunction
+from vtkmodules.vtkRenderingCore import vtkColorTransferFunction, vtkVolumeProperty
+
+import presets
+
+def test_simplify_drops_the_points_on_the_line():
+    points = [[0, 0], [1, 0.5], [2, 1], [3, 1], [4, 0]]
+    assert presets.simplify_points(points) == [[0, 0], [2, 1], [3, 1], [4, 0]]
+    # Steps keep both points.
+    assert presets.simplify_points([[0, 0], [1, 0], [1, 1], [2, 1]]) == [[0, 0], [1, 0], [1, 1], [2, 1]]
+
+def test_constant_gradient_opacity_is_folded_into_the_opacity():
+    preset = {"colour": [[0, 0, 0, 0], [100, 1, 1, 1]], "opacity": [[0, 0], [100, 0.8]], "gradient_opacity": [[0, 0.5], [255, 0.5]]}
+    analysed = presets.analyse_preset(preset)
+    assert analysed["gradient_opacity"] is None
+    assert analysed["opacity"] == [[0, 0], [100, 0.4]]
+    # The lighting defaults are filled in, without changing the preset.
+    assert analysed["shade"] == presets.LIGHTING["shade"]
+    assert preset["gradient_opacity"] == [[0, 0.5], [255, 0.5]]
+
+def test_varying_gradient_opacity_is_kept():
+    preset = {"colour": [[0, 0, 0, 0], [100, 1, 1, 1]], "opacity": [[0, 0], [100, 1]], "gradient_opacity": [[0, 0], [50, 0.5], [100, 1]]}
+    analysed = presets.analyse_preset(preset)
+    assert analysed["gradient_opacity"] == [[0, 0], [100, 1]]
+    assert analysed["opacity"] == [[0, 0], [100, 1]]
+
+@pytest.mark.parametrize("name", sorted(presets.PRESETS))
+def test_fill_transfer_function(name):
+    preset = presets.analyse_preset(presets.PRESETS[name])
+    scalar_color = vtkColorTransferFunction()
+    scalar_opacity = vtkPiecewiseFunction()
+    gradient_opacity = vtkPiecewiseFunction()
+    # The points of the previous preset are replaced.
+    scalar_opacity.AddPoint(-5000, 1)
+    presets.fill_transfer_function(preset, scalar_color, scalar_opacity, gradient_opacity)
+    assert scalar_color.GetSize() == len(preset["colour"])
+    assert scalar_opacity.GetSize() == len(preset["opacity"])
+    x, value = preset["opacity"][-1]
+    assert scalar_opacity.GetValue(x) == pytest.approx(value)
+    x, r, g, b = preset["colour"][0]
+    assert scalar_color.GetColor(x) == pytest.approx((r, g, b))
+    assert gradient_opacity.GetSize() == len(preset["gradient_opacity"] or [[0, 1], [255, 1]])
+
+def test_lighting_disables_the_folded_gradient_opacity():
+    volume_properties = vtkVolumeProperty()
+    presets.apply_lighting(presets.analyse_preset(presets.PRESETS["bone"]), volume_properties)
+    assert volume_properties.GetDisableGradientOpacity()
+    assert volume_properties.GetShade()
+
+def test_load_presets_validates_the_points(tmp_path):
+    (tmp_path / "unsorted.json").write_text(json.dumps({"colour": [[10, 0, 0, 0], [0, 1, 1, 1]], "opacity": [[0, 0], [10, 1]]}))
+    with pytest.raises(ValueError):
+        presets.load_presets(str(tmp_path))
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+import resample
+
+def test_resampled_shape_keeps_the_extent():
+    assert resample.get_resampled_shape((10, 20, 30), (0.5, 0.5, 2.0), (0.5, 0.5, 0.5)) == (37, 20, 30)
+    assert resample.get_resampled_shape((10, 20, 30), (1.0, 1.0, 1.0), (2.0, 2.0, 2.0)) == (5, 10, 15)
+
+def test_resample_interpolates_linearly():
+    z, y, x = np.meshgrid(np.arange(9), np.arange(10), np.arange(11), indexing="ij")
+    matrix = (100 * z + 10 * y + x).astype(np.float32)
+    output = resample.resample_volume(matrix, (1.0, 1.0, 2.0), (0.5, 0.5, 1.0), chunk_size=3)
+    assert output.shape == (17, 19, 21)
+    z, y, x = np.meshgrid(np.arange(17) / 2, np.arange(19) / 2, np.arange(21) / 2, indexing="ij")
+    np.testing.assert_allclose(output, 100 * z + 10 * y + x, rtol=1e-6)
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 7, 1000])
+def test_resample_does_not_depend_on_the_chunks(chunk_size):
+    matrix = np.random.default_rng(0).integers(-1000, 3000, (13, 16, 18)).astype(np.int16)
+    spacing = (0.8, 0.8, 2.5)
+    new_spacing = (0.6, 0.6, 0.6)
+    expected = resample.resample_volume(matrix, spacing, new_spacing, chunk_size=10**6, max_workers=1)
+    output = resample.resample_volume(matrix, spacing, new_spacing, chunk_size=chunk_size, max_workers=3)
+    assert output.dtype == np.int16
+    np.testing.assert_array_equal(output, expected)
+
+def test_resample_to_the_same_spacing_is_the_identity():
+    matrix = np.random.default_rng(1).integers(-1000, 3000, (5, 6, 7)).astype(np.int16)
+    np.testing.assert_array_equal(resample.resample_volume(matrix, (1.0, 1.0, 1.0), (1.0, 1.0, 1.0)), matrix)
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+from vtkmodules.vtkCommonCore import vtkObject
+from vtkmodules.vtkRenderingCore import vtkRenderWindowInteractor
+
+import scheduler
+from scheduler import MAX_STARVED_TICKS, Task, TaskScheduler
+
+@pytest.fixture
+def tasks():
+    # No worker threads: the tests put the finished tasks in the queue of results.
+    tasks = TaskScheduler(vtkRenderWindowInteractor(), workers=0, budget_ms=10.0)
+    delivered = []
+
+    def complete(name, cost_ms=0.0, takes_ms=0.0):
+        # cost_ms is the estimate of the scheduler, takes_ms the time the handler takes.
+        def callback(result):
+            time.sleep(takes_ms / 1000)
+            delivered.append(result)
+
+        task = Task(None, (), scheduler.PRIORITY_NORMAL, callback, None, name)
+        task.result = name
+        task.done = True
+        tasks.completed.append(task)
+        if cost_ms:
+            tasks.costs[task.kind] = cost_ms
+        return task
+    return tasks, complete, delivered
+
+def test_handlers_within_the_budget_run_in_order(tasks):
+    tasks, complete, delivered = tasks
+    for name in ("a", "b", "c"):
+        complete(name, cost_ms=2.0)
+    tasks.Deliver()
+    assert delivered == ["a", "b", "c"]
+    assert tasks.GetStats()["completed"] == 3
+
+def test_handlers_over_the_rest_of_the_budget_wait_for_the_next_tick(tasks):
+    tasks, complete, delivered = tasks
+    complete("cheap", cost_ms=2.0, takes_ms=3.0)
+    complete("expensive", cost_ms=9.0)
+    tasks.Deliver()
+    assert delivered == ["cheap"]
+    assert tasks.stats["deferred"] == 1
+    tasks.Deliver()
+    assert delivered == ["cheap", "expensive"]
+
+def test_handler_over_the_whole_budget_runs_alone_once_starved(tasks):
+    tasks, complete, delivered = tasks
+    complete("expensive", cost_ms=50.0, takes_ms=20.0)
+    complete("cheap", cost_ms=1.0)
+    for tick in range(MAX_STARVED_TICKS):
+        tasks.Deliver()
+        assert delivered == []
+    tasks.Deliver()
+    assert delivered == ["expensive"]
+    assert tasks.starved_ticks == 0
+    tasks.Deliver()
+    assert delivered == ["expensive", "cheap"]
+
+def test_cancelled_results_are_dropped_without_their_cost(tasks):
+    tasks, complete, delivered = tasks
+    complete("expensive", cost_ms=50.0).Cancel()
+    complete("cheap", cost_ms=1.0)
+    tasks.Deliver()
+    assert delivered == ["cheap"]
+    assert tasks.stats["cancelled"] == 1
+
+def test_cost_of_the_handlers_is_estimated_per_kind(tasks):
+    tasks, complete, delivered = tasks
+    complete("slow", takes_ms=20.0)
+    tasks.Deliver()
+    assert tasks.costs["slow"] >= 20.0
+
+def test_input_of_every_interactor_delays_the_idle_tasks():
+    tasks = TaskScheduler(vtkRenderWindowInteractor(), workers=0)
+    other = vtkRenderWindowInteractor()
+    tasks.AddInputInteractor(other)
+    tasks.AddInputInteractor(other)
+    assert len(tasks.input_interactors) == 2
+    # The interactors are never shown; initializing them without a window warns.
+    warnings = vtkObject.GetGlobalWarningDisplay()
+    vtkObject.GlobalWarningDisplayOff()
+    try:
+        tasks.Start()
+        assert tasks.IsIdle()
+        other.InvokeEvent("MouseMoveEvent")
+        assert not tasks.IsIdle()
+        tasks.Stop()
+    finally:
+        vtkObject.SetGlobalWarningDisplay(warnings)
+    assert tasks.observers == []
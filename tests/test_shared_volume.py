@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import shared_volume
+from slice_ import Slice
+
+@pytest.fixture
+def matrix():
+    return np.random.default_rng(4).integers(-1000, 3000, (40, 6, 7)).astype(np.int16)
+
+def chunk_sum(chunk, z_start, factor):
+    # Task of map_chunks, at the top level so the workers can unpickle it.
+    return z_start, chunk.shape[0], int(chunk.astype(np.int64).sum()) * factor
+
+def test_shared_copy_in_slabs(matrix):
+    shared = shared_volume.share_array(matrix)
+    try:
+        np.testing.assert_array_equal(shared.array, matrix)
+        assert shared_volume.find_shared(shared.array) is shared
+        assert shared_volume.find_shared(matrix) is None
+    finally:
+        shared.Release()
+    assert shared_volume.find_shared(matrix) is None
+
+def test_attached_view_is_read_only(matrix):
+    shared = shared_volume.share_array(matrix)
+    try:
+        descriptor = shared.Describe(spacing=(1.0, 1.0, 2.0))
+        assert descriptor["spacing"] == (1.0, 1.0, 2.0)
+        view = shared_volume.attach(descriptor)
+        np.testing.assert_array_equal(view, matrix)
+        assert not view.flags.writeable
+        # The owner writes, the attached view sees it without a copy.
+        shared.array[0, 0, 0] = 1234
+        assert view[0, 0, 0] == 1234
+    finally:
+        shared.Release()
+
+def test_map_chunks_runs_over_the_axial_chunks_in_order(matrix):
+    shared = shared_volume.share_array(matrix)
+    try:
+        results = shared_volume.map_chunks(chunk_sum, shared.Describe(), 2, chunk_size=16, workers=2)
+    finally:
+        shared.Release()
+    assert [(z, n) for z, n, total in results] == [(0, 16), (16, 16), (32, 8)]
+    assert sum(total for z, n, total in results) == 2 * int(matrix.astype(np.int64).sum())
+
+def test_slice_moves_its_volume_to_shared_memory(study, matrix):
+    slice = Slice()
+    slice.matrix = matrix
+    slice.spacing = (1.0, 1.0, 1.0)
+    assert slice.GetSharedDescriptor() is None
+    slice.ShareVolume()
+    try:
+        descriptor = slice.GetSharedDescriptor()
+        assert descriptor["spacing"] == (1.0, 1.0, 1.0)
+        np.testing.assert_array_equal(shared_volume.attach(descriptor), matrix)
+    finally:
+        shared_volume.find_shared(slice.matrix).Release()
@@ -0,0 +1,79 @@
+import numpy as np
+
+import snapshot
+from brick_store import BrickedVolume, create_brick_store
+from phantom import make_volume
+from project import Project
+from slice_ import Slice
+
+def save_and_restore(slice, directory):
+    project = Project()
+    state = {
+        "version": snapshot.SNAPSHOT_VERSION,
+        "project": {"window_level": project.window_level, "window_width": project.window_width},
+        "volume": snapshot.get_volume_state(slice, directory),
+    }
+    snapshot.write_state(directory, state)
+    # Restored over another project and volume.
+    project.window_level = project.window_width = 0
+    slice.matrix = np.zeros((2, 2, 2), dtype=np.int16)
+    slice.origin = (0.0, 0.0, 0.0)
+    slice.center = [0, 0, 0]
+    return snapshot.restore_study(snapshot.load_snapshot(directory), directory)
+
+def test_volume_round_trip(study, tmp_path):
+    matrix = make_volume((6, 16, 20))
+    slice = Slice()
+    slice.matrix = matrix
+    slice.spacing = (0.5, 0.5, 2.0)
+    slice.origin = (-120.0, -80.0, 35.5)
+    slice.SetSpacing((1.0, 1.0, 1.0))
+    resampled, center = slice.matrix, list(slice.center)
+    Project().window_level = 40
+    Project().window_width = 400
+
+    restored = save_and_restore(slice, str(tmp_path))
+    assert restored is slice
+    assert (Project().window_level, Project().window_width) == (40, 400)
+    np.testing.assert_array_equal(restored.matrix_native, matrix)
+    assert restored.spacing_native == (0.5, 0.5, 2.0)
+    # The resampled volume is restored, not resampled again.
+    np.testing.assert_array_equal(restored.matrix, resampled)
+    assert restored.spacing == (1.0, 1.0, 1.0)
+    assert restored.resampled_matrices[(1.0, 1.0, 1.0)] is restored.matrix
+    assert restored.center == center
+    assert restored.origin == (-120.0, -80.0, 35.5)
+
+def test_snapshot_of_a_restored_volume_is_not_written_again(study, tmp_path):
+    slice = Slice()
+    slice.matrix = make_volume((4, 8, 8))
+    slice.spacing = (1.0, 1.0, 1.0)
+    save_and_restore(slice, str(tmp_path))
+    # The restored volume is mapped from the snapshot and referenced as is.
+    assert isinstance(slice.matrix, np.memmap)
+    mtime = (tmp_path / snapshot.VOLUME_FILENAME).stat().st_mtime_ns
+    snapshot.get_volume_state(slice, str(tmp_path))
+    assert (tmp_path / snapshot.VOLUME_FILENAME).stat().st_mtime_ns == mtime
+
+def test_bricks_round_trip(study, tmp_path):
+    matrix = make_volume((8, 16, 16))
+    path = str(tmp_path / "bricks")
+    create_brick_store(path, matrix, matrix.shape, matrix.dtype, (0.5, 0.5, 1.0), (4, 8, 8), origin=(1.0, 2.0, 3.0))
+    slice = Slice()
+    slice.matrix = BrickedVolume(path)
+    slice.spacing = slice.matrix.spacing
+    slice.origin = slice.matrix.origin
+    preview, spacing = slice.GetVolumeMatrix()
+
+    directory = tmp_path / "snapshot"
+    directory.mkdir()
+    restored = save_and_restore(slice, str(directory))
+    assert isinstance(restored.matrix, BrickedVolume)
+    assert restored.matrix.path == path
+    assert restored.origin == (1.0, 2.0, 3.0)
+    np.testing.assert_array_equal(restored.matrix[3], matrix[3])
+    # The preview of the 3D view is read back instead of the bricks.
+    restored_preview, restored_spacing = restored.GetVolumeMatrix()
+    np.testing.assert_array_equal(restored_preview, preview)
+    assert tuple(restored_spacing) == tuple(spacing)
+    restored.matrix.close()